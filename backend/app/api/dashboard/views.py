@@ -30,11 +30,13 @@ def dashboard():
     proposals = Proposal.query.filter_by(company_id=current_user.company_id)
     clients = Client.query.filter_by(company_id=current_user.company_id)
     users = User.query.filter_by(company_id=current_user.company_id)
+    # Same for every user of the company so only compute it once
+    publish_state = current_user.company.publish_state()
 
     return json_response({
-        "proposals": [x.to_json() for x in proposals],
+        "proposals": Proposal.to_json_many(proposals.all()),
         "clients": [x.to_json() for x in clients],
-        "users": [x.to_json() for x in users],
+        "users": [x.to_json(publish_state=publish_state) for x in users],
         "templates": PROPOSAL_TEMPLATES,
     }, 200)
 
@@ -1,4 +1,6 @@
-from marshmallow import Schema, fields
+from marshmallow import Schema, fields, validate
+
+from ...models.enums import ProposalStatus
 
 
 class BlockSchema(Schema):
@@ -10,6 +12,30 @@ class BlockSchema(Schema):
     version = fields.Integer(required=True)
 
 
+class ChangedBlockSchema(Schema):
+    type = fields.String(required=True)
+    uid = fields.UUID(required=True)
+    data = fields.Dict(required=True)
+    version = fields.Integer(required=True)
+    ordering = fields.Integer(required=True)
+
+
+class MovedBlockSchema(Schema):
+    uid = fields.UUID(required=True)
+    ordering = fields.Integer(required=True)
+
+
+class PatchBlocksSchema(Schema):
+    """
+    Only the blocks that changed since the last save: inserted or edited
+    blocks go in `changed`, blocks that only moved in `moved` and deleted
+    ones in `removed`.
+    """
+    changed = fields.Nested(ChangedBlockSchema, many=True, missing=list)
+    moved = fields.Nested(MovedBlockSchema, many=True, missing=list)
+    removed = fields.List(fields.UUID, missing=list)
+
+
 class StatusSchema(Schema):
     # TODO: add a field type for enum?
     status = fields.String(required=True)
@@ -32,3 +58,12 @@ class UpdateProposalSchema(Schema):
 
 class ImportSectionSchema(Schema):
     uidToImport = fields.UUID(required=True)
+
+
+class ListProposalsSchema(Schema):
+    status = fields.String(required=False, validate=validate.OneOf([x.value for x in ProposalStatus]))
+    tag = fields.String(required=False)
+    client_id = fields.Integer(required=False, load_from="clientId")
+    title = fields.String(required=False)
+    cursor = fields.String(required=False)
+    limit = fields.Integer(missing=50, validate=validate.Range(min=1, max=200))
@@ -1,3 +1,5 @@
+import base64
+import binascii
 import logging
 import datetime
 
@@ -11,37 +13,100 @@ from ..utils import json_response, InvalidAPIRequest
 from ...utils.exceptions import AuthException
 from ...models.blocks import Block
 from ...models.clients import Client
-from ...models.companies import PublishState
+from ...models.companies import Company, PublishState
+from ...models.users import User
 from ...models.enums import ProposalStatus
-from .schemas import StatusSchema, UpdateProposalSchema, ImportSectionSchema
+from ...models.proposals import Proposal
+from .schemas import (
+    StatusSchema, UpdateProposalSchema, ImportSectionSchema, PatchBlocksSchema,
+    ListProposalsSchema,
+)
 from ...decorators import token_required, proposal_owner_required, current_user
 from ...utils.tokens import get_random_string
-from ...utils.search import find
+from ...utils.search import get_backend
 from ...utils.mixpanel import mp
 from . import internal_api
 
-from typing import List
-
 LOG = logging.getLogger(__name__)
 
+CURSOR_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
 
 def get_proposal_data(proposal):
-    tags = [] # type: List[str]
-    for p in proposal.company.proposals.all():
-        tags += p.tags
+    """
+    Everything the editor needs, in a fixed number of queries whatever the
+    number of proposals, users or integrations of the company.
+    """
+    company = Company.get_with_integrations(proposal.company_id)
+    publish_state = company.publish_state()
+    users = User.query.filter_by(company_id=company.id).all()
+    # Loading clients first means `proposal.client` comes from the identity map
+    clients = Client.query.filter_by(company_id=company.id).all()
 
     return {
         "proposal": proposal.to_json(),
-        "users": [u.to_json(get_token=False) for u in proposal.company.users.all()],
+        "users": [u.to_json(get_token=False, publish_state=publish_state) for u in users],
         "blocks": [b.to_json() for b in proposal.blocks.order_by(Block.ordering).all()],
         "client": proposal.client.to_json() if proposal.client_id else {},
-        "clients": [x.to_json() for x in proposal.company.clients.all()],
-        "tags": list(set(tags)),
+        "clients": [x.to_json() for x in clients],
+        "tags": company.get_tags(),
         # "threads": [x.to_json() for x in proposal.comment_threads],
-        "company": proposal.company.to_json(),
+        "company": company.to_json(),
     }
 
 
+def encode_cursor(proposal):
+    """Opaque cursor pointing right after that proposal in the listing"""
+    raw = "{}|{}".format(proposal.updated_at.strftime(CURSOR_DATE_FORMAT), proposal.id)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("utf-8")
+
+
+def decode_cursor(cursor):
+    try:
+        updated_at, proposal_id = base64.urlsafe_b64decode(cursor.encode("utf-8")).decode("utf-8").split("|")
+        return (
+            datetime.datetime.strptime(updated_at, CURSOR_DATE_FORMAT),
+            int(proposal_id),
+        )
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidAPIRequest(payload={"cursor": ["Invalid cursor"]})
+
+
+@api.route("/proposals", methods=["GET"])
+@token_required()
+def list_proposals():
+    """
+    Paginated alternative to the proposals in /dashboard, for big accounts.
+    Pass the `nextCursor` of a response as `cursor` to get the next page.
+    """
+    args, errors = ListProposalsSchema().load(request.args)
+    if errors:
+        raise InvalidAPIRequest(payload=errors)
+
+    after = decode_cursor(args["cursor"]) if args.get("cursor") else None
+    limit = args["limit"]
+    # Fetching one more to know whether there is a next page
+    proposals = Proposal.get_page(
+        current_user.company_id,
+        limit + 1,
+        after=after,
+        status=args.get("status"),
+        tag=args.get("tag"),
+        client_id=args.get("client_id"),
+        title_prefix=args.get("title"),
+    )
+
+    next_cursor = None
+    if len(proposals) > limit:
+        proposals = proposals[:limit]
+        next_cursor = encode_cursor(proposals[-1])
+
+    return json_response({
+        "proposals": Proposal.to_json_many(proposals),
+        "nextCursor": next_cursor,
+    }, 200)
+
+
 @api.route("/proposals", methods=["POST"])
 @token_required()
 def create_empty_proposal():
@@ -96,29 +161,64 @@ def put_proposal(proposal):
 
     # And now blocks saving
     current = set(x[0] for x in proposal.blocks.values(Block.uid))
-    new = set()
-
+    blocks = []
     for i, x in enumerate(data.get("blocks", [])):
-        # str conversion important because set difference will fail otherwise:
-        new.add(str(x["uid"]))
-        db.session.merge(Block(
-            x["type"],
-            x["proposal_id"],
-            uid=str(x["uid"]),
-            version=x["version"],
-            data=x["data"],
-            ordering=i,
-        ))
+        x["ordering"] = i
+        blocks.append(x)
+
+    # str conversion important because set difference will fail otherwise:
+    new = set(str(x["uid"]) for x in blocks)
+    if len(new) != len(blocks):
+        raise InvalidAPIRequest(payload={"blocks": ["Duplicate block uid"]})
+
+    _, conflicts = Block.bulk_upsert(proposal.id, blocks)
+    # Ordering isn't versioned: the position in the list always wins
+    Block.bulk_reorder(proposal.id, [(x["uid"], x["ordering"]) for x in blocks])
 
     # Instead of deleting we set the proposal id to null. block can
-    # then be restored by the merge above. Note that we need to fetch
-    # (synchronize_session=fetch) all data because sqlalchemy isn't
-    # clever enough to figure out what changes with a SQL-only update.
-    removed = current - new
-    if removed:
-        Block.query.filter(Block.uid.in_(removed)).update({"proposal_id": None}, synchronize_session="fetch")
+    # then be restored by the upsert above.
+    Block.bulk_detach(proposal.id, current - new)
 
-    return json_response(get_proposal_data(proposal), 200)
+    proposal_data = get_proposal_data(proposal)
+    proposal_data["conflicts"] = [b.to_json() for b in conflicts]
+    return json_response(proposal_data, 200)
+
+
+@api.route("/proposals/<int:proposal_id>/blocks", methods=["PATCH"])
+@token_required()
+@proposal_owner_required()
+def patch_proposal_blocks(proposal):
+    """
+    Saves only the blocks that changed since the last save. Much cheaper
+    than the full PUT above for big proposals as everything is done in a
+    handful of statements and we don't send the whole proposal back.
+
+    Blocks saved in the meantime by a teammate with a newer version are
+    not overwritten and are sent back in `conflicts` instead.
+    """
+    if proposal.is_signed() or proposal.status == "won":
+        raise InvalidAPIRequest()
+
+    data, errors = PatchBlocksSchema().load(request.json)
+    if errors:
+        raise InvalidAPIRequest(payload=errors)
+
+    changed_uids = [str(x["uid"]) for x in data["changed"]]
+    moved_uids = [str(x["uid"]) for x in data["moved"]]
+    if len(set(changed_uids)) != len(changed_uids) or len(set(moved_uids)) != len(moved_uids):
+        raise InvalidAPIRequest(payload={"blocks": ["Duplicate block uid"]})
+
+    saved, conflicts = Block.bulk_upsert(proposal.id, data["changed"])
+    Block.bulk_reorder(proposal.id, [(x["uid"], x["ordering"]) for x in data["moved"]])
+    Block.bulk_detach(proposal.id, data["removed"])
+    proposal.updated_at = datetime.datetime.utcnow()
+
+    return json_response({
+        "saved": saved + len(moved_uids),
+        "removed": len(data["removed"]),
+        "conflicts": [b.to_json() for b in conflicts],
+        "updatedAt": int(proposal.updated_at.replace(tzinfo=datetime.timezone.utc).timestamp()),
+    }, 200)
 
 
 @api.route("/proposals/<int:proposal_id>/status", methods=["PUT"])
@@ -192,7 +292,7 @@ def duplicate(proposal):
 @token_required()
 def section_search():
     """
-    Query ES for the most likely results
+    Query the search backend for the most likely results
     """
     q = request.args.get("q", "")
     proposal_id = request.args.get("id", "")
@@ -200,16 +300,16 @@ def section_search():
         return json_response({})
 
     results = []
-    for hit in find(q, current_user.company_id, proposal_id):
+    for hit in get_backend().find(q, current_user.company_id, proposal_id):
         summary = ""
-        if "title" in hit.meta.highlight:
+        if "title" in hit.highlight:
             # Repeating the title when finding a title is not very useful
             summary = hit.content
-        elif "content" in hit.meta.highlight:
-            summary = hit.meta.highlight.content[0]
+        elif "content" in hit.highlight:
+            summary = hit.highlight["content"][0]
 
         results.append({
-            "uid": hit.meta.id,
+            "uid": hit.uid,
             "level": hit.level,
             "proposalTitle": hit.proposal_title,
             "title": hit.title,
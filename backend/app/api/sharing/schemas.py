@@ -13,3 +13,9 @@ class SigningSchema(Schema):
     signature = fields.String(required=True)
     user_agent = fields.String(required=True, load_from="userAgent")
 
+
+class AnalyticsEventSchema(Schema):
+    user_uid = fields.UUID(required=True, load_from="userUid")
+    # load | ping | outbound_click
+    kind = fields.String(required=True, validate=validate.Length(max=100))
+    data = fields.Dict(required=True)
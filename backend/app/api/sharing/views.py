@@ -1,25 +1,22 @@
 import logging
-import threading
-import requests
 import datetime
 import calendar
+import gzip
+import hashlib
 import json
 
 from flask import request, current_app
-import geoip2.database
 import stripe
 
 from .. import api_bp as api
 from ...setup import db
-from ...utils import signalling
-from ..utils import json_response, InvalidAPIRequest
+from ...utils import signalling, analytics_ingestion, pdf_prerender
+from ..utils import json_response, InvalidAPIRequest, after_commit
 from ...models.enums import ProposalStatus
-from ...models.shared_blocks import SharedBlock
-from ...models.shared_proposals import SharedProposal, WAW_IPS
+from ...models.shared_proposals import SharedProposal
 from ...models.signatures import Signature
 from ...models.companies import PublishState
-from ...models.analytics import Event
-from .schemas import ShareSchema, SigningSchema
+from .schemas import ShareSchema, SigningSchema, AnalyticsEventSchema
 from ...decorators import (
     token_required, proposal_owner_required, shared_proposal, current_user,
     shared_pages_auth
@@ -39,44 +36,40 @@ def get_share_data(shared, shared_uid):
     if current_user:
         users = [u.to_public_json() for u in current_user.company.users.all()]
 
-    blocks = [b.to_json() for b in shared.blocks.order_by(SharedBlock.ordering).all()]
-    # We use share uid for everything on shared pages
-    for block in blocks:
-        block["proposalId"] = shared_uid
+    # The frozen part comes from the snapshot, only what can change
+    # (comments, signature) is queried
+    snapshot = shared.get_snapshot()
+    shared_json = snapshot["shared"]
+    shared_json["signed"] = shared.signature.count() > 0
+
     return {
-        "blocks": blocks,
+        "blocks": snapshot["blocks"],
         "threads": [c.to_json() for c in shared.comment_threads],
         "users": users,
         "company": shared.proposal.company.to_public_json(),
-        "shared": shared.to_json(),
+        "shared": shared_json,
         "isLatest": SharedProposal.count_versions(shared_uid) - 1 != shared.version
     }
 
 
-def generate_pdf(uid, shared):
-    pdf_renderer_base_url = current_app.config["PDF_RENDERER_BASE_URL"]
-
-    def pregenerate_pdf(base_url, s):
-        try:
-            requests.get("{}/{}/{}".format(base_url, uid, s.version))
-        except Exception as e:
-            logging.warning("pregenerate_pdf failed, ignoring error: %s", e)
-
-    # prefetch and ignore PDF on each share
-    threading.Thread(target=pregenerate_pdf, args=(pdf_renderer_base_url, shared, )).start()
-
-
-ip_db = None
+def get_share_etag(shared, data):
+    """
+    The stored snapshot etag covers the blocks, only what can change
+    (comments, signature, users, latest version) is hashed on top of it
+    """
+    changing = dict(data, blocks=None)
+    raw = json.dumps(changing, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha1(shared.snapshot_etag.encode("utf-8") + raw).hexdigest()
 
 
-@api.before_app_first_request
-def init_geoip_db():
-    global ip_db
-    try:
-        ip_db = geoip2.database.Reader(current_app.config["GEOIP_DATABASE_PATH"])
-        logging.info("loaded %s", ip_db.metadata())
-    except Exception:
-        logging.exception("could not load ip_db")
+def generate_pdf(uid, shared, signed):
+    # prefetch and ignore PDF on each share and signature, once committed
+    # as the renderer reads the shared proposal through the API
+    base_url = current_app.config["PDF_RENDERER_BASE_URL"]
+    version = shared.version
+    after_commit(lambda: pdf_prerender.client.submit(
+        base_url, uid, version, pdf_prerender.SIGNED if signed else pdf_prerender.UNSIGNED,
+    ))
 
 
 @api.route("/proposals/<int:proposal_id>/share", methods=["POST"])
@@ -97,8 +90,9 @@ def share_proposal(proposal):
         return json_response({"publishState": publish_state.value}, 402)
 
     shared2 = proposal.create_shared([]) if shared is None else proposal.create_shared(shared.sent_to)
+    shared2.build_snapshot()
 
-    generate_pdf(proposal.share_uid, shared2)
+    generate_pdf(proposal.share_uid, shared2, signed=False)
     mp.track(current_user.company_id, "Proposal shared")
 
     signalling.SIGNAL.PROPOSAL_PUBLISHED.send(company=proposal.company, payload={ # type: ignore
@@ -171,7 +165,41 @@ def mark_as_sent(proposal):
 @shared_pages_auth()
 def get_shared_proposal(share_uid, shared):
     """This is open to everyone"""
-    return json_response(get_share_data(shared, share_uid), 200)
+    data = get_share_data(shared, share_uid)
+    etag = get_share_etag(shared, data)
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = json_response(data, 200)
+    response.set_etag(etag)
+    return response
+
+
+@api.route("/shared/<string:share_uid>/<int:version>/snapshot", methods=["GET"])
+@shared_proposal()
+def get_shared_snapshot(share_uid, shared):
+    """
+    The frozen blocks and metadata of a shared version, served as-is from the
+    precompressed snapshot. This is open to everyone.
+    """
+    # Committed by `session_commit` like the other changes of a request
+    if shared.snapshot_etag is None:
+        shared.build_snapshot()
+
+    if request.if_none_match.contains(shared.snapshot_etag):
+        response = current_app.response_class(status=304)
+    elif "gzip" in request.accept_encodings:
+        response = current_app.response_class(shared.snapshot, mimetype="application/json")
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = current_app.response_class(gzip.decompress(shared.snapshot), mimetype="application/json")
+
+    response.set_etag(shared.snapshot_etag)
+    response.headers["Vary"] = "Accept-Encoding"
+    # Not immutable: signing or paying rewrites a block
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config["SHARED_SNAPSHOT_MAX_AGE"]
+    return response
 
 
 @api.route("/shared/<string:share_uid>/sign", methods=["POST"])
@@ -217,6 +245,7 @@ def sign(share_uid, shared):
     }
     shared.proposal.status = ProposalStatus.Won.value
     db.session.add(sig_block)
+    shared.build_snapshot()
 
     send_client_signed_email(
         shared.proposal.company.get_team_emails(),
@@ -224,7 +253,7 @@ def sign(share_uid, shared):
         name=data["name"],
         share_uid=shared.proposal.share_uid,
     )
-    generate_pdf(share_uid, shared)
+    generate_pdf(share_uid, shared, signed=True)
     shared.proposal.company.do_proposal_signature_integrations(shared)
     mp.track(shared.proposal.company.id, "Proposal signed")
 
@@ -266,6 +295,7 @@ def pay_with_stripe(share_uid, shared):
 
     shared.proposal.status = ProposalStatus.Won.value
     db.session.add(pay_block)
+    shared.build_snapshot()
     db.session.commit()
     send_client_paid_email(
         shared.proposal.company.get_team_emails(),
@@ -283,35 +313,30 @@ def pay_with_stripe(share_uid, shared):
 @shared_pages_auth()
 def analytics(share_uid, shared):
     """This is open to everyone"""
-    # No analytics once it's signed or localhost
-    if shared.proposal.is_signed() or request.remote_addr == "127.0.0.1":
+    # No analytics on localhost. Events of signed proposals are dropped
+    # when storing them, see `store_events`
+    if request.remote_addr == "127.0.0.1":
         return json_response({}, 200)
 
     user_agent = request.headers.get("User-Agent")
     if "Googlebot" in user_agent or "Google Web Preview" in user_agent:
         return json_response({}, 200)
 
-    event = Event(
-        user_uid=request.json["event"]["userUid"],
-        kind=request.json["event"]["kind"],
-        data=request.json["event"]["data"],
-    )
-    event.data["ip"] = request.remote_addr
-    event.data["city"] = ""
-    event.data["country"] = ""
-    try:
-        response = ip_db.city(request.remote_addr)
-        event.data["city"] = response.city.name
-        event.data["country"] = response.country.name
-    except Exception as e:  # it throws when an ip can't be located, like 127.0.0.1
-        LOG.warn("IP %s couldn't be located: %s" % (request.remote_addr, e))
-        pass
-
-    # Do integrations that do something on proposal viewing
-    if event.kind == "load" and request.remote_addr not in WAW_IPS:
-        shared.proposal.company.do_proposal_view_integrations(shared, event.data)
-
-    shared.events.append(event)
-    db.session.commit()
+    data, errors = AnalyticsEventSchema().load(request.json.get("event", {}))
+    if errors:
+        raise InvalidAPIRequest(payload=errors)
+
+    event = {
+        "shared_proposal_id": shared.id,
+        "user_uid": str(data["user_uid"]),
+        "kind": data["kind"],
+        "data": data["data"],
+        "ip": request.remote_addr,
+        "created_at": datetime.datetime.utcnow(),
+    }
+    # Enrichment and insertion happen in the background if buffering is
+    # enabled, otherwise (or if the buffer is full) we do it right now
+    if not analytics_ingestion.enqueue(event):
+        analytics_ingestion.store_events([event])
 
     return json_response({}, 200)
@@ -1,16 +1,12 @@
 import uuid
-import io
-import logging
-import subprocess
 
-import boto3
 from flask import request, abort
 
 from .. import api_bp as api
 from flask import current_app
 from ...decorators import token_required
+from ...utils.images import pipeline, InvalidImage, ImageScalingFailed
 from ..utils import json_response, InvalidAPIRequest
-from PIL import Image
 
 
 SIZES = {
@@ -33,17 +29,6 @@ EXTENSION_FROM_MIMETYPE = {
 }
 
 
-def try_saving_corrupted_image(image_bytes):
-    """
-    convert is pretty good at fixing random image problems like CRC
-    failures, so if the initial load fails we push the data through
-    convert hoping that that fixes the problem.
-    """
-    p = subprocess.Popen(['convert', '/dev/stdin', '/dev/stdout'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-    fixed_bytes, _ = p.communicate(image_bytes)
-    return fixed_bytes
-
-
 @api.route("/upload/<string:purpose>", methods=["POST"])
 @token_required()
 def upload(purpose):
@@ -60,25 +45,12 @@ def upload(purpose):
 
     extension = EXTENSION_FROM_MIMETYPE[file.mimetype]
     contents = file.read()
-    scaled_contents = io.BytesIO()
     try:
-        image = Image.open(io.BytesIO(contents))
-    except IOError:
-        maybe_fixed_contents = try_saving_corrupted_image(contents)
-        try:
-            image = Image.open(io.BytesIO(maybe_fixed_contents))
-        except:
-            raise InvalidAPIRequest(payload={"file": "Format not accepted"})
-    except:
+        scaled_contents = pipeline.scale(contents, extension, purpose_size)
+    except InvalidImage:
         raise InvalidAPIRequest(payload={"file": "Format not accepted"})
-
-    image.thumbnail(purpose_size, Image.ANTIALIAS)
-
-    if extension == "JPEG":
-        # default quality is 75 which is too low
-        image.save(scaled_contents, extension, quality=90)
-    else:
-        image.save(scaled_contents, extension)
+    except ImageScalingFailed:
+        abort(500)
 
     # TODO: save original filename somewhere?
     file_uuid = uuid.uuid4()
@@ -91,24 +63,12 @@ def upload(purpose):
     # store, too.
     scaled_filename = "proposals/{}-{}.{}".format(file_uuid, purpose, extension)
 
-    bucket_name = current_app.config["S3_BUCKET_NAME"]
-    s3_client = boto3.client("s3")
-
-    # TODO: scrubs exif data
-    def upload_s3(filename_, contents_):
-        response = s3_client.put_object(
-            Bucket=bucket_name, Key=filename_, Body=contents_, ContentType="image",
-            CacheControl='max-age=31536000',  # 1 year
-        )
-        status_code = response["ResponseMetadata"]["HTTPStatusCode"]
-        if status_code != 200:
-            logging.error("Could not store %s in %s: status_code: %s", filename, bucket_name, status_code)
-            abort(500)
-
-    # Upload both, scaled and original, unless its a GIF
-    upload_s3(filename, contents)
+    # Upload both at the same time, scaled and original, unless its a GIF
+    files = [(filename, contents)]
     if extension != "GIF":
-        upload_s3(scaled_filename, scaled_contents.getvalue())
+        files.append((scaled_filename, scaled_contents))
+    if not pipeline.upload(current_app.config["S3_BUCKET_NAME"], files):
+        abort(500)
 
     original_url = "https://{}.s3.amazonaws.com/{}".format(current_app.config["S3_BUCKET_NAME"], filename)
     scaled_url = "https://{}.s3.amazonaws.com/{}".format(current_app.config["S3_BUCKET_NAME"], scaled_filename)
@@ -1,5 +1,5 @@
 from sqlalchemy.exc import DatabaseError
-from flask import jsonify, current_app
+from flask import jsonify, current_app, g
 
 from . import api_bp as api
 from ..setup import db
@@ -65,8 +65,18 @@ def json_response(payload, status_code=200):
     return response
 
 
+def after_commit(func):
+    """
+    Calls `func` once `session_commit` committed the request, for
+    anything that reads back what the request wrote.
+    Not called if the request fails.
+    """
+    g.setdefault("after_commit", []).append(func)
+
+
 @api.after_request
 def session_commit(response):
+    callbacks = g.pop("after_commit", [])
     if response.status_code >= 400:
         return response
 
@@ -76,4 +86,6 @@ def session_commit(response):
         db.session.rollback()
         raise
 
+    for func in callbacks:
+        func()
     return response
@@ -27,7 +27,20 @@ class Config(object):
     # Id 17760 -> production,  ID 18112 -> staging
     MAILJET_PROPPRY_GENERAL_UPDATES_LIST_ID = os.environ.get("MAILJET_PROPPRY_GENERAL_UPDATES_LIST_ID", "")
 
+    # See app/utils/analytics_ingestion.py
+    ANALYTICS_BUFFERED = os.environ.get("ANALYTICS_BUFFERED", "") == "1"
+    ANALYTICS_FLUSH_INTERVAL_MS = int(os.environ.get("ANALYTICS_FLUSH_INTERVAL_MS", 500))
+    ANALYTICS_FLUSH_SIZE = int(os.environ.get("ANALYTICS_FLUSH_SIZE", 200))
+    ANALYTICS_BUFFER_SIZE = int(os.environ.get("ANALYTICS_BUFFER_SIZE", 10000))
+    ANALYTICS_BUFFER_PUT_TIMEOUT_MS = int(os.environ.get("ANALYTICS_BUFFER_PUT_TIMEOUT_MS", 50))
+    # Build the sessions of shares without a rollup in PostgreSQL
+    ANALYTICS_SQL_SESSIONS = os.environ.get("ANALYTICS_SQL_SESSIONS", "1") == "1"
+    # Where `manage.py archive_analytics` exports old events
+    ANALYTICS_ARCHIVE_DIR = os.environ.get("ANALYTICS_ARCHIVE_DIR", "/var/lib/proppy/analytics")
+
     GEOIP_DATABASE_PATH = os.environ.get("GEOIP_DATABASE_PATH", "./GeoLite2-City.mmdb")
+    # Number of ips whose location is kept in memory
+    GEOIP_CACHE_SIZE = int(os.environ.get("GEOIP_CACHE_SIZE", 10000))
 
     KEYCZAR_KEY_PATH = os.environ.get("PROPPY_KEYCZAR_KEY_PATH", relpath("../testdata/test-signing-keys"))
     if os.path.exists(KEYCZAR_KEY_PATH):
@@ -55,15 +68,31 @@ class Config(object):
     MAIL_DEBUG = True
     MAIL_SUPPRESS_SEND = True
 
+    # In seconds, for the published proposals snapshots
+    SHARED_SNAPSHOT_MAX_AGE = 60 * 5
+
     ALLOWED_UPLOAD_MIMETYPES = [
         "image/jpg",
         "image/jpeg",
         "image/png",
         "image/gif",
     ]
-
+    # Processes scaling the uploaded images in each worker, see app/utils/images.py
+    IMAGE_PROCESSES = int(os.environ.get("IMAGE_PROCESSES", 2))
+    # In seconds
+    IMAGE_SCALE_TIMEOUT = 30
+    # Larger images are refused before being decoded, 50M is more than most cameras
+    IMAGE_MAX_PIXELS = 50 * 1000 * 1000
+
+    # "elasticsearch" or "postgres", see app/utils/search.py::get_backend
+    SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND", "elasticsearch")
     ES_SERVER = os.environ.get("ES_SERVER", "127.0.0.1:9200")
+    # Alias of the index searched, see app/utils/search.py::reindex
     ES_IMPORT_INDEX = "proposals"
+    ES_NUMBER_OF_SHARDS = int(os.environ.get("ES_NUMBER_OF_SHARDS", 1))
+    ES_NUMBER_OF_REPLICAS = int(os.environ.get("ES_NUMBER_OF_REPLICAS", 1))
+    # Limits how fast a full reindex reads the proposals from PostgreSQL
+    ES_REINDEX_PROPOSALS_PER_SECOND = int(os.environ.get("ES_REINDEX_PROPOSALS_PER_SECOND", 200))
 
     # Integration
     SLACK_CLIENT_ID = "2639475339.106087107473"
@@ -85,6 +114,7 @@ class DevelopmentConfig(Config):
 
 class TestingConfig(Config):
     TESTING = True
+    ANALYTICS_BUFFERED = False
     SQLALCHEMY_DATABASE_URI = os.environ.get("TEST_DATABASE_URL")
     BCRYPT_LOG_ROUNDS = 4
     ES_IMPORT_INDEX = "proposals-test"
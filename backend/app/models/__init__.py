@@ -8,8 +8,9 @@ from app.models.users import User, Unsubscribed
 from app.models.shared_comments import SharedComment, SharedCommentThread
 from app.models.signatures import Signature
 from app.models.payments import ChargebeeSubscriptionCache
-from app.models.analytics import Event
+from app.models.analytics import Event, AnalyticsRollup, AnalyticsSession
 from app.models.zapier import ZapierIntegration
+from app.models.search import SearchDirtyProposal, SearchSection
 from app.models.integrations import (
     SlackIntegration, ZohoCRMIntegration, InsightlyIntegration,
     PipedriveIntegration, ContactsIntegration, StripeIntegration
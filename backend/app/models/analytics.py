@@ -1,13 +1,27 @@
+from collections import Counter
 from datetime import datetime, timezone
 
+from sqlalchemy import text
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 
 from ..setup import db
 
+from typing import NamedTuple, List, Dict, Any
+
+
+Analytics = NamedTuple("Analytics", [
+    ("numberViews", int),
+    ("lastSessionTimestamp", int),
+    ("outboundClicks", List[Dict[str, Any]]),
+    ("sessions", List[Dict[str, Any]]),   # {start, end, length, data} dict
+    ("averageSessionLength", int),  # in seconds
+])
+
 
 class Event(db.Model):
     """
     Our own analytics system.
+    The table is partitioned by month, see `app.utils.analytics_archive`.
     """
     __tablename__ = "shared_proposals_events"
     id = db.Column(db.Integer, primary_key=True)
@@ -19,6 +33,11 @@ class Event(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     shared_proposal_id = db.Column(db.Integer, db.ForeignKey("shared_proposals.id"), nullable=False, index=True)
 
+    __table_args__ = (
+        # Used by the SQL analytics, see `get_analytics_from_sql`
+        db.Index("ix_shared_proposals_events_share_kind_created_at", "shared_proposal_id", "kind", "created_at"),
+    )
+
     def __repr__(self):
         return "<Analytics %r - %r>" % (self.user_uid, self.kind)
 
@@ -32,3 +51,256 @@ class Event(db.Model):
             "data": self.data,
             "createdAt": self.get_created_at_timestamp(),
         }
+
+
+class AnalyticsRollup(db.Model):
+    """
+    Analytics of a shared proposal computed from all its events up to
+    `last_event_id`, see `AnalyticsAccumulator`. Sessions are stored in
+    `AnalyticsSession`.
+    """
+    __tablename__ = "shared_proposals_analytics"
+
+    shared_proposal_id = db.Column(db.Integer, db.ForeignKey("shared_proposals.id"), primary_key=True)
+    last_event_id = db.Column(db.Integer, nullable=False)
+    number_views = db.Column(db.Integer, nullable=False)
+    last_session_timestamp = db.Column(db.Integer, nullable=False)
+    # List of [url, count] to keep the order in which urls were first clicked
+    outbound_clicks = db.Column(JSONB, nullable=False)
+    updated_at = db.Column(
+        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False
+    )
+
+
+class AnalyticsSession(db.Model):
+    __tablename__ = "shared_proposals_sessions"
+
+    id = db.Column(db.Integer, primary_key=True)
+    shared_proposal_id = db.Column(db.Integer, db.ForeignKey("shared_proposals.id"), nullable=False, index=True)
+    user_uid = db.Column(UUID, nullable=False)
+    # timestamps, end is -1 until we get a ping
+    start = db.Column(db.Integer, nullable=False)
+    end = db.Column(db.Integer, nullable=False)
+    # data of the load event
+    data = db.Column(JSONB, nullable=False)
+    # The latest session of a user is still open: pings can extend it
+    is_current = db.Column(db.Boolean, nullable=False)
+
+
+class AnalyticsAccumulator(object):
+    """
+    Builds the analytics of a shared proposal from its events, which need to
+    be added in chronological order.
+
+    A session starts on a load and ends on the last ping before the next
+    load of the same user. Sessions without any ping are ignored, unless it
+    is the last one of the user in which case it counts as a 1s session.
+
+    The state can be saved to and loaded from the rollup tables so that
+    only new events need to be processed.
+    """
+    def __init__(self):
+        self.number_views = 0
+        self.last_session_timestamp = 0
+        self.outbound_clicks = Counter() # type: Counter
+        # user uid -> finished sessions, in order
+        self.finished = {} # type: Dict[str, List[Dict[str, Any]]]
+        # user uid -> the session that later pings can extend
+        self.current = {} # type: Dict[str, Dict[str, Any]]
+        self.last_event_id = 0
+
+    def add(self, event_id, kind, user_uid, timestamp, data):
+        self.last_event_id = max(self.last_event_id, event_id)
+
+        if kind == "load":
+            self.number_views += 1
+            self.last_session_timestamp = max(self.last_session_timestamp, timestamp)
+            current = self.current.get(user_uid)
+            if current is not None and current["end"] > -1:
+                current["length"] = current["end"] - current["start"]
+                self.finished.setdefault(user_uid, []).append(current)
+            # start a new session
+            self.current[user_uid] = {"start": timestamp, "end": -1, "data": data}
+        elif kind == "ping":
+            current = self.current.get(user_uid)
+            # Ping before a load? disregard
+            if current is not None:
+                current["end"] = timestamp
+        elif kind == "outbound_click":
+            self.outbound_clicks[data["url"]] += 1
+
+    def add_events(self, events):
+        for e in events:
+            self.add(e.id, e.kind, e.user_uid, e.get_created_at_timestamp(), e.data)
+
+    def to_analytics(self):
+        sessions = []
+        for uid in sorted(set(self.finished.keys()) | set(self.current.keys())):
+            sessions += [dict(s) for s in self.finished.get(uid, [])]
+            if uid in self.current:
+                last = dict(self.current[uid])
+                # session ended before the first ping? Count that as a 1s session
+                if last["end"] == -1:
+                    last["length"] = 1
+                else:
+                    last["length"] = last["end"] - last["start"]
+                sessions.append(last)
+
+        average_session_length = 0
+        if len(sessions) > 0:
+            average_session_length = int(
+                sum([s["length"] for s in sessions]) / len(sessions)
+            )
+            # and re-sort session in a desc order this time for showing
+            # newer ones first
+            sessions = sorted(sessions, key=lambda s: s["start"], reverse=True)
+
+        sorted_outbound_clicks = sorted(
+            ({"url": url, "count": count} for url, count in self.outbound_clicks.items()),
+            key=lambda o: (-o["count"], o["url"])
+        )
+
+        return Analytics(
+            numberViews=self.number_views,
+            lastSessionTimestamp=self.last_session_timestamp,
+            outboundClicks=sorted_outbound_clicks,
+            sessions=sessions,
+            averageSessionLength=average_session_length,
+        )
+
+    @classmethod
+    def load(cls, rollup):
+        accumulator = cls()
+        accumulator.last_event_id = rollup.last_event_id
+        accumulator.number_views = rollup.number_views
+        accumulator.last_session_timestamp = rollup.last_session_timestamp
+        for url, count in rollup.outbound_clicks:
+            accumulator.outbound_clicks[url] = count
+
+        sessions = AnalyticsSession.query\
+            .filter_by(shared_proposal_id=rollup.shared_proposal_id)\
+            .order_by(AnalyticsSession.start, AnalyticsSession.id)
+        for s in sessions:
+            session = {"start": s.start, "end": s.end, "data": s.data}
+            if s.is_current:
+                accumulator.current[s.user_uid] = session
+            else:
+                session["length"] = s.end - s.start
+                accumulator.finished.setdefault(s.user_uid, []).append(session)
+        return accumulator
+
+    def save(self, shared_proposal_id):
+        """
+        Replaces the rollup of that shared proposal. Doesn't commit.
+        """
+        rollup = AnalyticsRollup.query.get(shared_proposal_id)
+        if rollup is None:
+            rollup = AnalyticsRollup(shared_proposal_id=shared_proposal_id)
+            db.session.add(rollup)
+        rollup.last_event_id = self.last_event_id
+        rollup.number_views = self.number_views
+        rollup.last_session_timestamp = self.last_session_timestamp
+        rollup.outbound_clicks = [[url, count] for url, count in self.outbound_clicks.items()]
+
+        AnalyticsSession.query\
+            .filter_by(shared_proposal_id=shared_proposal_id)\
+            .delete(synchronize_session=False)
+
+        rows = []
+        for uid in self.finished.keys() | self.current.keys():
+            for s in self.finished.get(uid, []):
+                rows.append(dict(shared_proposal_id=shared_proposal_id, user_uid=uid, start=s["start"],
+                                 end=s["end"], data=s["data"], is_current=False))
+            if uid in self.current:
+                s = self.current[uid]
+                rows.append(dict(shared_proposal_id=shared_proposal_id, user_uid=uid, start=s["start"],
+                                 end=s["end"], data=s["data"], is_current=True))
+        if rows:
+            db.session.execute(AnalyticsSession.__table__.insert().values(rows))
+
+
+# Events of a share, with their timestamp and minus the excluded ips.
+# `data->>'ip'` is NULL when there is no ip which we keep
+_SQL_EVENTS = """
+    SELECT id, user_uid, kind, data, created_at,
+           floor(extract(epoch FROM created_at))::integer AS ts
+    FROM shared_proposals_events
+    WHERE shared_proposal_id = :shared_proposal_id
+      AND kind = ANY(CAST(:kinds AS text[]))
+      AND (data->>'ip' IS NULL OR NOT data->>'ip' = ANY(CAST(:excluded_ips AS text[])))
+"""
+
+_SQL_VIEWS = """
+    SELECT count(*), coalesce(max(ts), 0) FROM ({events}) AS e
+""".format(events=_SQL_EVENTS)
+
+_SQL_OUTBOUND_CLICKS = """
+    SELECT data->>'url' AS url, count(*) AS count FROM ({events}) AS e
+    GROUP BY url
+    ORDER BY count DESC, url COLLATE "C"
+""".format(events=_SQL_EVENTS)
+
+# Each load starts a session: numbering the events of a user by the number
+# of loads seen so far groups every ping with the session it extends, pings
+# before the first load get 0 and are dropped.
+# A session without pings only counts if it is the last one of its user,
+# as a 1s session.
+_SQL_SESSIONS = """
+    WITH numbered AS (
+        SELECT e.*,
+               count(*) FILTER (WHERE kind = 'load')
+                   OVER (PARTITION BY user_uid ORDER BY created_at, id) AS session_number
+        FROM ({events}) AS e
+    ), sessions AS (
+        SELECT user_uid, session_number,
+               min(ts) FILTER (WHERE kind = 'load') AS start,
+               max(ts) FILTER (WHERE kind = 'ping') AS "end",
+               (array_agg(data) FILTER (WHERE kind = 'load'))[1] AS data,
+               session_number = max(session_number) OVER (PARTITION BY user_uid) AS is_last
+        FROM numbered
+        WHERE session_number > 0
+        GROUP BY user_uid, session_number
+    )
+    SELECT start, coalesce("end", -1) AS "end", data,
+           CASE WHEN "end" IS NULL THEN 1 ELSE "end" - start END AS length
+    FROM sessions
+    WHERE "end" IS NOT NULL OR is_last
+    ORDER BY start DESC, user_uid, session_number
+""".format(events=_SQL_EVENTS)
+
+
+def get_analytics_from_sql(shared_proposal_id, excluded_ips):
+    """
+    Computes the same `Analytics` as `AnalyticsAccumulator` but in
+    PostgreSQL so only the sessions leave the database.
+    """
+    def execute(query, kinds):
+        return db.session.execute(text(query), {
+            "shared_proposal_id": shared_proposal_id,
+            "kinds": kinds,
+            "excluded_ips": list(excluded_ips),
+        })
+
+    number_views, last_session_timestamp = execute(_SQL_VIEWS, ["load"]).first()
+    outbound_clicks = [
+        {"url": url, "count": count}
+        for url, count in execute(_SQL_OUTBOUND_CLICKS, ["outbound_click"])
+    ]
+    sessions = [
+        {"start": start, "end": end, "data": data, "length": length}
+        for start, end, data, length in execute(_SQL_SESSIONS, ["load", "ping"])
+    ]
+
+    average_session_length = 0
+    if len(sessions) > 0:
+        average_session_length = int(
+            sum([s["length"] for s in sessions]) / len(sessions)
+        )
+
+    return Analytics(
+        numberViews=number_views,
+        lastSessionTimestamp=last_session_timestamp,
+        outboundClicks=outbound_clicks,
+        sessions=sessions,
+        averageSessionLength=average_session_length,
+    )
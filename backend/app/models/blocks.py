@@ -1,6 +1,7 @@
 from datetime import datetime
 
-from sqlalchemy.dialects.postgresql import UUID, JSONB
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import UUID, JSONB, insert
 import uuid
 
 from ..setup import db
@@ -38,6 +39,11 @@ class Block(db.Model):
     # magically re-appear on the DB (because we still have them with
     # ther comments).
     proposal_id = db.Column(db.Integer, db.ForeignKey('proposals.id'), nullable=True, index=True)
+    # The proposal a detached block was removed from, only that proposal
+    # can restore it
+    detached_from_id = db.Column(
+        db.Integer, db.ForeignKey('proposals.id', ondelete="SET NULL"), nullable=True, index=True
+    )
 
     type = db.Column(BlockTypeDBEnum, nullable=False)
     data = db.Column(JSONB, nullable=False)
@@ -90,6 +96,132 @@ class Block(db.Model):
             "data": self.data,
         }
 
+    @classmethod
+    def bulk_upsert(cls, proposal_id, blocks):
+        """
+        Inserts or updates `blocks` (dicts with uid, type, data, version and
+        ordering) in a single INSERT ... ON CONFLICT statement.
+
+        This is a compare-and-set on (uid, version): an existing block is only
+        overwritten if the incoming version is newer than the stored one. A
+        block detached (see the comment on `proposal_id`) from that proposal
+        is restored if the incoming version isn't older.
+        Blocks of other proposals, detached or not, are never touched.
+
+        Returns the number of blocks saved or already up to date, and the
+        current state of the blocks that were rejected because someone else
+        saved a different version in the meantime. Rejected blocks of other
+        proposals are not returned.
+        """
+        if not blocks:
+            return 0, []
+
+        now = datetime.utcnow()
+        rows = [{
+            "uid": str(b["uid"]),
+            "proposal_id": proposal_id,
+            "type": b["type"],
+            "data": b["data"],
+            "version": b["version"],
+            "ordering": b["ordering"],
+            "detached_from_id": None,
+            "created_at": now,
+            "updated_at": now,
+        } for b in blocks]
+
+        table = cls.__table__
+        stmt = insert(table).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.uid],
+            set_={
+                "proposal_id": stmt.excluded.proposal_id,
+                "type": stmt.excluded.type,
+                "data": stmt.excluded.data,
+                "version": stmt.excluded.version,
+                "ordering": stmt.excluded.ordering,
+                "detached_from_id": stmt.excluded.detached_from_id,
+                "updated_at": stmt.excluded.updated_at,
+            },
+            where=db.or_(
+                db.and_(table.c.proposal_id == proposal_id, table.c.version < stmt.excluded.version),
+                db.and_(
+                    table.c.proposal_id.is_(None),
+                    table.c.detached_from_id == proposal_id,
+                    table.c.version <= stmt.excluded.version,
+                ),
+            ),
+        ).returning(table.c.uid)
+
+        accepted = set(str(x[0]) for x in db.session.execute(stmt))
+        cls._expire_loaded(accepted)
+
+        incoming_versions = dict((row["uid"], row["version"]) for row in rows)
+        rejected = set(incoming_versions.keys()) - accepted
+        if not rejected:
+            return len(accepted), []
+
+        own = cls.query.filter(
+            cls.uid.in_(rejected),
+            db.or_(cls.proposal_id == proposal_id, cls.detached_from_id == proposal_id),
+        ).all()
+        # Re-sending the version we already have is fine, not a conflict
+        conflicts = [
+            b for b in own
+            if b.version != incoming_versions[b.uid] or b.proposal_id != proposal_id
+        ]
+        return len(accepted) + len(own) - len(conflicts), conflicts
+
+    @classmethod
+    def bulk_reorder(cls, proposal_id, orderings):
+        """
+        Sets the ordering of several blocks of a proposal at once.
+        `orderings` is a list of (uid, ordering) tuples.
+        """
+        if not orderings:
+            return
+
+        db.session.execute(
+            text(
+                "UPDATE blocks SET ordering = moved.ordering, updated_at = :now "
+                "FROM unnest(CAST(:uids AS uuid[]), CAST(:orderings AS integer[])) "
+                "AS moved(uid, ordering) "
+                "WHERE blocks.uid = moved.uid AND blocks.proposal_id = :proposal_id"
+            ),
+            {
+                "now": datetime.utcnow(),
+                "uids": [str(uid) for uid, _ in orderings],
+                "orderings": [ordering for _, ordering in orderings],
+                "proposal_id": proposal_id,
+            }
+        )
+        cls._expire_loaded(uid for uid, _ in orderings)
+
+    @classmethod
+    def bulk_detach(cls, proposal_id, uids):
+        """
+        Detaches blocks from their proposal instead of deleting them so
+        they can be restored later.
+        """
+        if not uids:
+            return
+
+        cls.query.filter(
+            cls.proposal_id == proposal_id,
+            cls.uid.in_([str(uid) for uid in uids]),
+        ).update({"proposal_id": None, "detached_from_id": proposal_id}, synchronize_session=False)
+        cls._expire_loaded(uids)
+
+    @classmethod
+    def _expire_loaded(cls, uids):
+        """
+        The bulk_* methods bypass the ORM so blocks already loaded in the
+        session need to be refreshed from the DB on next access.
+        """
+        uids = set(str(uid) for uid in uids)
+        for obj in list(db.session.identity_map.values()):
+            if isinstance(obj, cls) and obj.uid in uids:
+                db.session.expire(obj)
+
     def dump_data(self):
         """Same as to_json but only dump the data"""
         return {
@@ -2,11 +2,12 @@ from datetime import datetime, timedelta, timezone
 import json
 import enum
 
-import requests
 from flask import current_app
 from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import joinedload
 
 from ..setup import db
+from ..utils import slack_notifications
 from .proposals import Proposal
 from .enums import ProposalStatus
 from . import integrations # required for sqlalchemy to resolve the "ContactsIntegration" table.
@@ -106,6 +107,29 @@ class Company(db.Model):
     def __repr__(self):
         return "<Company %r - %d>" % (self.name, self.id)
 
+    @classmethod
+    def get_with_integrations(cls, company_id):
+        """
+        Loads the company along with all the 1-to-1 relationships needed by
+        `to_json` and `publish_state` in a single query.
+        """
+        return cls.query.options(
+            joinedload(cls.subscription_cache),
+            joinedload(cls.slack),
+            joinedload(cls.zoho_crm),
+            joinedload(cls.insightly),
+            joinedload(cls.pipedrive),
+            joinedload(cls.stripe),
+            joinedload(cls.zapier),
+        ).filter(cls.id == company_id).one()
+
+    def get_tags(self):
+        """All the tags used in the company proposals, without duplicates"""
+        rows = db.session.query(db.func.unnest(Proposal.tags))\
+            .filter(Proposal.company_id == self.id)\
+            .distinct()
+        return [x[0] for x in rows]
+
     def get_trial_expiry_date(self):
         """
         This returns the end of the trial period for the company except that
@@ -277,11 +301,11 @@ class Company(db.Model):
             user = viewing_data["username"] if viewing_data["username"] else "Someone"
 
             message = "%s has opened your proposal \"%s\" %s" % (user, shared.title, location)
-            response = requests.post(self.slack.webhook_url, json={"text": message})
-
-            if response.status_code != 200:
-                # TODO: log error
-                print("SLACK ERROR ON VIEW: %s" % response.text)
+            # The same reader reloading the page only gets posted once
+            slack_notifications.dispatcher.post(
+                self.slack.id, self.slack.webhook_url, {"text": message},
+                coalesce_key=(self.slack.id, shared.id, message),
+            )
 
     def do_proposal_comment_integrations(self, shared, comment, username):
         if self.slack and self.slack.post_on_comment:
@@ -296,23 +320,15 @@ class Company(db.Model):
                 "fallback": comment,
 
             }
-            response = requests.post(self.slack.webhook_url, json={
+            slack_notifications.dispatcher.post(self.slack.id, self.slack.webhook_url, {
                 "text": message,
                 "attachments": [attachment]
             })
 
-            if response.status_code != 200:
-                # TODO: log error
-                print("SLACK ERROR ON COMMENT: %s" % response.text)
-
     def do_proposal_signature_integrations(self, shared):
         if self.slack and self.slack.post_on_signature:
             message = "Your proposal \"%s\" has been signed!" % shared.title
-            response = requests.post(self.slack.webhook_url, json={"text": message})
-
-            if response.status_code != 200:
-                # TODO: log error
-                print("SLACK ERROR ON SIGNATURE: %s" % response.text)
+            slack_notifications.dispatcher.post(self.slack.id, self.slack.webhook_url, {"text": message})
 
     def delete_clients_from_integration(self, name):
         """
@@ -4,6 +4,8 @@ few denormalized values. Denormalize more values as required.
 
 Naming of tables follows mailjet API.
 """
+from datetime import datetime
+
 from sqlalchemy.dialects.postgresql import JSONB
 
 from ..setup import db
@@ -47,3 +49,22 @@ class OpenInformation(db.Model):
     contact_id = db.Column(db.Integer, db.ForeignKey("mailjet_contact.id"), nullable=False)
     json_response = db.Column(JSONB, nullable=False)
     opened_at = db.Column(db.DateTime, nullable=False)
+
+
+class OutboxMessage(db.Model):
+    """
+    Emails waiting to be sent to mailjet by `manage.py send_emails`.
+    Added in the same transaction as the change that triggered them and
+    deleted once sent.
+    """
+    __tablename__ = 'mailjet_outbox'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # A message in the format of the mailjet send API
+    payload = db.Column(JSONB, nullable=False)
+    message_reason = db.Column(db.String(), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    last_error = db.Column(db.Text, nullable=True)
@@ -9,6 +9,7 @@ from .enums import ProposalStatusDBEnum, BlockType, ProposalStatus
 from .shared_proposals import SharedProposal
 from .shared_blocks import SharedBlock
 from .blocks import Block
+from .signatures import Signature
 from ..utils.exceptions import AuthException
 from typing import List, Dict, Any
 
@@ -31,14 +32,45 @@ class Proposal(db.Model):
     status = db.Column(ProposalStatusDBEnum, default="draft", nullable=False)
     cover_image_url = db.Column(db.String(2048), default="", nullable=False)
 
-    blocks = db.relationship("Block", cascade="all,delete-orphan", backref="proposal", lazy="dynamic")
+    blocks = db.relationship(
+        "Block", cascade="all,delete-orphan", backref="proposal", lazy="dynamic",
+        foreign_keys="Block.proposal_id",
+    )
     shared_proposals = db.relationship("SharedProposal", cascade="all,delete-orphan", backref="proposal", lazy="dynamic")
     # TODO: Potentially add `owner` or at least `created by`
     signature = db.relationship("Signature", cascade="all,delete-orphan", backref="proposal", lazy="dynamic")
 
+    __table_args__ = (
+        # Used by the dashboard listing, see `get_page`
+        db.Index("ix_proposals_company_id_status_updated_at", "company_id", "status", "updated_at"),
+    )
+
     def __repr__(self):
         return "<Proposal %r - %r>" % (self.title, self.id)
 
+    @classmethod
+    def get_page(cls, company_id, limit, after=None, status=None, tag=None, client_id=None, title_prefix=None):
+        """
+        Returns up to `limit` proposals of the company, most recently updated
+        first. `after` is the (updated_at, id) of the last proposal of the
+        previous page: we filter on it rather than using an OFFSET so that
+        fetching a page costs the same whatever its position.
+        """
+        query = cls.query.filter(cls.company_id == company_id)
+        if status is not None:
+            query = query.filter(cls.status == status)
+        if tag is not None:
+            query = query.filter(cls.tags.contains([tag]))
+        if client_id is not None:
+            query = query.filter(cls.client_id == client_id)
+        if title_prefix:
+            escaped = title_prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            query = query.filter(cls.title.ilike(escaped + "%", escape="\\"))
+        if after is not None:
+            query = query.filter(db.tuple_(cls.updated_at, cls.id) < db.tuple_(*after))
+
+        return query.order_by(cls.updated_at.desc(), cls.id.desc()).limit(limit).all()
+
     def get_shared_version_number(self):
         return self.shared_proposals.value(db.func.max(SharedProposal.version)) or 0
 
@@ -121,55 +153,7 @@ class Proposal(db.Model):
         Returns 4-tuple (uid, level, title, content) for section and subsection
         level can be h1 or h2
         """
-        all_blocks = self.blocks.order_by(Block.ordering).all()
-
-        def group_by(kind):
-            i = 0
-            for block in all_blocks:
-                if block.type == kind:
-                    i += 1
-                yield i, block
-
-        sections = itertools.groupby(group_by(BlockType.Section.value), lambda x: x[0])
-        subsections = itertools.groupby(group_by(BlockType.Subtitle.value), lambda x: x[0])
-        # We want to search on the content of the following blocks
-        block_types = (
-            BlockType.H3.value,
-            BlockType.Paragraph.value,
-            BlockType.UnorderedItem.value,
-            BlockType.OrderedItem.value,
-        )
-
-        def extract_text(grouped, level):
-            values = []
-            for _, group in grouped:
-                uid, title = None, None
-                content = []
-                for _, b in group:
-                    if level == "h1" and b.type == BlockType.Section.value:
-                        uid, title = b.uid, b.data.get("value", "")
-                    elif level == "h2" and b.type == BlockType.Subtitle.value:
-                        uid, title = b.uid, b.data.get("value", "")
-
-                    # Don't append content if there's no uid
-                    if uid is None:
-                        continue
-
-                    # Stop if we encountered a section as a h2
-                    if level == "h2" and b.type == BlockType.Section.value:
-                        break
-
-                    if b.type in block_types:
-                        content.append(b.data.get('value', ""))
-                    elif level == "h1" and b.type == BlockType.Subtitle.value:
-                        content.append(b.data.get('value', ""))
-
-                if uid is not None:
-                    values.append((uid, level, title, " ".join(content)))
-
-            return values
-
-        return extract_text(sections, "h1") + extract_text(subsections, "h2")
+        return extract_search_content(self.blocks.order_by(Block.ordering).all())
 
     def is_signed(self):
         return self.signature.count() > 0
@@ -191,13 +175,24 @@ class Proposal(db.Model):
 
         return analytics
 
-    def to_json(self):
+    def to_json(self, latest_share=False, signed=None, signed_share_ids=None):
+        """
+        `latest_share`, `signed` and `signed_share_ids` can be given when
+        they were fetched in bulk, see `to_json_many`.
+        """
         shares = [] # type: List[Dict[str, Any]]
-        latest_share = self.get_latest_shared()
+        if latest_share is False:
+            latest_share = self.get_latest_shared()
         # Only fetch one right now, could fetch more if we want to display
         # a project timeline
         if latest_share is not None:
-            shares = [latest_share.to_private_json()]
+            share_signed = None
+            if signed_share_ids is not None:
+                share_signed = latest_share.id in signed_share_ids
+            shares = [latest_share.to_private_json(signed=share_signed)]
+
+        if signed is None:
+            signed = self.is_signed()
 
         return {
             "id": self.id,
@@ -211,8 +206,95 @@ class Proposal(db.Model):
             "createdAt": int(self.created_at.replace(tzinfo=timezone.utc).timestamp()),
             "coverImageUrl": self.cover_image_url,
             "shares": shares,
-            "signed": self.is_signed(),
+            "signed": signed,
         }
 
+    @classmethod
+    def to_json_many(cls, proposals):
+        """
+        Same output as calling `to_json` on each proposal but with 2 queries
+        in total instead of up to 3 per proposal.
+        """
+        ids = [p.id for p in proposals]
+        if not ids:
+            return []
+
+        # DISTINCT ON keeps the first row of each proposal, ie the latest version
+        latest_shares = SharedProposal.query\
+            .filter(SharedProposal.proposal_id.in_(ids))\
+            .distinct(SharedProposal.proposal_id)\
+            .order_by(SharedProposal.proposal_id, SharedProposal.version.desc())
+        latest_by_proposal = dict((s.proposal_id, s) for s in latest_shares)
+
+        signatures = db.session.query(Signature.proposal_id, Signature.shared_proposal_id)\
+            .filter(Signature.proposal_id.in_(ids))\
+            .all()
+        signed_proposal_ids = set(x[0] for x in signatures)
+        signed_share_ids = set(x[1] for x in signatures)
+
+        return [
+            p.to_json(
+                latest_share=latest_by_proposal.get(p.id),
+                signed=p.id in signed_proposal_ids,
+                signed_share_ids=signed_share_ids,
+            )
+            for p in proposals
+        ]
+
     def get_share_link(self):
         return "{}/p/{}".format(current_app.config["BASE_URL"], self.share_uid)
+
+
+def extract_search_content(all_blocks):
+    """
+    Returns 4-tuple (uid, level, title, content) for section and subsection
+    level can be h1 or h2. `all_blocks` are the blocks of a proposal in order,
+    anything with uid, type and data.
+    """
+    def group_by(kind):
+        i = 0
+        for block in all_blocks:
+            if block.type == kind:
+                i += 1
+            yield i, block
+
+    sections = itertools.groupby(group_by(BlockType.Section.value), lambda x: x[0])
+    subsections = itertools.groupby(group_by(BlockType.Subtitle.value), lambda x: x[0])
+    # We want to search on the content of the following blocks
+    block_types = (
+        BlockType.H3.value,
+        BlockType.Paragraph.value,
+        BlockType.UnorderedItem.value,
+        BlockType.OrderedItem.value,
+    )
+
+    def extract_text(grouped, level):
+        values = []
+        for _, group in grouped:
+            uid, title = None, None
+            content = []
+            for _, b in group:
+                if level == "h1" and b.type == BlockType.Section.value:
+                    uid, title = b.uid, b.data.get("value", "")
+                elif level == "h2" and b.type == BlockType.Subtitle.value:
+                    uid, title = b.uid, b.data.get("value", "")
+
+                # Don't append content if there's no uid
+                if uid is None:
+                    continue
+
+                # Stop if we encountered a section as a h2
+                if level == "h2" and b.type == BlockType.Section.value:
+                    break
+
+                if b.type in block_types:
+                    content.append(b.data.get('value', ""))
+                elif level == "h1" and b.type == BlockType.Subtitle.value:
+                    content.append(b.data.get('value', ""))
+
+            if uid is not None:
+                values.append((uid, level, title, " ".join(content)))
+
+        return values
+
+    return extract_text(sections, "h1") + extract_text(subsections, "h2")
@@ -0,0 +1,111 @@
+from datetime import datetime
+
+from sqlalchemy.dialects.postgresql import UUID, TSVECTOR
+
+from ..setup import db
+
+
+class SearchDirtyProposal(db.Model):
+    """
+    Change log of the proposals whose search documents are out of date,
+    filled by the triggers below on any write to `proposals` or `blocks`
+    and consumed by `app.utils.search.index_dirty_proposals`.
+    A proposal is only logged once per transaction.
+    No foreign key: a deleted proposal needs to be removed from the index.
+    """
+    __tablename__ = "search_dirty_proposals"
+
+    id = db.Column(db.BigInteger, primary_key=True)
+    proposal_id = db.Column(db.Integer, nullable=False)
+    txid = db.Column(db.BigInteger, server_default=db.text("txid_current()"), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, server_default=db.func.now(), nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint("proposal_id", "txid", name="uq_search_dirty_proposals_proposal_id_txid"),
+    )
+
+
+class SearchSection(db.Model):
+    """
+    Sections searched by `app.utils.search_postgres.PostgresBackend`, one
+    row per document of the elasticsearch index.
+    `document` weights the title over the content. The trigram indices
+    (pg_trgm) answer the substring matches.
+    """
+    __tablename__ = "search_sections"
+
+    uid = db.Column(UUID, primary_key=True)
+    proposal_id = db.Column(
+        db.Integer, db.ForeignKey("proposals.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    company_id = db.Column(db.Integer, nullable=False, index=True)
+    proposal_title = db.Column(db.String, nullable=False)
+    level = db.Column(db.String(2), nullable=False)
+    title = db.Column(db.String, nullable=False)
+    content = db.Column(db.String, nullable=False)
+    document = db.Column(TSVECTOR, nullable=False)
+
+    __table_args__ = (
+        db.Index("ix_search_sections_document", "document", postgresql_using="gin"),
+        db.Index(
+            "ix_search_sections_title_trgm", "title",
+            postgresql_using="gin", postgresql_ops={"title": "gin_trgm_ops"}
+        ),
+        db.Index(
+            "ix_search_sections_content_trgm", "content",
+            postgresql_using="gin", postgresql_ops={"content": "gin_trgm_ops"}
+        ),
+    )
+
+
+# Triggers rather than ORM events as blocks are mostly written with bulk
+# statements. Old and new proposal are both dirty when a block moves.
+DIRTY_TRIGGERS_SQL = """
+CREATE OR REPLACE FUNCTION search_mark_dirty(dirty_id integer) RETURNS void AS $$
+BEGIN
+    IF dirty_id IS NOT NULL THEN
+        INSERT INTO search_dirty_proposals (proposal_id) VALUES (dirty_id)
+        ON CONFLICT ON CONSTRAINT uq_search_dirty_proposals_proposal_id_txid DO NOTHING;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION search_proposals_dirty() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM search_mark_dirty(OLD.id);
+    ELSE
+        PERFORM search_mark_dirty(NEW.id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION search_blocks_dirty() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM search_mark_dirty(OLD.proposal_id);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM search_mark_dirty(NEW.proposal_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS search_proposals_dirty ON proposals;
+CREATE TRIGGER search_proposals_dirty AFTER INSERT OR UPDATE OR DELETE ON proposals
+    FOR EACH ROW EXECUTE PROCEDURE search_proposals_dirty();
+
+DROP TRIGGER IF EXISTS search_blocks_dirty ON blocks;
+CREATE TRIGGER search_blocks_dirty AFTER INSERT OR UPDATE OR DELETE ON blocks
+    FOR EACH ROW EXECUTE PROCEDURE search_blocks_dirty();
+"""
+
+DROP_DIRTY_TRIGGERS_SQL = """
+DROP TRIGGER IF EXISTS search_blocks_dirty ON blocks;
+DROP TRIGGER IF EXISTS search_proposals_dirty ON proposals;
+DROP FUNCTION IF EXISTS search_blocks_dirty();
+DROP FUNCTION IF EXISTS search_proposals_dirty();
+DROP FUNCTION IF EXISTS search_mark_dirty(integer);
+"""
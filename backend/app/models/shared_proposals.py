@@ -1,24 +1,14 @@
-from collections import Counter
 from datetime import datetime, timezone
-from itertools import groupby
+import gzip
+import hashlib
+import json
 
+from flask import current_app
 from sqlalchemy.dialects.postgresql import ARRAY
 
 from .enums import BlockType
 from ..setup import db
-from .analytics import Event
-
-from typing import NamedTuple, List, Dict, Any
-
-#IdList = NewType('IdList', List[UserId])
-
-Analytics = NamedTuple("Analytics", [
-    ("numberViews", int),
-    ("lastSessionTimestamp", int),
-    ("outboundClicks", List[Dict[str, Any]]),
-    ("sessions", List[Dict[str, Any]]),   # {start, end, length, data} dict
-    ("averageSessionLength", int),  # in seconds
-])
+from .analytics import Event, AnalyticsAccumulator, get_analytics_from_sql
 
 
 
@@ -55,6 +45,13 @@ class SharedProposal(db.Model):
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
+    # Gzipped JSON of the frozen part of the shared page (blocks and
+    # metadata), built on publish so we don't have to query and serialize
+    # hundreds of blocks on every view. Deferred as it can be big.
+    # Signing and paying change their block so it gets rebuilt then.
+    snapshot = db.deferred(db.Column(db.LargeBinary, nullable=True))
+    snapshot_etag = db.Column(db.String(64), nullable=True)
+
     blocks = db.relationship(
         "SharedBlock",
         backref="shared_proposal",
@@ -79,20 +76,66 @@ class SharedProposal(db.Model):
         lazy="dynamic",
         cascade="all,delete-orphan",
     )
+    analytics_rollup = db.relationship(
+        "AnalyticsRollup",
+        cascade="all,delete-orphan",
+        uselist=False,
+    )
+    analytics_sessions = db.relationship(
+        "AnalyticsSession",
+        lazy="dynamic",
+        cascade="all,delete-orphan",
+    )
 
     def __repr__(self):
         return "<Share %r - %r>" % (self.id, self.version)
 
-    def to_json(self):
+    def to_json(self, signed=None):
+        if signed is None:
+            signed = self.signature.count() > 0
+
         return {
             "id": self.id,
-            "signed": self.signature.count() > 0,
+            "signed": signed,
             "version": self.version,
             "title": self.title,
             "coverImageUrl": self.cover_image_url,
             "createdAt": int(self.created_at.replace(tzinfo=timezone.utc).timestamp()),
         }
 
+    def get_frozen_json(self):
+        """Everything in `to_json` that can never change"""
+        data = self.to_json(signed=False)
+        del data["signed"]
+        return data
+
+    def build_snapshot(self):
+        """
+        (Re)builds the snapshot, needs to be called every time a block changes.
+        """
+        share_uid = self.proposal.share_uid
+        blocks = [b.to_json() for b in self.blocks.order_by("ordering")]
+        # We use share uid for everything on shared pages
+        for block in blocks:
+            block["proposalId"] = share_uid
+
+        raw = json.dumps(
+            {"blocks": blocks, "shared": self.get_frozen_json()},
+            sort_keys=True,
+            separators=(",", ":"),
+        ).encode("utf-8")
+        self.snapshot = gzip.compress(raw)
+        self.snapshot_etag = hashlib.sha1(raw).hexdigest()
+
+    def get_snapshot(self):
+        """
+        Returns the decoded snapshot, building it first for proposals
+        shared before snapshots existed.
+        """
+        if self.snapshot is None:
+            self.build_snapshot()
+        return json.loads(gzip.decompress(self.snapshot).decode("utf-8"))
+
     def get_comments_count(self):
         count = 0
         # TODO: optimise that if needed (probably not)
@@ -102,77 +145,42 @@ class SharedProposal(db.Model):
 
     def get_analytics(self):
         """
-        Prepare analytics for the page in the app
+        Prepare analytics for the page in the app.
+        Starts from the rollup if the events were already compacted (see
+        `compact_analytics`) so only the newer events need to be loaded.
+        """
+        rollup = self.analytics_rollup
+        if rollup is None:
+            if current_app.config["ANALYTICS_SQL_SESSIONS"]:
+                return self.get_analytics_from_sql()
+            return self.get_analytics_from_events()
+
+        accumulator = AnalyticsAccumulator.load(rollup)
+        accumulator.add_events(self._get_events(after_id=rollup.last_event_id))
+        return accumulator.to_analytics()._asdict()
+
+    def get_analytics_from_events(self):
+        """
+        Same as `get_analytics` but always goes through all the events
+        """
+        accumulator = AnalyticsAccumulator()
+        accumulator.add_events(self._get_events())
+        return accumulator.to_analytics()._asdict()
+
+    def get_analytics_from_sql(self):
+        """
+        Same as `get_analytics_from_events` but the sessions are built by
+        PostgreSQL
         """
-        events = self.events.order_by(Event.created_at).all()
+        return get_analytics_from_sql(self.id, WAW_IPS)._asdict()
+
+    def _get_events(self, after_id=0):
+        events = self.events\
+            .filter(Event.id > after_id)\
+            .order_by(Event.created_at, Event.id)\
+            .all()
         # Remove our servers ips from the data returned
-        events = [e for e in events if e.data.get("ip") not in WAW_IPS]
-
-        views = [e for e in events if e.kind == "load"]
-        last_session_timestamp = 0
-        if len(views) > 0:
-            last_session_timestamp = views[len(views) - 1].get_created_at_timestamp()
-
-        outbound_clicks = Counter(e.data["url"] for e in events if e.kind == "outbound_click")
-
-        sorted_outbound_clicks = sorted(
-            ({"url": url, "count": count} for url, count in outbound_clicks.items()),
-            key=lambda o: o["count"], reverse=True
-        )
-
-        # Sorting per user uid to groupby
-        session_events = sorted(
-            [e for e in events if e.kind == "load" or e.kind == "ping"],
-            key=lambda e: e.user_uid
-        )
-        sessions = []
-        for uid, group in groupby(session_events, lambda e: e.user_uid):
-            events = sorted(group, key=lambda e: e.created_at)
-            current_session = None # type: Any
-
-            for e in events:
-                if e.kind == "load":
-                    if current_session is not None and current_session["end"] > -1:
-                        current_session["length"] = current_session["end"] - current_session["start"]
-                        sessions.append(current_session)
-                    # start a new session
-                    current_session = {
-                        "start": e.get_created_at_timestamp(),
-                        "end": -1,
-                        "data": e.data,
-                    }
-                elif e.kind == "ping":
-                    if current_session is None:
-                        # Ping before a load? disregard
-                        continue
-                    current_session["end"] = e.get_created_at_timestamp()
-
-            # don't forget to add the last session
-            if current_session:
-                # session ended before the first ping? Count that as a 1s session
-                if current_session["end"] == -1:
-                    current_session["length"] = 1
-                else:
-                    current_session["length"] = current_session["end"] - current_session["start"]
-                sessions.append(current_session)
-
-        averageSessionLength = 0
-        if len(sessions) > 0:
-            averageSessionLength = int(
-                sum([s["length"] for s in sessions]) / len(sessions)
-            )
-
-            # and re-sort session in a desc order this time for showing
-            # newer ones first
-            sessions = sorted(sessions, key=lambda s: s["start"], reverse=True)
-
-        return Analytics(
-            numberViews=len(views),
-            lastSessionTimestamp=last_session_timestamp,
-            outboundClicks=sorted_outbound_clicks,
-            sessions=sessions,
-            averageSessionLength=averageSessionLength,
-        )._asdict()
+        return [e for e in events if e.data.get("ip") not in WAW_IPS]
 
     def get_signature_block(self):
         return self.blocks.filter_by(type=BlockType.Signature.value).first()
@@ -180,12 +188,12 @@ class SharedProposal(db.Model):
     def get_payment_block(self):
         return self.blocks.filter_by(type=BlockType.Payment.value).first()
 
-    def to_private_json(self):
+    def to_private_json(self, signed=None):
         """
         Used in sharing page for example to get some data we don't want to
         publicly display in the shared proposal page
         """
-        data = self.to_json()
+        data = self.to_json(signed=signed)
         data.update({
             "sentTo": self.sent_to,
             "subject": self.subject,
@@ -134,15 +134,22 @@ class User(db.Model):
 
         return self.company.publish_state()
 
-    def to_json(self, get_token=True):
-        """Data sent to the frontend for that user"""
+    def to_json(self, get_token=True, publish_state=None):
+        """
+        Data sent to the frontend for that user.
+        `publish_state` can be passed when serializing all the users of a
+        company to avoid computing the company one for each of them.
+        """
+        if publish_state is None or not self.is_active:
+            publish_state = self.publish_state()
+
         return {
             "id": self.id,
             "username": self.username,
             "email": self.email,
             "isAdmin": self.is_admin,
             "isActive": self.is_active,
-            "publishState": self.publish_state().value,
+            "publishState": publish_state.value,
             "companyId": self.company_id,
             "disabled": self.disabled,
             "onboarded": self.onboarded,
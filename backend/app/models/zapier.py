@@ -39,20 +39,44 @@ class ZapierIntegration(db.Model):
 
 
 class ZapierTriggerEvent(db.Model):
+    """
+    A trigger to post to one endpoint. Written in the same transaction as
+    the change that triggered it and posted by `manage.py zapier_dispatcher`,
+    see `app.utils.zapier`.
+    """
     __tablename__ = 'zapier_trigger_events'
 
     id = db.Column(db.Integer, primary_key=True)
     company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), nullable=False, index=True)
+    endpoint_id = db.Column(
+        db.Integer, db.ForeignKey('zapier_hook_endpoints.id', ondelete="CASCADE"), nullable=False, index=True
+    )
+    event = db.Column(db.String(128), nullable=False)
 
     # when we created the event
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
     # event log (retries etc)
-    post_event_log = db.Column(JSONB, nullable=False)
+    post_event_log = db.Column(JSONB, nullable=False, default=list)
 
     # what we posted to zapier
     data = db.Column(JSONB, nullable=False)
 
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # NULL until zapier accepted it
+    delivered_at = db.Column(db.DateTime, nullable=True)
+
+    endpoint = db.relationship("ZapierHookEndpoint")
+
+    __table_args__ = (
+        # The pending events, see `Dispatcher.dispatch`
+        db.Index(
+            "ix_zapier_trigger_events_pending", "next_attempt_at",
+            postgresql_where=sqlalchemy.text("delivered_at IS NULL"),
+        ),
+    )
+
 
 class ZapierHookEndpoint(db.Model):
     __tablename__ = 'zapier_hook_endpoints'
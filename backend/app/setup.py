@@ -9,6 +9,8 @@ from raven.contrib.flask import Sentry
 from werkzeug.contrib.fixers import ProxyFix
 from typing import Any
 import app.utils.zapier as zapier
+import app.utils.analytics_ingestion as analytics_ingestion
+import app.utils.geoip as geoip
 
 import chargebee
 
@@ -41,6 +43,8 @@ def create_app(config_name: str):
     conf.init_app(app)
 
     zapier.init_app(app)
+    analytics_ingestion.init_app(app)
+    geoip.init_app(app)
 
     mail.init_app(app)
     db.init_app(app)
@@ -0,0 +1,188 @@
+"""
+`shared_proposals_events` is partitioned by month using table inheritance:
+rows inserted in the parent table are routed by a trigger to a
+`shared_proposals_events_yYYYYmMM` child table, created on first use.
+Queries go through the parent and skip the months they don't need thanks
+to the CHECK constraint on `created_at`.
+
+Old months are exported to gzip'd JSON lines and detached from the parent
+by `archive_partitions`.
+"""
+from datetime import date
+import gzip
+import json
+import logging
+import os
+import re
+
+from sqlalchemy import func, text
+
+from ..setup import db
+from ..models.analytics import Event, AnalyticsRollup, AnalyticsSession
+from ..models.proposals import Proposal
+from ..models.shared_proposals import SharedProposal
+
+
+logger = logging.getLogger(__name__)
+
+PARENT_TABLE = "shared_proposals_events"
+PARTITION_NAME_RE = re.compile(r"^shared_proposals_events_y(\d{4})m(\d{2})$")
+
+# Returns the name of the partition for that timestamp, creating it if needed.
+# Indices and foreign keys are not inherited so they are added there.
+PARTITION_FUNCTION_SQL = """
+CREATE OR REPLACE FUNCTION shared_proposals_events_partition(ts timestamp) RETURNS text AS $$
+DECLARE
+    month_start timestamp := date_trunc('month', ts);
+    partition text := 'shared_proposals_events_' || to_char(month_start, '"y"YYYY"m"MM');
+BEGIN
+    IF to_regclass(partition) IS NULL THEN
+        BEGIN
+            EXECUTE format(
+                'CREATE TABLE %I (
+                    PRIMARY KEY (id),
+                    FOREIGN KEY (shared_proposal_id) REFERENCES shared_proposals (id),
+                    CHECK (created_at >= %L AND created_at < %L)
+                ) INHERITS (shared_proposals_events)',
+                partition, month_start, month_start + interval '1 month'
+            );
+            EXECUTE format(
+                'CREATE INDEX %I ON %I (shared_proposal_id, kind, created_at)',
+                partition || '_share_kind_created_at', partition
+            );
+        EXCEPTION WHEN duplicate_table OR unique_violation THEN
+            -- created concurrently by another insert
+            NULL;
+        END;
+    END IF;
+    RETURN partition;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+# Nothing is returned from the parent table so inserts must not rely on
+# RETURNING, which the ORM does: events are inserted through Core, see
+# `store_events`
+INSERT_TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION shared_proposals_events_insert() RETURNS trigger AS $$
+BEGIN
+    EXECUTE format('INSERT INTO %I VALUES ($1.*)', shared_proposals_events_partition(NEW.created_at))
+        USING NEW;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER shared_proposals_events_insert
+    BEFORE INSERT ON shared_proposals_events
+    FOR EACH ROW EXECUTE PROCEDURE shared_proposals_events_insert();
+"""
+
+
+def get_partitions():
+    """
+    Returns the (name, first day of the month) of the partitions currently
+    attached, oldest first
+    """
+    names = db.session.execute(text("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = CAST(:parent AS regclass)
+    """), {"parent": PARENT_TABLE})
+
+    partitions = []
+    for name, in names:
+        match = PARTITION_NAME_RE.match(name)
+        if match is None:
+            continue
+        partitions.append((name, date(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def _add_months(day, months):
+    month = day.year * 12 + day.month - 1 + months
+    return date(month // 12, month % 12 + 1, 1)
+
+
+def export_partition(name, path):
+    """
+    Writes all the events of that partition as gzip'd JSON lines, only
+    moving the file to `path` once complete.
+    Returns the number of events written.
+    """
+    assert PARTITION_NAME_RE.match(name)
+    rows = db.session.connection()\
+        .execution_options(stream_results=True)\
+        .execute(text('SELECT * FROM "%s" ORDER BY id' % name))
+
+    count = 0
+    tmp_path = path + ".tmp"
+    with gzip.open(tmp_path, "wt") as f:
+        while True:
+            batch = rows.fetchmany(5000)
+            if not batch:
+                break
+            for row in batch:
+                event = dict(row)
+                event["created_at"] = event["created_at"].isoformat()
+                f.write(json.dumps(event) + "\n")
+            count += len(batch)
+    os.rename(tmp_path, path)
+    return count
+
+
+def archive_partitions(directory, keep_months=12, execute=False, drop=False):
+    """
+    Exports the partitions older than `keep_months` to `directory` and
+    detaches them from `shared_proposals_events`, dropping them if `drop`.
+
+    Only partitions whose events have all been compacted are archived:
+    the analytics of the shares are then entirely served by the rollups.
+    """
+    cutoff = _add_months(date.today().replace(day=1), -keep_months)
+    checkpoint = db.session.query(func.max(AnalyticsRollup.last_event_id)).scalar() or 0
+
+    archived = []
+    for name, month in get_partitions():
+        if _add_months(month, 1) > cutoff:
+            continue
+
+        last_event_id = db.session.execute(text('SELECT max(id) FROM "%s"' % name)).scalar()
+        if last_event_id is not None and last_event_id > checkpoint:
+            logger.warning("Not archiving %s: events up to %d not compacted yet", name, last_event_id)
+            continue
+
+        path = os.path.join(directory, "%s.jsonl.gz" % name)
+        if not execute:
+            print("would archive", name, "to", path)
+            continue
+
+        count = export_partition(name, path)
+        db.session.execute(text('ALTER TABLE "%s" NO INHERIT %s' % (name, PARENT_TABLE)))
+        if drop:
+            db.session.execute(text('DROP TABLE "%s"' % name))
+        db.session.commit()
+        logger.info("Archived %d events of %s to %s", count, name, path)
+        archived.append(name)
+
+    return archived
+
+
+def delete_company_analytics(company_id):
+    """
+    Deletes the events, sessions and rollups of all the shares of a company
+    in one statement each. Archived partitions are not touched.
+    Doesn't commit, returns the number of events deleted.
+    """
+    shared_proposal_ids = db.session.query(SharedProposal.id)\
+        .join(Proposal, SharedProposal.proposal_id == Proposal.id)\
+        .filter(Proposal.company_id == company_id)\
+        .subquery()
+
+    for model in [AnalyticsSession, AnalyticsRollup]:
+        model.query\
+            .filter(model.shared_proposal_id.in_(shared_proposal_ids))\
+            .delete(synchronize_session=False)
+
+    return Event.query\
+        .filter(Event.shared_proposal_id.in_(shared_proposal_ids))\
+        .delete(synchronize_session=False)
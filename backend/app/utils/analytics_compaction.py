@@ -0,0 +1,72 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import logging
+
+from sqlalchemy import func
+
+from ..setup import db
+from ..models.analytics import Event, AnalyticsRollup, AnalyticsAccumulator
+from ..models.shared_proposals import WAW_IPS
+
+
+logger = logging.getLogger(__name__)
+
+
+def compact_analytics(lag_seconds=300, batch_size=10000):
+    """
+    Folds the events received since the last run into the analytics rollups
+    so the analytics page only has to read the events that came after.
+
+    Events are processed by id, starting after the highest id already
+    compacted. Only events older than `lag_seconds` are taken: buffered
+    ingestion inserts events after they happened so we leave them some
+    time to land before moving the checkpoint past them.
+    Returns the number of events compacted.
+    """
+    checkpoint = db.session.query(func.max(AnalyticsRollup.last_event_id)).scalar() or 0
+    cutoff = datetime.utcnow() - timedelta(seconds=lag_seconds)
+    upto = db.session.query(func.max(Event.id)).filter(Event.created_at < cutoff).scalar()
+    if upto is None or upto <= checkpoint:
+        return 0
+
+    compacted = 0
+    while checkpoint < upto:
+        events = Event.query\
+            .filter(Event.id > checkpoint, Event.id <= upto)\
+            .order_by(Event.id)\
+            .limit(batch_size)\
+            .all()
+        if not events:
+            break
+
+        by_share = OrderedDict()  # type: OrderedDict
+        for e in events:
+            by_share.setdefault(e.shared_proposal_id, []).append(e)
+
+        for shared_proposal_id, share_events in by_share.items():
+            _compact_share(shared_proposal_id, share_events)
+
+        db.session.commit()
+        compacted += len(events)
+        checkpoint = events[-1].id
+        logger.info("Compacted %d analytics events up to %d", compacted, checkpoint)
+
+    return compacted
+
+
+def _compact_share(shared_proposal_id, events):
+    rollup = AnalyticsRollup.query.get(shared_proposal_id)
+    if rollup is None:
+        accumulator = AnalyticsAccumulator()
+    else:
+        accumulator = AnalyticsAccumulator.load(rollup)
+
+    last_event_id = max(accumulator.last_event_id, events[-1].id)
+    events = [
+        e for e in events
+        if e.id > accumulator.last_event_id and e.data.get("ip") not in WAW_IPS
+    ]
+    accumulator.add_events(sorted(events, key=lambda e: e.created_at))
+    # Filtered out events still count as compacted
+    accumulator.last_event_id = last_event_id
+    accumulator.save(shared_proposal_id)
@@ -0,0 +1,195 @@
+"""
+Storing of the analytics events sent by published proposals.
+
+Pings are sent every few seconds by every reader so this is our busiest
+write path. When ANALYTICS_BUFFERED is set, the view only validates events
+and puts them in an in-process buffer; a background thread then enriches
+them and inserts them in bulk every ANALYTICS_FLUSH_INTERVAL_MS or every
+ANALYTICS_FLUSH_SIZE events, whichever comes first.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from . import geoip
+
+
+LOG = logging.getLogger(__name__)
+
+# Set by init_app when buffering is enabled
+buffer = None
+
+
+def store_events(events):
+    """
+    Enriches events (geolocation, view integrations) and inserts them with a
+    single multi-row INSERT. Doesn't commit.
+
+    Events are dicts with shared_proposal_id, user_uid, kind, data, ip
+    and created_at keys.
+    """
+    from ..models.analytics import Event
+    from ..models.shared_proposals import SharedProposal, WAW_IPS
+    from ..models.signatures import Signature
+    from ..setup import db
+
+    shared_ids = set(e["shared_proposal_id"] for e in events)
+    shares = dict(
+        (s.id, s) for s in SharedProposal.query.filter(SharedProposal.id.in_(shared_ids))
+    )
+    # No analytics once it's signed
+    signed_ids = set(x[0] for x in db.session.query(SharedProposal.id)
+        .join(Signature, Signature.proposal_id == SharedProposal.proposal_id)
+        .filter(SharedProposal.id.in_(shared_ids)))
+
+    rows = []
+    for e in events:
+        shared = shares.get(e["shared_proposal_id"])
+        if shared is None or shared.id in signed_ids:
+            continue
+
+        data = dict(e["data"])
+        data["ip"] = e["ip"]
+        data["city"], data["country"] = geoip.locate(e["ip"])
+
+        # Do integrations that do something on proposal viewing. A failing
+        # integration shouldn't lose the other events of the batch.
+        if e["kind"] == "load" and e["ip"] not in WAW_IPS:
+            try:
+                shared.proposal.company.do_proposal_view_integrations(shared, data)
+            except Exception:
+                LOG.exception("View integrations failed for share %d", shared.id)
+
+        rows.append({
+            "shared_proposal_id": shared.id,
+            "user_uid": e["user_uid"],
+            "kind": e["kind"],
+            "data": data,
+            "created_at": e["created_at"],
+        })
+
+    if rows:
+        db.session.execute(Event.__table__.insert().values(rows))
+
+
+class EventBuffer(object):
+    """
+    Bounded queue of events drained by a single flusher thread.
+
+    Gunicorn forks workers after the app is created (preload) and threads
+    don't survive a fork so the queue and thread are (re)created lazily in
+    the process actually receiving events.
+    """
+    def __init__(self, app, flush_interval, flush_size, max_size, put_timeout):
+        self.app = app
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_size = max_size
+        self.put_timeout = put_timeout
+        self.pid = None
+        self.lock = threading.Lock()
+        atexit.register(self.stop)
+
+    def _ensure_started(self):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.queue = queue.Queue(maxsize=self.max_size)
+            self.stopping = threading.Event()
+            self.thread = threading.Thread(target=self._run, name="analytics-flusher", daemon=True)
+            self.thread.start()
+            self.pid = os.getpid()
+
+    def put(self, event):
+        """
+        Returns False if the buffer stayed full for `put_timeout` seconds,
+        in which case the caller should store the event itself.
+        """
+        self._ensure_started()
+        try:
+            self.queue.put(event, timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            LOG.warning("Analytics buffer full, storing event synchronously")
+            return False
+
+    def _take_batch(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.flush_size and not self.stopping.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                # Short waits so that stopping doesn't wait for a full interval
+                batch.append(self.queue.get(timeout=min(remaining, 0.1)))
+            except queue.Empty:
+                continue
+        return batch
+
+    def _run(self):
+        while not self.stopping.is_set():
+            batch = self._take_batch()
+            if batch:
+                self.flush(batch)
+
+    def flush(self, batch):
+        from ..setup import db
+
+        with self.app.app_context():
+            try:
+                store_events(batch)
+                db.session.commit()
+            except Exception:
+                LOG.exception("Failed to store %d analytics events", len(batch))
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+    def stop(self):
+        """Called on exit: stores whatever is left in the queue"""
+        if self.pid != os.getpid():
+            return
+        self.stopping.set()
+        self.thread.join(timeout=30)
+
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+            if len(batch) >= self.flush_size:
+                self.flush(batch)
+                batch = []
+        if batch:
+            self.flush(batch)
+
+
+def enqueue(event):
+    """
+    Returns True if the event was buffered, False if it has to be stored
+    right away (buffering disabled or buffer full).
+    """
+    if buffer is None:
+        return False
+    return buffer.put(event)
+
+
+def init_app(app):
+    global buffer
+    if not app.config["ANALYTICS_BUFFERED"]:
+        return
+
+    buffer = EventBuffer(
+        app,
+        flush_interval=app.config["ANALYTICS_FLUSH_INTERVAL_MS"] / 1000,
+        flush_size=app.config["ANALYTICS_FLUSH_SIZE"],
+        max_size=app.config["ANALYTICS_BUFFER_SIZE"],
+        put_timeout=app.config["ANALYTICS_BUFFER_PUT_TIMEOUT_MS"] / 1000,
+    )
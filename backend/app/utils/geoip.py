@@ -0,0 +1,67 @@
+from functools import lru_cache
+import logging
+
+import geoip2.database
+from geoip2.database import MODE_AUTO
+
+
+LOG = logging.getLogger(__name__)
+
+
+class GeoIPLocator(object):
+    """
+    City/country lookups with a bounded LRU cache in front of the database.
+    A viewer sends a ping every few seconds from the same ip so most
+    lookups are cache hits. Ips that can't be located are cached as well.
+    """
+    def __init__(self, reader, cache_size):
+        self.reader = reader
+        self._locate = lru_cache(maxsize=cache_size)(self._locate_uncached)
+
+    def _locate_uncached(self, ip):
+        try:
+            response = self.reader.city(ip)
+            return response.city.name, response.country.name
+        except Exception as e:  # it throws when an ip can't be located, like 127.0.0.1
+            LOG.warn("IP %s couldn't be located: %s" % (ip, e))
+            return "", ""
+
+    def locate(self, ip):
+        return self._locate(ip)
+
+    def stats(self):
+        info = self._locate.cache_info()
+        return {"hits": info.hits, "misses": info.misses, "size": info.currsize}
+
+
+locator = None
+
+
+def init_db(path, cache_size):
+    """
+    The database is memory mapped by the C extension of maxminddb when
+    installed: with gunicorn preloading the app, the workers share the
+    pages loaded by the master.
+    """
+    global locator
+    try:
+        reader = geoip2.database.Reader(path, mode=MODE_AUTO)
+        logging.info("loaded %s", reader.metadata())
+    except Exception:
+        logging.exception("could not load ip_db")
+        return
+    locator = GeoIPLocator(reader, cache_size)
+
+
+def init_app(app):
+    init_db(app.config["GEOIP_DATABASE_PATH"], app.config["GEOIP_CACHE_SIZE"])
+
+
+def locate(ip):
+    """
+    Returns a (city, country) tuple for that ip, empty strings if it can't
+    be located.
+    """
+    if locator is None:
+        return "", ""
+    return locator.locate(ip)
@@ -0,0 +1,175 @@
+"""
+Scaling of the uploaded images, done in a pool of processes so that
+decoding a large photo doesn't hold the gunicorn worker's GIL, and their
+upload to S3.
+"""
+import io
+import logging
+import os
+import subprocess
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import boto3
+from flask import current_app
+from PIL import Image
+
+
+LOG = logging.getLogger(__name__)
+
+
+class InvalidImage(Exception): pass
+
+
+class ImageScalingFailed(Exception): pass
+
+
+def try_saving_corrupted_image(image_bytes):
+    """
+    convert is pretty good at fixing random image problems like CRC
+    failures, so if the initial load fails we push the data through
+    convert hoping that that fixes the problem.
+    """
+    p = subprocess.Popen(['convert', '/dev/stdin', '/dev/stdout'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    fixed_bytes, _ = p.communicate(image_bytes)
+    return fixed_bytes
+
+
+def open_image(contents):
+    try:
+        return Image.open(io.BytesIO(contents))
+    except IOError:
+        try:
+            maybe_fixed_contents = try_saving_corrupted_image(contents)
+            return Image.open(io.BytesIO(maybe_fixed_contents))
+        except:
+            raise InvalidImage()
+    except:
+        raise InvalidImage()
+
+
+def scale_image(contents, extension, size, max_pixels=Image.MAX_IMAGE_PIXELS):
+    """
+    Returns the image scaled down to fit in `size` in the `extension`
+    format, or None for GIFs which are only checked as they are used as is.
+    Images of more than `max_pixels` are refused before being decoded.
+    Runs in the pool processes.
+    """
+    image = open_image(contents)
+    # Only the header has been read so far
+    width, height = image.size
+    if width * height > max_pixels:
+        raise InvalidImage()
+    if extension == "GIF":
+        return None
+
+    if image.format == "JPEG":
+        # Decodes at the smallest 1/2, 1/4 or 1/8 scale still larger
+        # than `size`, a lot faster and lighter for large photos
+        image.draft(image.mode, size)
+    try:
+        image.thumbnail(size, Image.ANTIALIAS)
+        scaled_contents = io.BytesIO()
+        if extension == "JPEG":
+            # default quality is 75 which is too low
+            image.save(scaled_contents, extension, quality=90)
+        else:
+            image.save(scaled_contents, extension)
+    except (IOError, ValueError):
+        raise InvalidImage()
+    return scaled_contents.getvalue()
+
+
+class ImagePipeline(object):
+    """
+    Scales images in `processes` processes and uploads them to S3 from a
+    few threads sharing one client.
+
+    Like `EventBuffer`, the pools are created lazily in each process as
+    gunicorn forks after importing the app, `processes` defaults to the
+    IMAGE_PROCESSES setting.
+    """
+    def __init__(self, processes=None, upload_threads=8):
+        self.processes = processes
+        self.upload_threads = upload_threads
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            if self.processes is None:
+                self.processes = current_app.config["IMAGE_PROCESSES"]
+            self.process_pool = ProcessPoolExecutor(max_workers=self.processes)
+            self.thread_pool = ThreadPoolExecutor(max_workers=self.upload_threads)
+            self.s3_client = boto3.client("s3")
+            self.pid = os.getpid()
+
+    def _replace_process_pool(self, broken_pool):
+        """
+        Replaces the pool after one of its processes died, unless another
+        request already did
+        """
+        with self.lock:
+            if self.process_pool is broken_pool:
+                broken_pool.shutdown(wait=False)
+                self.process_pool = ProcessPoolExecutor(max_workers=self.processes)
+
+    def scale(self, contents, extension, size, retries=1):
+        """
+        Scales the image in the pool, raises `InvalidImage` if it can't be
+        decoded and `ImageScalingFailed` if that takes longer than
+        IMAGE_SCALE_TIMEOUT or the pool breaks again after `retries`.
+        A process dying breaks the pool for all the images being scaled in
+        it: they are all retried in a new one.
+        """
+        self._ensure_started()
+        pool = self.process_pool
+        try:
+            future = pool.submit(
+                scale_image, contents, extension, size, current_app.config["IMAGE_MAX_PIXELS"]
+            )
+            return future.result(timeout=current_app.config["IMAGE_SCALE_TIMEOUT"])
+        except BrokenProcessPool as e:
+            LOG.error("Could not scale a %s image of %d bytes: %r", extension, len(contents), e)
+            self._replace_process_pool(pool)
+            if retries <= 0:
+                raise ImageScalingFailed()
+            return self.scale(contents, extension, size, retries - 1)
+        except TimeoutError:
+            # The process finishes it in the background, IMAGE_MAX_PIXELS
+            # bounds how long that can be
+            LOG.error("Scaling a %s image of %d bytes timed out", extension, len(contents))
+            future.cancel()
+            raise ImageScalingFailed()
+
+    def _upload(self, bucket_name, filename, contents):
+        # TODO: scrubs exif data
+        response = self.s3_client.put_object(
+            Bucket=bucket_name, Key=filename, Body=contents, ContentType="image",
+            CacheControl='max-age=31536000',  # 1 year
+        )
+        status_code = response["ResponseMetadata"]["HTTPStatusCode"]
+        if status_code != 200:
+            LOG.error("Could not store %s in %s: status_code: %s", filename, bucket_name, status_code)
+            return False
+        return True
+
+    def upload(self, bucket_name, files):
+        """
+        Uploads the `(filename, contents)` at the same time, returns
+        whether all of them were stored
+        """
+        self._ensure_started()
+        futures = [
+            self.thread_pool.submit(self._upload, bucket_name, filename, contents)
+            for filename, contents in files
+        ]
+        return all([f.result() for f in futures])
+
+
+pipeline = ImagePipeline()
@@ -0,0 +1,147 @@
+from datetime import datetime, timedelta
+import logging
+import time
+
+from flask import current_app
+from mailjet_rest import Client
+from sqlalchemy.dialects.postgresql import insert
+
+from ..setup import db
+from ..models.mailjet import Message as MailjetMessage, OutboxMessage
+
+
+LOG = logging.getLogger(__name__)
+
+# Mailjet accepts up to 50 messages per call of the send API
+MAX_BATCH_SIZE = 50
+
+_client = None
+
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = Client(auth=(current_app.config["MAILJET_API_KEY"], current_app.config["MAILJET_API_SECRET"]))
+    return _client
+
+
+def count_recipients(payload):
+    return sum(
+        len([x for x in payload.get(field, "").split(",") if x.strip()])
+        for field in ["To", "Cc", "Bcc"]
+    )
+
+
+def _send(messages):
+    """
+    Sends the messages in one call and returns the response. Raises if
+    mailjet didn't accept them.
+    """
+    response = get_client().send.create(data={"Messages": [m.payload for m in messages]})
+    if response.status_code != 200:
+        raise ValueError("Mailjet returned %d: %s" % (response.status_code, response.text))
+    return response
+
+
+def _split_sent(messages, response):
+    """Returns the `Sent` entries of each message"""
+    # Mailjet returns one entry per recipient, in the order of the messages
+    sent = response.json()["Sent"]
+    results = []
+    for m in messages:
+        count = count_recipients(m.payload)
+        results.append(sent[:count])
+        sent = sent[count:]
+    return results
+
+
+def _record_sent(messages, results):
+    rows = [
+        dict(id=sent[0]["MessageID"], json_response={"Sent": sent}, message_reason=m.message_reason)
+        for m, sent in zip(messages, results) if sent
+    ]
+    if rows:
+        # We had issues where the message ID was already in our db
+        db.session.execute(
+            insert(MailjetMessage.__table__).values(rows).on_conflict_do_nothing(index_elements=["id"])
+        )
+    OutboxMessage.query\
+        .filter(OutboxMessage.id.in_([m.id for m in messages]))\
+        .delete(synchronize_session=False)
+
+
+def _record_response(messages, response):
+    """
+    Records the messages mailjet accepted. If that fails they are still
+    removed from the outbox: sending them again would duplicate the emails.
+    """
+    try:
+        with db.session.begin_nested():
+            _record_sent(messages, _split_sent(messages, response))
+    except Exception:
+        LOG.exception("Could not record %d messages sent by Mailjet", len(messages))
+        OutboxMessage.query\
+            .filter(OutboxMessage.id.in_([m.id for m in messages]))\
+            .delete(synchronize_session=False)
+
+
+def _record_failure(messages, error, max_attempts):
+    LOG.warn("Mailjet failed to send %d messages: %r", len(messages), error)
+    now = datetime.utcnow()
+    for m in messages:
+        m.attempts += 1
+        m.last_error = repr(error)
+        # 1 min, 2 min, 4 min...
+        m.next_attempt_at = now + timedelta(minutes=2 ** (m.attempts - 1))
+        if m.attempts >= max_attempts:
+            LOG.error("Giving up on outbox message %d after %d attempts", m.id, m.attempts)
+
+
+def send_outbox(batch_size=MAX_BATCH_SIZE, max_attempts=5):
+    """
+    Sends one batch of the due messages of the outbox. Rows are locked
+    while being sent so several consumers can run at the same time.
+    Returns the number of messages that were due.
+    """
+    messages = OutboxMessage.query\
+        .filter(OutboxMessage.next_attempt_at <= datetime.utcnow())\
+        .filter(OutboxMessage.attempts < max_attempts)\
+        .order_by(OutboxMessage.next_attempt_at)\
+        .limit(min(batch_size, MAX_BATCH_SIZE))\
+        .with_for_update(skip_locked=True)\
+        .all()
+    if not messages:
+        db.session.commit()
+        return 0
+
+    try:
+        response = _send(messages)
+    except Exception as e:
+        if len(messages) == 1:
+            _record_failure(messages, e, max_attempts)
+        else:
+            # A single invalid message fails the whole call so we retry them
+            # one by one to find which one it was
+            for m in messages:
+                try:
+                    response = _send([m])
+                except Exception as error:
+                    _record_failure([m], error, max_attempts)
+                else:
+                    _record_response([m], response)
+    else:
+        _record_response(messages, response)
+
+    db.session.commit()
+    return len(messages)
+
+
+def send_outbox_forever(poll_interval=5):
+    while True:
+        try:
+            if send_outbox() == 0:
+                time.sleep(poll_interval)
+        except Exception:
+            LOG.exception("Sending the outbox failed")
+            db.session.rollback()
+            time.sleep(poll_interval)
@@ -3,11 +3,10 @@ import logging
 
 from flask import current_app, render_template
 from flask_mail import Message
-from mailjet_rest import Client
 from .tokens import create_expiring_jwt
 
 from ..setup import mail, db
-from ..models.mailjet import Message as MailjetMessage
+from ..models.mailjet import OutboxMessage
 
 
 LOG = logging.getLogger(__name__)
@@ -43,7 +42,6 @@ def send_email(to, subject: str, text_body, html_body, reason, **kwargs):
         return
 
     app = current_app._get_current_object()
-    # Sent in a thread to avoid timeout as the call is blocking
     # Don't use mailjet when not in prod
     if not app.config["PRODUCTION"]:
         msg = Message(subject, recipients=to, bcc=kwargs.get("bcc", None))
@@ -72,33 +70,8 @@ def send_email(to, subject: str, text_body, html_body, reason, **kwargs):
     if "replyTo" in kwargs:
         data.update({"Headers": {"Reply-To": kwargs["replyTo"]}})
 
-    def send_async():
-        mailjet = Client(auth=(app.config["MAILJET_API_KEY"], app.config["MAILJET_API_SECRET"]))
-
-        # Response of send.create is this:
-        # {'Sent': [{'Email': 'tom+3@wearewizards.io', 'MessageID': 19421835755008714}]}
-        try:
-            response = mailjet.send.create(data=data)
-            result = response.json()
-            # We had issues where the message ID was already in our db
-            if not MailjetMessage.query.get(result['Sent'][0]['MessageID']):
-                db.session.add(
-                    MailjetMessage(
-                        id=result['Sent'][0]['MessageID'],
-                        json_response=result,
-                        message_reason=reason,
-                    )
-                )
-                db.session.commit()
-        except Exception as e:
-            db.session.rollback()
-            # Mailjet can fail and we'd get an invalid json response, log that instead of throwing
-            LOG.warn("Mailjet failed in giving us info: %r - %r" % (e, response.status_code))
-
-    # Send in thread so we aren't blocking users on signup. If this
-    # fails users will still be able to re-send their activation mail
-    # with the button in settings.
-    Thread(target=send_async).start()
+    # Sent by `manage.py send_emails` once the current transaction commits
+    db.session.add(OutboxMessage(payload=data, message_reason=reason))
 
 
 def send_activation_email(to: str, **kwargs):
@@ -1,24 +1,123 @@
+import atexit
+import logging
 import os
-from threading import Thread
+import queue
+import threading
+import time
 
 import mixpanel
 
 from app.models.companies import Company
 
 
-def send(consumer, endpoint, message):
-    consumer.send(endpoint, message)
+LOG = logging.getLogger(__name__)
 
 
-class ThreadConsumer(object):
-    def __init__(self):
-        self.consumer = mixpanel.Consumer()
+class QueueConsumer(object):
+    """
+    Mixpanel consumer sending messages from a single background thread in
+    batches of up to `batch_size` (50 is the most mixpanel accepts).
 
-    def send(self, endpoint, message):
-        thr = Thread(target=send, args=(self.consumer, endpoint, message, ))
-        thr.start()
+    The queue is bounded: `send` waits at most `put_timeout` seconds for some
+    room and drops the message otherwise, same as a batch mixpanel refuses.
+    Tracking is not worth slowing down or failing a request for.
+
+    Like `EventBuffer`, the thread is started lazily in each process as
+    gunicorn forks after importing the app.
+    """
+    def __init__(self, max_size=10000, batch_size=50, flush_interval=1.0, put_timeout=0.01,
+                 request_timeout=5, events_url=None, people_url=None, import_url=None):
+        self.consumer = mixpanel.Consumer(
+            events_url=events_url, people_url=people_url, import_url=import_url,
+            request_timeout=request_timeout,
+        )
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.dropped = 0
+        self.pid = None
+        self.lock = threading.Lock()
+        atexit.register(self.stop)
+
+    def _ensure_started(self):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.queue = queue.Queue(maxsize=self.max_size)
+            self.stopping = threading.Event()
+            self.thread = threading.Thread(target=self._run, name="mixpanel-flusher", daemon=True)
+            self.thread.start()
+            self.pid = os.getpid()
+
+    def send(self, endpoint, json_message, api_key=None):
+        """`api_key` is only given for imports (`Mixpanel.import_data`)"""
+        self._ensure_started()
+        try:
+            self.queue.put((endpoint, json_message, api_key), timeout=self.put_timeout)
+        except queue.Full:
+            self._drop(1, "queue full")
+
+    def _drop(self, count, reason):
+        self.dropped += count
+        LOG.warning("Dropped %d mixpanel messages (%s), %d so far", count, reason, self.dropped)
+
+    def _take_batch(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size and not self.stopping.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                # Short waits so that stopping doesn't wait for a full interval
+                batch.append(self.queue.get(timeout=min(remaining, 0.1)))
+            except queue.Empty:
+                continue
+        return batch
+
+    def _run(self):
+        while not self.stopping.is_set():
+            batch = self._take_batch()
+            if batch:
+                self.flush(batch)
+
+    def flush(self, batch):
+        by_endpoint = {}  # type: dict
+        for endpoint, message, api_key in batch:
+            by_endpoint.setdefault((endpoint, api_key), []).append(message)
+
+        for (endpoint, api_key), messages in by_endpoint.items():
+            try:
+                self.consumer.send(endpoint, "[%s]" % ",".join(messages), api_key=api_key)
+            except mixpanel.MixpanelException as e:
+                self._drop(len(messages), e)
+
+    def stop(self):
+        """Called on exit: sends whatever is left in the queue"""
+        if self.pid != os.getpid():
+            return
+        self.stopping.set()
+        self.thread.join(timeout=30)
+
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+            if len(batch) >= self.batch_size:
+                self.flush(batch)
+                batch = []
+        if batch:
+            self.flush(batch)
 
 
 # Docs at
 # https://mixpanel.com/help/reference/python
-mp = mixpanel.Mixpanel(os.environ.get("MIXPANEL_TOKEN", "ba1ffdaa6512aba4fb249e3df17707d9"), ThreadConsumer())
+mp = mixpanel.Mixpanel(
+    os.environ.get("MIXPANEL_TOKEN", "ba1ffdaa6512aba4fb249e3df17707d9"),
+    QueueConsumer(max_size=int(os.environ.get("MIXPANEL_QUEUE_SIZE", 10000))),
+)
@@ -0,0 +1,145 @@
+"""
+Asks the PDF renderer to render the PDF of a proposal when it is shared or
+signed so that the download is served from its cache.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+LOG = logging.getLogger(__name__)
+
+UNSIGNED = "u"
+SIGNED = "s"
+
+
+class PrerenderClient(object):
+    """
+    Posts the render jobs from a few threads sharing one HTTP session.
+    At most `max_pending` renders are in flight, past that new ones are
+    dropped: the PDF is then rendered when downloaded.
+    A PDF already in flight is not asked for again.
+
+    Like `EventBuffer`, the threads are started lazily in each process as
+    gunicorn forks after importing the app.
+    """
+    def __init__(self, workers=2, max_pending=100, timeout=(3, 10)):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.pid = None
+        self.lock = threading.Lock()
+        self.counters = {
+            "submitted": 0, "deduplicated": 0, "dropped": 0, "rendered": 0, "failed": 0, "totalLatency": 0.0,
+        }
+
+    def _ensure_started(self):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.executor = ThreadPoolExecutor(max_workers=self.workers)
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+            self.session.mount("https://", adapter)
+            self.session.mount("http://", adapter)
+            self.slots = threading.BoundedSemaphore(self.max_pending)
+            self.pending = set()  # type: set
+            self.pid = os.getpid()
+
+    def submit(self, base_url, share_uid, version, signed, wait=False, block=False):
+        """
+        Queues the render of the PDF, returns whether it was.
+        With `wait` the thread waits for the render to be done instead of
+        only queueing it, with `block` the caller waits for a free slot
+        instead of dropping the render.
+        """
+        self._ensure_started()
+        key = (share_uid, version, signed)
+        with self.lock:
+            if key in self.pending:
+                self.counters["deduplicated"] += 1
+                return False
+            self.pending.add(key)
+
+        if not self.slots.acquire(blocking=block):
+            LOG.warning("Too many PDF pre-renders in flight, dropping %s", key)
+            with self.lock:
+                self.pending.discard(key)
+                self.counters["dropped"] += 1
+            return False
+
+        with self.lock:
+            self.counters["submitted"] += 1
+        future = self.executor.submit(self._render, base_url, key, wait)
+        future.add_done_callback(lambda _: self._done(key))
+        return True
+
+    def _done(self, key):
+        with self.lock:
+            self.pending.discard(key)
+        self.slots.release()
+
+    def _render(self, base_url, key, wait):
+        url = "{}/{}/{}/{}".format(base_url, *key)
+        start = time.monotonic()
+        try:
+            response = self.session.post(url + "/jobs", params={"priority": "prerender"}, timeout=self.timeout)
+            response.raise_for_status()
+            status = response.json()["status"]
+            while wait and status in ("queued", "running"):
+                response = self.session.get(
+                    url + "/status", params={"wait": 60}, timeout=(self.timeout[0], 70)
+                )
+                response.raise_for_status()
+                status = response.json()["status"]
+            ok = status != "failed"
+        except (requests.RequestException, ValueError, KeyError) as e:
+            LOG.warning("PDF pre-render of %s failed: %r", url, e)
+            ok = False
+
+        with self.lock:
+            self.counters["totalLatency"] += time.monotonic() - start
+            self.counters["rendered" if ok else "failed"] += 1
+
+    def join(self):
+        """Waits for everything in flight"""
+        self._ensure_started()
+        for _ in range(self.max_pending):
+            self.slots.acquire()
+        for _ in range(self.max_pending):
+            self.slots.release()
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, pending=len(self.pending) if self.pid == os.getpid() else 0)
+
+
+client = PrerenderClient()
+
+
+def warm_signed_pdfs(base_url, workers=4):
+    """
+    Renders the PDF of every signed proposal, `workers` at a time.
+    Returns the client for its stats.
+    """
+    from ..models.proposals import Proposal
+    from ..models.shared_proposals import SharedProposal
+    from ..models.signatures import Signature
+    from ..setup import db
+
+    warmer = PrerenderClient(workers=workers, max_pending=workers)
+    signed = db.session.query(Proposal.share_uid, SharedProposal.version)\
+        .join(SharedProposal, SharedProposal.proposal_id == Proposal.id)\
+        .join(Signature, Signature.shared_proposal_id == SharedProposal.id)\
+        .order_by(SharedProposal.id)
+    for share_uid, version in signed:
+        warmer.submit(base_url, share_uid, version, SIGNED, wait=True, block=True)
+    warmer.join()
+    return warmer
@@ -1,32 +1,55 @@
+import abc
+import itertools
+import logging
+import re
 import time
 import datetime
+from typing import NamedTuple, List, Dict
 
 from elasticsearch import Elasticsearch
-from elasticsearch.helpers import bulk
+from elasticsearch.helpers import bulk, parallel_bulk, streaming_bulk
 from elasticsearch_dsl import Search, Q
 from flask import current_app
+from sqlalchemy import text
 
-from ..models.proposals import Proposal
+from ..setup import db
+from ..models.blocks import Block
+from ..models.proposals import Proposal, extract_search_content
+from ..models.search import SearchDirtyProposal
 
 
 DOC_TYPE = "section"
+# Number of documents sent per bulk request
+BULK_CHUNK_SIZE = 500
+# Number of proposal ids per terms filter
+TERMS_CHUNK_SIZE = 1000
+# Number of blocks fetched at a time when streaming
+STREAM_BATCH_SIZE = 2000
+# Advisory lock held by `reindex` to pause `index_dirty_proposals`
+REINDEX_LOCK_KEY = 74201
+# With the proposal id as second key, held while indexing a proposal
+PROPOSAL_LOCK_NAMESPACE = 74202
 
 
 def get_client():
     return Elasticsearch([current_app.config["ES_SERVER"]])
 
 
-def create_index():
+def create_index(index=None, number_of_replicas=None):
     """
     Uses a edge ngram analyzer so that we can search efficiently
     """
-    index = current_app.config["ES_IMPORT_INDEX"]
+    if index is None:
+        index = current_app.config["ES_IMPORT_INDEX"]
+    if number_of_replicas is None:
+        number_of_replicas = current_app.config["ES_NUMBER_OF_REPLICAS"]
     client = get_client()
 
     # Ensure index exists
     client.indices.create(index=index, body={
         "settings": {
-            "number_of_shards": 1,  # TODO: do we need more?
+            "number_of_shards": current_app.config["ES_NUMBER_OF_SHARDS"],
+            "number_of_replicas": number_of_replicas,
             "analysis": {
                 "filter": {
                     "edge_ngram_filter": {
@@ -64,79 +87,186 @@ def create_index():
     }, ignore=400)
 
 
+def _delete_actions(index, hits):
+    for hit in hits:
+        yield {
+            "_op_type": "delete",
+            "_index": index,
+            "_type": DOC_TYPE,
+            "_id": hit.meta.id,
+        }
+
+
 def _delete_proposals_from_index(proposal_ids):
     """
     Delete all the documents with the proposal_id set to one of the ids.
-    ES removed delete_by_query so we have to query first to get the doc ids
+    ES removed delete_by_query so we have to query first to get the doc ids,
+    scrolled through and deleted as they come
     """
     index = current_app.config["ES_IMPORT_INDEX"]
     client = get_client()
 
-    response = Search(using=client, index=index)\
-        .filter("terms", proposal_id=proposal_ids)\
-        .fields(["id"])\
-        .execute()
-
-    block_uids = [x.meta.id for x in response.hits]
-
-    if len(block_uids) == 0:
-        return
-
-    bulk_data = []
-    for _id in block_uids:
-        bulk_data.append({
-            "_op_type": "delete",
-            "_index": index,
-            "_type": DOC_TYPE,
-            "_id": _id,
-        })
-    bulk(client, bulk_data)
+    for i in range(0, len(proposal_ids), TERMS_CHUNK_SIZE):
+        hits = Search(using=client, index=index)\
+            .filter("terms", proposal_id=proposal_ids[i:i + TERMS_CHUNK_SIZE])\
+            .source(False)\
+            .scan()
+        bulk(client, _delete_actions(index, hits), chunk_size=BULK_CHUNK_SIZE)
 
 
 def ingest_proposals(ingest_all=False):
     """
-    If ingest_all is true, it will push every single proposal blocks to ES
+    If ingest_all is true, it will push every single proposal blocks to ES,
+    streamed so memory doesn't grow with the number of proposals. Existing
+    documents are overwritten but not deleted, see `reindex` for that.
     Otherwise it will only take the ones updated in the last 10min
     """
-    client = get_client()
-    index = current_app.config["ES_IMPORT_INDEX"]
-
     if ingest_all:
-        proposals = Proposal.query.all()
-    else:
-        cutoff = datetime.datetime.utcnow() - datetime.timedelta(minutes=10)
-        proposals = Proposal.query.filter(Proposal.updated_at >= cutoff).all()
+        client = get_client()
+        index = current_app.config["ES_IMPORT_INDEX"]
+        for ok, result in streaming_bulk(client, _stream_actions(index), chunk_size=BULK_CHUNK_SIZE):
+            if not ok:
+                raise Exception("Failed to index {}".format(result))
+        return
+
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(minutes=10)
+    proposals = Proposal.query.filter(Proposal.updated_at >= cutoff).all()
 
     if len(proposals) == 0:
         return
 
-    proposal_ids = [p.id for p in proposals]
+    _index_proposals([p.id for p in proposals], proposals)
+
+
+def _index_proposals(proposal_ids, proposals):
+    """
+    Replaces the documents of `proposal_ids` by the ones of `proposals`,
+    ids without a proposal are only removed
+    """
+    client = get_client()
+    index = current_app.config["ES_IMPORT_INDEX"]
 
     # First we remove all the proposals we are going to update from ES
     # so we don't have to find out which block was removed or anything
     _delete_proposals_from_index(proposal_ids)
 
-    bulk_data = []
+    bulk(client, _index_actions(index, proposals), chunk_size=BULK_CHUNK_SIZE)
+
+
+def _index_action(index, proposal_id, company_id, proposal_title, content):
+    return {
+        "_op_type": "index",
+        "_index": index,
+        "_type": DOC_TYPE,
+        "_id": content[0],
+        "_source": {
+            "company_id": company_id,
+            "proposal_id": proposal_id,
+            "proposal_title": proposal_title,
+            "level": content[1],
+            "title": content[2],
+            "content": content[3],
+        }
+    }
+
+
+def _index_actions(index, proposals):
     for proposal in proposals:
         for content in proposal.extract_search_content():
-            bulk_data.append({
-                "_op_type": "index",
-                "_index": index,
-                "_type": DOC_TYPE,
-                "_id": content[0],
-                "_source": {
-                    "company_id": proposal.company_id,
-                    "proposal_id": proposal.id,
-                    "proposal_title": proposal.title,
-                    "level": content[1],
-                    "title": content[2],
-                    "content": content[3],
-                }
-            })
+            yield _index_action(index, proposal.id, proposal.company_id, proposal.title, content)
 
-    if not bulk_data:
-        return
-    bulk(client, bulk_data)
+
+def stream_documents(proposal_ids=None, after_id=None, until_id=None):
+    """
+    Yields the (proposal_id, company_id, proposal_title, content) of the
+    sections of the proposals in `proposal_ids` or with an id in
+    (after_id, until_id], `content` as returned by `extract_search_content`.
+
+    Read with a single server-side cursor over their blocks in order: only
+    the blocks of one proposal are in memory at a time.
+    """
+    query = db.session.query(
+        Block.proposal_id, Block.uid, Block.type, Block.data, Proposal.company_id, Proposal.title,
+    ).join(Proposal, Block.proposal_id == Proposal.id)
+    if proposal_ids is not None:
+        query = query.filter(Block.proposal_id.in_(proposal_ids))
+    if after_id is not None:
+        query = query.filter(Block.proposal_id > after_id)
+    if until_id is not None:
+        query = query.filter(Block.proposal_id <= until_id)
+    rows = query.order_by(Block.proposal_id, Block.ordering).yield_per(STREAM_BATCH_SIZE)
+
+    for proposal_id, blocks in itertools.groupby(rows, lambda row: row.proposal_id):
+        blocks = list(blocks)
+        for content in extract_search_content(blocks):
+            yield proposal_id, blocks[0].company_id, blocks[0].title, content
+
+
+def _stream_actions(index, after_id=None, until_id=None):
+    for document in stream_documents(after_id=after_id, until_id=until_id):
+        yield _index_action(index, *document)
+
+
+def lock_proposals(proposal_ids):
+    """
+    Locks the indexing of these proposals until the end of the transaction,
+    in id order so that two indexers don't deadlock
+    """
+    db.session.execute(
+        text("""
+            SELECT count(pg_advisory_xact_lock(:namespace, id))
+            FROM (SELECT id FROM unnest(CAST(:ids AS integer[])) AS id ORDER BY id) AS ordered
+        """),
+        {"namespace": PROPOSAL_LOCK_NAMESPACE, "ids": sorted(proposal_ids)}
+    )
+
+
+def index_dirty_proposals(batch_size=100):
+    """
+    Indexes one batch of the proposals in the `SearchDirtyProposal` change
+    log. The entries are deleted in the same transaction that locked them,
+    once indexed, so a crash only means indexing them again.
+    Returns the number of entries consumed, 0 while `reindex` builds a new
+    index: the changes would only go to the index it's replacing.
+    """
+    paused = not db.session.execute(
+        text("SELECT pg_try_advisory_xact_lock_shared(:key)"), {"key": REINDEX_LOCK_KEY}
+    ).scalar()
+    if paused:
+        db.session.commit()
+        return 0
+
+    entries = db.session.query(SearchDirtyProposal.id, SearchDirtyProposal.proposal_id)\
+        .order_by(SearchDirtyProposal.id)\
+        .limit(batch_size)\
+        .with_for_update(skip_locked=True)\
+        .all()
+    if not entries:
+        db.session.commit()
+        return 0
+
+    proposal_ids = sorted(set(proposal_id for _, proposal_id in entries))
+    # Another consumer can have taken other entries of the same proposals:
+    # wait for it so that its index of an older state doesn't land last
+    lock_proposals(proposal_ids)
+    get_backend().index_proposals(proposal_ids)
+
+    SearchDirtyProposal.query\
+        .filter(SearchDirtyProposal.id.in_([entry_id for entry_id, _ in entries]))\
+        .delete(synchronize_session=False)
+    db.session.commit()
+    return len(entries)
+
+
+def index_dirty_proposals_forever(poll_interval=1):
+    while True:
+        try:
+            if index_dirty_proposals() == 0:
+                time.sleep(poll_interval)
+        except Exception:
+            logging.exception("Search indexing failed")
+            db.session.rollback()
+            time.sleep(poll_interval)
 
 
 def cleanup_index():
@@ -146,12 +276,11 @@ def cleanup_index():
     client = get_client()
     index = current_app.config["ES_IMPORT_INDEX"]
 
-    proposals_id = set([p.id for p in Proposal.query.all()])
+    proposal_ids = set(x for x, in db.session.query(Proposal.id).yield_per(10000))
 
-    response = Search(using=client, index=index).fields(["proposal_id"]).execute()
-    es_proposal_ids = set([x.proposal_id[0] for x in response.hits])
-
-    _delete_proposals_from_index(list(es_proposal_ids - proposals_id))
+    hits = Search(using=client, index=index).source(["proposal_id"]).scan()
+    stale = (hit for hit in hits if hit.proposal_id not in proposal_ids)
+    bulk(client, _delete_actions(index, stale), chunk_size=BULK_CHUNK_SIZE)
 
 
 def delete_index():
@@ -160,17 +289,119 @@ def delete_index():
     client.indices.delete(index=index, ignore=[404])
 
 
-def reindex():
+def _get_checkpoint(client, index):
+    """Id of the last proposal ingested in `index` by `reindex`"""
+    mapping = client.indices.get_mapping(index=index, doc_type=DOC_TYPE)
+    return mapping[index]["mappings"][DOC_TYPE].get("_meta", {}).get("reindexed_up_to", 0)
+
+
+def _set_checkpoint(client, index, proposal_id):
+    client.indices.put_mapping(index=index, doc_type=DOC_TYPE, body={
+        "_meta": {"reindexed_up_to": proposal_id},
+    })
+
+
+def _build_index(client, index, start_after, batch_size, workers):
+    """
+    Ingests the proposals after `start_after` by batches of `batch_size`
+    ids, the documents of one batch in memory at a time, checkpointing
+    after each batch, at most
+    ES_REINDEX_PROPOSALS_PER_SECOND proposals per second
     """
-    Deletes the index and recreate it from scratch.
-    ES doesn't actually delete the documents so we could call that method every
-    week or so to keep the index lean
+    min_batch_duration = batch_size / current_app.config["ES_REINDEX_PROPOSALS_PER_SECOND"]
+    last_id = start_after
+    while True:
+        started_at = time.monotonic()
+        ids = db.session.query(Proposal.id)\
+            .filter(Proposal.id > last_id)\
+            .order_by(Proposal.id)\
+            .limit(batch_size)\
+            .all()
+        if not ids:
+            return
+
+        until_id = ids[-1][0]
+        # Read here: parallel_bulk iterates the actions from one of its
+        # threads, which has no app context nor our session. Only the bulk
+        # requests are sent from its threads.
+        actions = list(_stream_actions(index, last_id, until_id))
+        for ok, result in parallel_bulk(client, actions, thread_count=workers, chunk_size=BULK_CHUNK_SIZE):
+            if not ok:
+                raise Exception("Failed to index {}".format(result))
+
+        last_id = until_id
+        _set_checkpoint(client, index, last_id)
+        time.sleep(max(0, min_batch_duration - (time.monotonic() - started_at)))
+
+
+def reindex(resume=False, batch_size=500, workers=4):
     """
-    delete_index()
-    time.sleep(1)
-    create_index()
-    time.sleep(1)
-    ingest_proposals(ingest_all=True)
+    Rebuilds the index without downtime: the proposals are ingested in a
+    new `<alias>-<timestamp>` index, then the alias is moved to it in one
+    atomic operation and the previous indices are deleted.
+
+    The new index has no replica and no refresh while it's built. With
+    `resume`, the build carries on from the last checkpoint of the latest
+    index not yet aliased.
+
+    The change log isn't consumed during the build, the changes made
+    meanwhile are indexed in the new index once aliased. Changes consumed
+    between an interrupted build and its resume are only in the previous
+    index for the proposals before the checkpoint.
+    """
+    # On its own connection, held for the whole build whatever the session does
+    lock_connection = db.engine.connect()
+    lock_connection.execute(text("SELECT pg_advisory_lock(:key)"), key=REINDEX_LOCK_KEY)
+    try:
+        _reindex(resume, batch_size, workers)
+    finally:
+        lock_connection.execute(text("SELECT pg_advisory_unlock(:key)"), key=REINDEX_LOCK_KEY)
+        lock_connection.close()
+
+    # What changed during the build
+    while index_dirty_proposals(batch_size=500) > 0:
+        pass
+    cleanup_index()
+
+
+def _reindex(resume, batch_size, workers):
+    client = get_client()
+    alias = current_app.config["ES_IMPORT_INDEX"]
+    aliased = set(client.indices.get_alias(name=alias, ignore=404).keys()) - {"status", "error"}
+    # Before the first reindex the alias is still an index
+    legacy = not aliased and client.indices.exists(index=alias)
+
+    index_re = re.compile(r"^{}-\d{{20}}$".format(re.escape(alias)))
+    building = sorted(
+        i for i in client.indices.get_settings(index="{}-*".format(alias)).keys()
+        if index_re.match(i) and i not in aliased
+    )
+    if resume and building:
+        index = building[-1]
+        start_after = _get_checkpoint(client, index)
+        logging.info("Resuming %s after proposal %s", index, start_after)
+    else:
+        index = "{}-{}".format(alias, datetime.datetime.utcnow().strftime("%Y%m%d%H%M%S%f"))
+        create_index(index, number_of_replicas=0)
+        start_after = 0
+    client.indices.put_settings(index=index, body={"index": {"refresh_interval": "-1"}})
+
+    _build_index(client, index, start_after, batch_size, workers)
+
+    client.indices.put_settings(index=index, body={"index": {
+        "refresh_interval": "1s",
+        "number_of_replicas": current_app.config["ES_NUMBER_OF_REPLICAS"],
+    }})
+    client.indices.refresh(index=index)
+
+    actions = [{"add": {"index": index, "alias": alias}}]
+    if legacy:
+        # Search is down between the delete and the alias creation, only once
+        client.indices.delete(index=alias)
+    actions += [{"remove": {"index": i, "alias": alias}} for i in aliased]
+    client.indices.update_aliases(body={"actions": actions})
+    for i in set(building + list(aliased)) - {index}:
+        client.indices.delete(index=i, ignore=404)
 
 
 def find(query, company_id, proposal_id):
@@ -187,3 +418,85 @@ def find(query, company_id, proposal_id):
     # Only get the first 20 results
     response = s[:20].execute()
     return response.hits
+
+
+SectionHit = NamedTuple("SectionHit", [
+    ("uid", str),
+    ("level", str),  # h1 or h2
+    ("proposal_title", str),
+    ("title", str),
+    ("content", str),
+    # Highlighted fragments of the fields matched, "title" and/or "content"
+    ("highlight", Dict[str, List[str]]),
+])
+
+
+class SearchBackend(metaclass=abc.ABCMeta):
+    """
+    What section search needs from a search engine, selected with the
+    SEARCH_BACKEND config, see `get_backend`.
+    The change log consumer (`index_dirty_proposals`) is shared.
+    """
+    @abc.abstractmethod
+    def create_index(self):
+        pass
+
+    @abc.abstractmethod
+    def index_proposals(self, proposal_ids):
+        """Replaces the sections of these proposals, removed if deleted"""
+
+    @abc.abstractmethod
+    def ingest_proposals(self, ingest_all=False):
+        pass
+
+    @abc.abstractmethod
+    def cleanup_index(self):
+        """Removes the sections of the proposals deleted"""
+
+    @abc.abstractmethod
+    def reindex(self, resume=False, workers=4):
+        """Rebuilds the index while searches keep being answered"""
+
+    @abc.abstractmethod
+    def find(self, query, company_id, proposal_id):
+        # type: (str, int, str) -> List[SectionHit]
+        """The 20 best sections of the company for that query"""
+
+
+class ElasticsearchBackend(SearchBackend):
+    def create_index(self):
+        create_index()
+
+    def index_proposals(self, proposal_ids):
+        _index_proposals(proposal_ids, Proposal.query.filter(Proposal.id.in_(proposal_ids)).all())
+
+    def ingest_proposals(self, ingest_all=False):
+        ingest_proposals(ingest_all)
+
+    def cleanup_index(self):
+        cleanup_index()
+
+    def reindex(self, resume=False, workers=4):
+        reindex(resume=resume, workers=workers)
+
+    def find(self, query, company_id, proposal_id):
+        return [
+            SectionHit(
+                uid=hit.meta.id,
+                level=hit.level,
+                proposal_title=hit.proposal_title,
+                title=hit.title,
+                content=hit.content,
+                highlight=dict((k, list(v)) for k, v in hit.meta.to_dict().get("highlight", {}).items()),
+            )
+            for hit in find(query, company_id, proposal_id)
+        ]
+
+
+def get_backend():
+    # type: () -> SearchBackend
+    name = current_app.config["SEARCH_BACKEND"]
+    if name == "postgres":
+        from .search_postgres import PostgresBackend
+        return PostgresBackend()
+    return ElasticsearchBackend()
@@ -0,0 +1,171 @@
+"""
+Section search with PostgreSQL full text search, for the deployments
+without elasticsearch.
+
+Words are matched as prefixes like the edge ngram analyzer of the
+elasticsearch index does, and a trigram match on the whole query catches
+the text in the middle of a word.
+"""
+import re
+
+from sqlalchemy import text
+
+from ..setup import db
+from ..models.proposals import Proposal
+from ..models.search import SearchSection
+from .search import SearchBackend, SectionHit, stream_documents, lock_proposals
+
+
+# Number of sections inserted per statement
+INSERT_CHUNK_SIZE = 500
+
+HIGHLIGHT_OPTIONS = "StartSel=\"<span class='search-highlight'>\", StopSel=</span>"
+
+# Weights of D, C, B and A in that order: the title (A, 1.0) counts 4 times
+# more than the content (B, 0.25) like `title^4` in elasticsearch
+RANK_WEIGHTS = "{0.1, 0.2, 0.25, 1.0}"
+
+INSERT_SQL = text("""
+    INSERT INTO search_sections (uid, proposal_id, company_id, proposal_title, level, title, content, document)
+    VALUES (
+        :uid, :proposal_id, :company_id, :proposal_title, :level, :title, :content,
+        setweight(to_tsvector('simple', :title), 'A') || setweight(to_tsvector('simple', :content), 'B')
+    )
+    ON CONFLICT (uid) DO UPDATE SET
+        proposal_id = EXCLUDED.proposal_id,
+        company_id = EXCLUDED.company_id,
+        proposal_title = EXCLUDED.proposal_title,
+        level = EXCLUDED.level,
+        title = EXCLUDED.title,
+        content = EXCLUDED.content,
+        document = EXCLUDED.document
+""")
+
+# Ranked first, the highlights are only computed for the 20 kept
+FIND_SQL = text("""
+    SELECT
+        uid, level, proposal_title, title, content,
+        to_tsvector('simple', title) @@ query OR title ILIKE :pattern AS title_matched,
+        to_tsvector('simple', content) @@ query OR content ILIKE :pattern AS content_matched,
+        ts_headline('simple', title, query, :title_options) AS title_highlight,
+        ts_headline('simple', content, query, :content_options) AS content_highlight
+    FROM (
+        SELECT s.*, q.query
+        FROM search_sections s, to_tsquery('simple', :tsquery) q(query)
+        WHERE s.company_id = :company_id
+            AND (s.document @@ q.query OR s.title ILIKE :pattern OR s.content ILIKE :pattern)
+        ORDER BY ts_rank(CAST(:weights AS float4[]), s.document, q.query) + similarity(s.title, :query) DESC, s.uid
+        LIMIT 20
+    ) best
+""")
+
+
+def to_prefix_tsquery(query):
+    """`ab cde` -> `ab:* | cde:*`, any word of the query as a prefix"""
+    return " | ".join("{}:*".format(word) for word in re.findall(r"\w+", query.lower()))
+
+
+def _highlight_pattern(highlight, query):
+    """ts_headline doesn't know about the substring matches"""
+    if "search-highlight" in highlight:
+        return highlight
+    return re.sub(
+        "({})".format(re.escape(query)), "<span class='search-highlight'>\\1</span>", highlight,
+        flags=re.IGNORECASE
+    )
+
+
+class PostgresBackend(SearchBackend):
+    def create_index(self):
+        """The table is created by the migrations"""
+
+    def _insert(self, documents):
+        chunk = []
+        for proposal_id, company_id, proposal_title, content in documents:
+            chunk.append({
+                "uid": content[0],
+                "proposal_id": proposal_id,
+                "company_id": company_id,
+                "proposal_title": proposal_title,
+                "level": content[1],
+                "title": content[2],
+                "content": content[3],
+            })
+            if len(chunk) == INSERT_CHUNK_SIZE:
+                db.session.execute(INSERT_SQL, chunk)
+                chunk = []
+        if chunk:
+            db.session.execute(INSERT_SQL, chunk)
+
+    def index_proposals(self, proposal_ids):
+        if not proposal_ids:
+            return
+        SearchSection.query\
+            .filter(SearchSection.proposal_id.in_(proposal_ids))\
+            .delete(synchronize_session=False)
+        self._insert(stream_documents(proposal_ids=proposal_ids))
+
+    def ingest_proposals(self, ingest_all=False):
+        if ingest_all:
+            self.reindex()
+            return
+        # The change log consumer keeps the sections up to date
+        from .search import index_dirty_proposals
+        while index_dirty_proposals(batch_size=500) > 0:
+            pass
+
+    def cleanup_index(self):
+        """Deleting a proposal deletes its sections (ON DELETE CASCADE)"""
+
+    def reindex(self, resume=False, workers=4, batch_size=500):
+        """
+        Rewrites the sections of `batch_size` proposals per transaction, in
+        id order: searches see the previous sections of a batch until it's
+        committed. The sections of deleted proposals are already gone so
+        there's nothing to resume, `resume` and `workers` are ignored.
+        """
+        last_id = 0
+        while True:
+            ids = [x for x, in db.session.query(Proposal.id)
+                   .filter(Proposal.id > last_id)
+                   .order_by(Proposal.id)
+                   .limit(batch_size)]
+            if not ids:
+                return
+            lock_proposals(ids)
+            self.index_proposals(ids)
+            db.session.commit()
+            last_id = ids[-1]
+
+    def find(self, query, company_id, proposal_id):
+        tsquery = to_prefix_tsquery(query)
+        if not tsquery:
+            return []
+
+        pattern = "%{}%".format(query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_"))
+        rows = db.session.execute(FIND_SQL, {
+            "tsquery": tsquery,
+            "query": query,
+            "pattern": pattern,
+            "company_id": company_id,
+            "weights": RANK_WEIGHTS,
+            "title_options": HIGHLIGHT_OPTIONS + ", HighlightAll=TRUE",
+            "content_options": HIGHLIGHT_OPTIONS + ", MinWords=10, MaxWords=25",
+        })
+
+        hits = []
+        for row in rows:
+            highlight = {}
+            if row.title_matched:
+                highlight["title"] = [_highlight_pattern(row.title_highlight, query)]
+            if row.content_matched:
+                highlight["content"] = [_highlight_pattern(row.content_highlight, query)]
+            hits.append(SectionHit(
+                uid=row.uid,
+                level=row.level,
+                proposal_title=row.proposal_title,
+                title=row.title,
+                content=row.content,
+                highlight=highlight,
+            ))
+        return hits
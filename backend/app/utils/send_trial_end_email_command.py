@@ -29,6 +29,7 @@ def send_trial_end_emails_command():
 
             admin.trial_end_email_sent = True
             db.session.add(admin)
-            db.session.commit()
             print("sending to %s" % admin.email)
             send_trial_end_email(admin.email, **{"username": admin.username})
+            # The email is queued in the same transaction
+            db.session.commit()
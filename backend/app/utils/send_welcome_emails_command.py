@@ -15,7 +15,8 @@ def send_welcome_emails_command():
     for x in candidates:
         x.welcome_email_sent = True
         db.session.add(x)
-        db.session.commit()
         print("sending to %s", x.email)
 
         send_welcome_email(x.email)
+        # The email is queued in the same transaction
+        db.session.commit()
@@ -0,0 +1,106 @@
+"""
+Posts the notifications of the slack integrations (views, comments,
+signatures) from background threads so a slow webhook doesn't hold a
+request.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+LOG = logging.getLogger(__name__)
+
+
+class SlackDispatcher(object):
+    """
+    Bounded queue drained by `workers` threads sharing one HTTP session.
+    Messages posted with a `coalesce_key` are only sent once per
+    `coalesce_window` seconds: a reader refreshing a proposal shouldn't
+    notify the channel every time.
+
+    Like `EventBuffer`, the threads are started lazily in each process as
+    gunicorn forks after importing the app.
+    """
+    def __init__(self, workers=2, max_size=1000, timeout=5, coalesce_window=600):
+        self.workers = workers
+        self.max_size = max_size
+        self.timeout = timeout
+        self.coalesce_window = coalesce_window
+        self.pid = None
+        self.lock = threading.Lock()
+        # coalesce key -> when it can be sent again
+        self.recent = {}  # type: dict
+        atexit.register(self.stop)
+
+    def _ensure_started(self):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.queue = queue.Queue(maxsize=self.max_size)
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.workers, pool_maxsize=self.workers)
+            self.session.mount("https://", adapter)
+            self.session.mount("http://", adapter)
+            self.threads = [
+                threading.Thread(target=self._run, name="slack-dispatcher", daemon=True)
+                for _ in range(self.workers)
+            ]
+            for thread in self.threads:
+                thread.start()
+            self.pid = os.getpid()
+
+    def _should_coalesce(self, coalesce_key):
+        now = time.monotonic()
+        if len(self.recent) > 10000:
+            self.recent = dict((k, v) for k, v in self.recent.items() if v > now)
+        if self.recent.get(coalesce_key, 0) > now:
+            return True
+        self.recent[coalesce_key] = now + self.coalesce_window
+        return False
+
+    def post(self, integration_id, webhook_url, payload, coalesce_key=None):
+        """Never blocks: the message is dropped if the queue is full"""
+        self._ensure_started()
+        with self.lock:
+            if coalesce_key is not None and self._should_coalesce(coalesce_key):
+                return
+        try:
+            self.queue.put_nowait((integration_id, webhook_url, payload))
+        except queue.Full:
+            LOG.warning("Slack queue full, dropping message for integration %s", integration_id)
+
+    def _send(self, integration_id, webhook_url, payload):
+        try:
+            response = self.session.post(webhook_url, json=payload, timeout=self.timeout)
+            error = None if response.status_code == 200 else response.text
+        except requests.RequestException as e:
+            error = repr(e)
+        if error is not None:
+            LOG.warning("Slack post failed for integration %s: %s", integration_id, error)
+
+    def _run(self):
+        while True:
+            message = self.queue.get()
+            if message is None:
+                return
+            self._send(*message)
+
+    def stop(self, timeout=10):
+        """Called on exit: sends whatever is left in the queue"""
+        if self.pid != os.getpid():
+            return
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join(timeout=timeout)
+
+
+dispatcher = SlackDispatcher()
@@ -1,52 +1,198 @@
-import threading
-import requests
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 import logging
-from retrying import retry
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
 import app.utils.signalling as signalling
 
 # DO NOT DELETE THIS: blinker uses weak references and without anything holding
 # onto the receivers they will be GCed and blinker will never call the signal.
 WEAK_REF_HOLD = []
 
-# To be executed in a thread. Retries a few times.
+# zapier say that we should delete our endpoint on those
+GONE_STATUS_CODES = (401, 410)
+
+
 def build_trigger(event: str):
     """
     This function takes an event name and returns a new function which can be
     connected to a blinker signal.
 
-    The new function will look up the rest hook for the event name and then
-    trigger that with some light retry logic.
+    The new function queues the payload for every rest hook of the event in
+    `ZapierTriggerEvent`, as part of the current transaction: nothing is
+    posted if the change that triggered it is rolled back.
+    `Dispatcher` does the posting.
     """
-    from ..models.zapier import ZapierHookEndpoint
+    from sqlalchemy import select, literal
+    from sqlalchemy.dialects.postgresql import JSONB
+    from ..models.zapier import ZapierHookEndpoint, ZapierTriggerEvent
     from ..setup import db
 
     def trigger_receiver(sender, company, payload):
-        # make a list to avoid DB access in thread
-        company_name = str(company)
-        endpoints = list(x.target_url for x in ZapierHookEndpoint.query.filter_by(company_id=company.id, event=event))
+        logging.info("Zapier queueing for {}: {}({})".format(company, event, payload))
+        # One statement whatever the number of zaps
+        endpoints = select([
+            ZapierHookEndpoint.company_id,
+            ZapierHookEndpoint.id,
+            literal(event),
+            literal(payload, type_=JSONB),
+            literal([], type_=JSONB),
+        ]).where(ZapierHookEndpoint.company_id == company.id).where(ZapierHookEndpoint.event == event)
+
+        db.session.execute(ZapierTriggerEvent.__table__.insert().from_select(
+            ["company_id", "endpoint_id", "event", "data", "post_event_log"], endpoints
+        ))
 
-        # log non-action as well, interesting for debugging
-        if not endpoints:
-            logging.info("No hooks for  for {}: {}({})".format(company_name, event, payload))
+    WEAK_REF_HOLD.append(trigger_receiver) # DO NOT DELETE THIS LINE!
 
-        for target_url in endpoints:
-            logging.info("Zapier triggering for {}: {}({})".format(company_name, event, payload))
+    return trigger_receiver
 
-            @retry(wait_exponential_multiplier=1000, stop_max_attempt_number=3)
-            def trigger():
-                response = requests.post(target_url, json=payload)
-                # zapier say that we should delete our endpoint on 401 gone:
-                logging.info("Zapier triggering for {}: {}({})".format(company_name, event, payload))
-                if response.status_code == 401:
-                    logging.error("We should delete %s but we're in a thread so we lost the DB context", target_url)
-                    # TODO, following doesn't work:
-                    # db.session.delete(endpoint)
 
-            threading.Thread(target=trigger).start()
+class RateLimiter(object):
+    """
+    Token bucket per endpoint: `rate` posts per second with bursts of up
+    to `burst`. Only used from the dispatcher thread.
+    """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}  # type: dict
 
-    WEAK_REF_HOLD.append(trigger_receiver) # DO NOT DELETE THIS LINE!
+    def allow(self, key):
+        now = time.monotonic()
+        tokens, last = self.buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens < 1:
+            self.buckets[key] = (tokens, now)
+            return False
+        self.buckets[key] = (tokens - 1, now)
+        return True
 
-    return trigger_receiver
+
+class Dispatcher(object):
+    """
+    Posts the pending `ZapierTriggerEvent` with a pool of threads sharing
+    one HTTP session. Only the posting happens in the threads, the database
+    is only accessed from the calling thread.
+    """
+    def __init__(self, workers=8, timeout=10, max_attempts=8, rate=1, burst=5, retention=timedelta(days=7)):
+        self.workers = workers
+        self.retention = retention
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.rate_limiter = RateLimiter(rate, burst)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _post(self, target_url, data):
+        try:
+            response = self.session.post(target_url, json=data, timeout=self.timeout)
+            return response.status_code, None
+        except requests.RequestException as e:
+            return None, repr(e)
+
+    def dispatch(self, batch_size=100):
+        """
+        Posts one batch of the due events. Rows are locked while being posted
+        so several dispatchers can run at the same time.
+        Returns the number of events posted.
+        """
+        from ..models.zapier import ZapierHookEndpoint, ZapierTriggerEvent
+        from ..setup import db
+
+        pending = ZapierTriggerEvent.query\
+            .filter(ZapierTriggerEvent.delivered_at == None)\
+            .filter(ZapierTriggerEvent.next_attempt_at <= datetime.utcnow())\
+            .filter(ZapierTriggerEvent.attempts < self.max_attempts)\
+            .order_by(ZapierTriggerEvent.next_attempt_at)\
+            .limit(batch_size)\
+            .with_for_update(skip_locked=True)\
+            .all()
+
+        now = datetime.utcnow()
+        events = []
+        for e in pending:
+            if self.rate_limiter.allow(e.endpoint_id):
+                events.append(e)
+            else:
+                # Over the limit: moved back in the queue without counting an attempt
+                e.next_attempt_at = now + timedelta(seconds=1 / self.rate_limiter.rate)
+        targets = [e.endpoint.target_url for e in events]
+        results = list(self.executor.map(self._post, targets, [e.data for e in events]))
+
+        now = datetime.utcnow()
+        gone = set()
+        for e, target_url, (status_code, error) in zip(events, targets, results):
+            e.post_event_log = e.post_event_log + [{
+                "at": now.isoformat(), "statusCode": status_code, "error": error,
+            }]
+            if status_code is not None and 200 <= status_code < 300:
+                e.delivered_at = now
+                continue
+
+            if status_code in GONE_STATUS_CODES:
+                logging.info("Zapier endpoint %s is gone, deleting it", target_url)
+                gone.add(e.endpoint_id)
+                continue
+
+            e.attempts += 1
+            # 30s, 1min, 2min... up to ~1h
+            e.next_attempt_at = now + timedelta(seconds=30 * 2 ** min(e.attempts - 1, 7))
+            logging.warning("Zapier post to %s failed (%r, %r), attempt %d", target_url, status_code, error, e.attempts)
+
+        if gone:
+            # Deleting the endpoints deletes their events as well
+            db.session.flush()
+            ZapierHookEndpoint.query\
+                .filter(ZapierHookEndpoint.id.in_(gone))\
+                .delete(synchronize_session=False)
+        db.session.commit()
+        return len(events)
+
+    def prune(self):
+        """
+        Deletes the events delivered or given up on more than `retention`
+        ago, their log is only kept to debug the zaps.
+        Returns the number of events deleted.
+        """
+        from ..models.zapier import ZapierTriggerEvent
+        from ..setup import db
+
+        cutoff = datetime.utcnow() - self.retention
+        count = ZapierTriggerEvent.query\
+            .filter(db.or_(
+                ZapierTriggerEvent.delivered_at < cutoff,
+                db.and_(
+                    ZapierTriggerEvent.delivered_at == None,
+                    ZapierTriggerEvent.attempts >= self.max_attempts,
+                    ZapierTriggerEvent.created_at < cutoff,
+                ),
+            ))\
+            .delete(synchronize_session=False)
+        db.session.commit()
+        return count
+
+    def run_forever(self, poll_interval=1, prune_interval=3600):
+        from ..setup import db
+
+        last_prune = None
+        while True:
+            try:
+                if last_prune is None or time.monotonic() - last_prune > prune_interval:
+                    self.prune()
+                    last_prune = time.monotonic()
+                if self.dispatch() == 0:
+                    time.sleep(poll_interval)
+            except Exception:
+                logging.exception("Zapier dispatching failed")
+                db.session.rollback()
+                time.sleep(poll_interval)
 
 
 def init_app(app):
@@ -30,10 +30,15 @@ from app.utils.sync_mailjet import (
     sync_to_mailjet as sync_to_mailjet_command,
     sync_properties_to_mailjet as sync_properties_to_mailjet_command
 )
-from app.utils.search import reindex, ingest_proposals, cleanup_index
+from app.utils.search import get_backend, index_dirty_proposals, index_dirty_proposals_forever
 from app.utils.merge_companies import merge_companies_command
 from app.utils.run_gunicorn import StandaloneApplication
 from app.utils.integrations import sync_contacts
+from app.utils.analytics_compaction import compact_analytics as compact_analytics_command
+from app.utils.analytics_archive import archive_partitions, delete_company_analytics
+from app.utils.mail_outbox import send_outbox_forever
+from app.utils.zapier import Dispatcher as ZapierDispatcher
+from app.utils.pdf_prerender import warm_signed_pdfs
 
 from testdata.commands import CoolAgencyCommand
 
@@ -83,17 +88,26 @@ manager.add_command("cool-agency", CoolAgencyCommand)
 
 
 @manager.command
-def es_reindex():
+def es_reindex(resume=False, workers=4):
+    """Rebuilds the search index without interrupting the searches"""
     with app.app_context():
-        reindex()
+        get_backend().reindex(resume=bool(resume), workers=int(workers))
 
 
 @manager.command
 def es_ingestion():
-    """Periodical (max 10 mins apart) ingestion for ES"""
+    """Periodical ingestion for ES of the proposals changed since the last one"""
     with app.app_context():
-        ingest_proposals()
-        cleanup_index()
+        while index_dirty_proposals(batch_size=500) > 0:
+            pass
+        get_backend().cleanup_index()
+
+
+@manager.command
+def es_indexer(poll_interval=1):
+    """Indexes the changed proposals as they change, runs forever"""
+    with app.app_context():
+        index_dirty_proposals_forever(int(poll_interval))
 
 
 @manager.command
@@ -114,6 +128,28 @@ def send_trial_end_emails():
         send_trial_end_emails_command()
 
 
+@manager.command
+def send_emails(poll_interval=5):
+    """Sends the emails of the outbox to mailjet, runs forever"""
+    with app.app_context():
+        send_outbox_forever(int(poll_interval))
+
+
+@manager.command
+def zapier_dispatcher(workers=8):
+    """Posts the queued zapier triggers, runs forever"""
+    with app.app_context():
+        ZapierDispatcher(workers=int(workers)).run_forever()
+
+
+@manager.command
+def warm_pdfs(workers=4):
+    """Renders the PDF of every signed proposal not in the renderer cache"""
+    with app.app_context():
+        warmer = warm_signed_pdfs(app.config["PDF_RENDERER_BASE_URL"], int(workers))
+        print(warmer.stats())
+
+
 @manager.command
 def merge_companies(a_id, b_id):
     with app.app_context():
@@ -144,6 +180,13 @@ def sync_integration_contacts():
         sync_contacts()
 
 
+@manager.command
+def compact_analytics(lag_seconds=300):
+    """Periodical folding of the new analytics events into the rollups"""
+    with app.app_context():
+        compact_analytics_command(int(lag_seconds))
+
+
 @manager.command
 def run_gunicorn():
     """
@@ -192,25 +235,30 @@ def clean_shared_comments_for_company(company_id, execute=False):
 
 @manager.command
 def clean_analytics_for_company(company_id, execute=False):
-    def collect():
-        for p in Proposal.query.filter_by(company_id=company_id).all():
-            for x in p.shared_proposals.all():
-                yield x
-
-    shared_proposals = list(collect())
     if not execute:
         print("dry run, use --execute to actually delete")
     print("company:\033[1m", Company.query.filter_by(id=company_id).first().name, "\033[0m")
     if execute:
-        for s in shared_proposals:
-            s.events.delete()
+        print("deleted", delete_company_analytics(company_id), "events")
         db.session.commit()
 
 
+@manager.command
+def archive_analytics(directory=None, keep_months=12, execute=False, drop=False):
+    """Export and detach the analytics events partitions older than keep_months"""
+    with app.app_context():
+        if not execute:
+            print("dry run, use --execute to actually archive")
+        archive_partitions(
+            directory or app.config["ANALYTICS_ARCHIVE_DIR"], int(keep_months), execute, drop
+        )
+
+
 @manager.command
 def test(pattern="test*.py"):
     import unittest
     db.engine.execute("CREATE EXTENSION IF NOT EXISTS citext")
+    db.engine.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
 
     with app.app_context():
         # Reflect "reflects" the current state of the DB which may
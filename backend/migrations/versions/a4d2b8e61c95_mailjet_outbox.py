@@ -0,0 +1,35 @@
+"""mailjet outbox
+
+Revision ID: a4d2b8e61c95
+Revises: f3c96a1d5e28
+Create Date: 2026-10-18 18:05:44.129563
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a4d2b8e61c95'
+down_revision = 'f3c96a1d5e28'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+def upgrade():
+    op.create_table(
+        'mailjet_outbox',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('payload', postgresql.JSONB(), nullable=False),
+        sa.Column('message_reason', sa.String(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_mailjet_outbox_next_attempt_at'), 'mailjet_outbox', ['next_attempt_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_mailjet_outbox_next_attempt_at'), table_name='mailjet_outbox')
+    op.drop_table('mailjet_outbox')
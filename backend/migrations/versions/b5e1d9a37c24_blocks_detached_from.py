@@ -0,0 +1,30 @@
+"""blocks detached from
+
+Revision ID: b5e1d9a37c24
+Revises: d2e6b4a1f390
+Create Date: 2026-10-18 23:40:52.806213
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b5e1d9a37c24'
+down_revision = 'd2e6b4a1f390'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # Blocks detached before that can't be restored anymore, we don't know
+    # where they come from
+    op.add_column('blocks', sa.Column('detached_from_id', sa.Integer(), nullable=True))
+    op.create_index(op.f('ix_blocks_detached_from_id'), 'blocks', ['detached_from_id'], unique=False)
+    op.create_foreign_key(
+        'blocks_detached_from_id_fkey', 'blocks', 'proposals', ['detached_from_id'], ['id'], ondelete='SET NULL'
+    )
+
+
+def downgrade():
+    op.drop_constraint('blocks_detached_from_id_fkey', 'blocks', type_='foreignkey')
+    op.drop_index(op.f('ix_blocks_detached_from_id'), table_name='blocks')
+    op.drop_column('blocks', 'detached_from_id')
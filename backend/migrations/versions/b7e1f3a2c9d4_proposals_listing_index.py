@@ -0,0 +1,27 @@
+"""proposals listing index
+
+Revision ID: b7e1f3a2c9d4
+Revises: a6dedba383df
+Create Date: 2026-10-18 10:12:41.203518
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b7e1f3a2c9d4'
+down_revision = 'a6dedba383df'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index(
+        'ix_proposals_company_id_status_updated_at',
+        'proposals',
+        ['company_id', 'status', 'updated_at'],
+        unique=False
+    )
+
+
+def downgrade():
+    op.drop_index('ix_proposals_company_id_status_updated_at', table_name='proposals')
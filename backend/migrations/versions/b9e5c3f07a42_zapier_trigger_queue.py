@@ -0,0 +1,43 @@
+"""zapier trigger queue
+
+Revision ID: b9e5c3f07a42
+Revises: a4d2b8e61c95
+Create Date: 2026-10-18 19:12:27.448310
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b9e5c3f07a42'
+down_revision = 'a4d2b8e61c95'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # The table was never written to so the new columns can be NOT NULL
+    op.add_column('zapier_trigger_events', sa.Column('endpoint_id', sa.Integer(), nullable=False))
+    op.add_column('zapier_trigger_events', sa.Column('event', sa.String(length=128), nullable=False))
+    op.add_column('zapier_trigger_events', sa.Column('attempts', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('zapier_trigger_events', sa.Column('next_attempt_at', sa.DateTime(), server_default=sa.func.now(), nullable=False))
+    op.add_column('zapier_trigger_events', sa.Column('delivered_at', sa.DateTime(), nullable=True))
+    op.create_foreign_key(
+        'zapier_trigger_events_endpoint_id_fkey', 'zapier_trigger_events', 'zapier_hook_endpoints',
+        ['endpoint_id'], ['id'], ondelete='CASCADE'
+    )
+    op.create_index(op.f('ix_zapier_trigger_events_endpoint_id'), 'zapier_trigger_events', ['endpoint_id'], unique=False)
+    op.create_index(
+        'ix_zapier_trigger_events_pending', 'zapier_trigger_events', ['next_attempt_at'],
+        unique=False, postgresql_where=sa.text('delivered_at IS NULL')
+    )
+
+
+def downgrade():
+    op.drop_index('ix_zapier_trigger_events_pending', table_name='zapier_trigger_events')
+    op.drop_index(op.f('ix_zapier_trigger_events_endpoint_id'), table_name='zapier_trigger_events')
+    op.drop_constraint('zapier_trigger_events_endpoint_id_fkey', 'zapier_trigger_events', type_='foreignkey')
+    op.drop_column('zapier_trigger_events', 'delivered_at')
+    op.drop_column('zapier_trigger_events', 'next_attempt_at')
+    op.drop_column('zapier_trigger_events', 'attempts')
+    op.drop_column('zapier_trigger_events', 'event')
+    op.drop_column('zapier_trigger_events', 'endpoint_id')
@@ -0,0 +1,25 @@
+"""shared proposal snapshot
+
+Revision ID: c42d8e9b1f06
+Revises: b7e1f3a2c9d4
+Create Date: 2026-10-18 11:03:17.684211
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'c42d8e9b1f06'
+down_revision = 'b7e1f3a2c9d4'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # Existing shares get their snapshot built lazily on first view
+    op.add_column('shared_proposals', sa.Column('snapshot', sa.LargeBinary(), nullable=True))
+    op.add_column('shared_proposals', sa.Column('snapshot_etag', sa.String(length=64), nullable=True))
+
+
+def downgrade():
+    op.drop_column('shared_proposals', 'snapshot_etag')
+    op.drop_column('shared_proposals', 'snapshot')
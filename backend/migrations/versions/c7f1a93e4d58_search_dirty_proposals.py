@@ -0,0 +1,84 @@
+"""search dirty proposals
+
+Revision ID: c7f1a93e4d58
+Revises: b9e5c3f07a42
+Create Date: 2026-10-18 20:41:09.117364
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'c7f1a93e4d58'
+down_revision = 'b9e5c3f07a42'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# Copied from app/models/search.py so this migration never changes
+DIRTY_TRIGGERS_SQL = """
+CREATE OR REPLACE FUNCTION search_mark_dirty(dirty_id integer) RETURNS void AS $$
+BEGIN
+    IF dirty_id IS NOT NULL THEN
+        INSERT INTO search_dirty_proposals (proposal_id) VALUES (dirty_id)
+        ON CONFLICT ON CONSTRAINT uq_search_dirty_proposals_proposal_id_txid DO NOTHING;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION search_proposals_dirty() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM search_mark_dirty(OLD.id);
+    ELSE
+        PERFORM search_mark_dirty(NEW.id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION search_blocks_dirty() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM search_mark_dirty(OLD.proposal_id);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM search_mark_dirty(NEW.proposal_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS search_proposals_dirty ON proposals;
+CREATE TRIGGER search_proposals_dirty AFTER INSERT OR UPDATE OR DELETE ON proposals
+    FOR EACH ROW EXECUTE PROCEDURE search_proposals_dirty();
+
+DROP TRIGGER IF EXISTS search_blocks_dirty ON blocks;
+CREATE TRIGGER search_blocks_dirty AFTER INSERT OR UPDATE OR DELETE ON blocks
+    FOR EACH ROW EXECUTE PROCEDURE search_blocks_dirty();
+"""
+
+DROP_DIRTY_TRIGGERS_SQL = """
+DROP TRIGGER IF EXISTS search_blocks_dirty ON blocks;
+DROP TRIGGER IF EXISTS search_proposals_dirty ON proposals;
+DROP FUNCTION IF EXISTS search_blocks_dirty();
+DROP FUNCTION IF EXISTS search_proposals_dirty();
+DROP FUNCTION IF EXISTS search_mark_dirty(integer);
+"""
+
+
+def upgrade():
+    op.create_table(
+        'search_dirty_proposals',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('proposal_id', sa.Integer(), nullable=False),
+        sa.Column('txid', sa.BigInteger(), server_default=sa.text('txid_current()'), nullable=False),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('proposal_id', 'txid', name='uq_search_dirty_proposals_proposal_id_txid')
+    )
+    op.execute(DIRTY_TRIGGERS_SQL)
+
+
+def downgrade():
+    op.execute(DROP_DIRTY_TRIGGERS_SQL)
+    op.drop_table('search_dirty_proposals')
@@ -0,0 +1,52 @@
+"""search sections
+
+Revision ID: d2e6b4a1f390
+Revises: c7f1a93e4d58
+Create Date: 2026-10-18 21:27:54.603118
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'd2e6b4a1f390'
+down_revision = 'c7f1a93e4d58'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.create_table(
+        'search_sections',
+        sa.Column('uid', postgresql.UUID(), nullable=False),
+        sa.Column('proposal_id', sa.Integer(), nullable=False),
+        sa.Column('company_id', sa.Integer(), nullable=False),
+        sa.Column('proposal_title', sa.String(), nullable=False),
+        sa.Column('level', sa.String(length=2), nullable=False),
+        sa.Column('title', sa.String(), nullable=False),
+        sa.Column('content', sa.String(), nullable=False),
+        sa.Column('document', postgresql.TSVECTOR(), nullable=False),
+        sa.ForeignKeyConstraint(['proposal_id'], ['proposals.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('uid')
+    )
+    op.create_index(op.f('ix_search_sections_company_id'), 'search_sections', ['company_id'], unique=False)
+    op.create_index(op.f('ix_search_sections_proposal_id'), 'search_sections', ['proposal_id'], unique=False)
+    op.create_index('ix_search_sections_document', 'search_sections', ['document'], unique=False, postgresql_using='gin')
+    op.create_index(
+        'ix_search_sections_title_trgm', 'search_sections', ['title'], unique=False,
+        postgresql_using='gin', postgresql_ops={'title': 'gin_trgm_ops'}
+    )
+    op.create_index(
+        'ix_search_sections_content_trgm', 'search_sections', ['content'], unique=False,
+        postgresql_using='gin', postgresql_ops={'content': 'gin_trgm_ops'}
+    )
+
+
+def downgrade():
+    op.drop_index('ix_search_sections_content_trgm', table_name='search_sections')
+    op.drop_index('ix_search_sections_title_trgm', table_name='search_sections')
+    op.drop_index('ix_search_sections_document', table_name='search_sections')
+    op.drop_index(op.f('ix_search_sections_proposal_id'), table_name='search_sections')
+    op.drop_index(op.f('ix_search_sections_company_id'), table_name='search_sections')
+    op.drop_table('search_sections')
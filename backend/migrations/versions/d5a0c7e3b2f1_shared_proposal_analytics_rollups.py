@@ -0,0 +1,53 @@
+"""shared proposal analytics rollups
+
+Revision ID: d5a0c7e3b2f1
+Revises: c42d8e9b1f06
+Create Date: 2026-10-18 13:42:08.315402
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'd5a0c7e3b2f1'
+down_revision = 'c42d8e9b1f06'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+def upgrade():
+    # Filled by `manage.py compact_analytics`, shares without a rollup
+    # still get their analytics computed from all their events
+    op.create_table(
+        'shared_proposals_analytics',
+        sa.Column('shared_proposal_id', sa.Integer(), nullable=False),
+        sa.Column('last_event_id', sa.Integer(), nullable=False),
+        sa.Column('number_views', sa.Integer(), nullable=False),
+        sa.Column('last_session_timestamp', sa.Integer(), nullable=False),
+        sa.Column('outbound_clicks', postgresql.JSONB(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['shared_proposal_id'], ['shared_proposals.id'], ),
+        sa.PrimaryKeyConstraint('shared_proposal_id')
+    )
+    op.create_table(
+        'shared_proposals_sessions',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('shared_proposal_id', sa.Integer(), nullable=False),
+        sa.Column('user_uid', postgresql.UUID(), nullable=False),
+        sa.Column('start', sa.Integer(), nullable=False),
+        sa.Column('end', sa.Integer(), nullable=False),
+        sa.Column('data', postgresql.JSONB(), nullable=False),
+        sa.Column('is_current', sa.Boolean(), nullable=False),
+        sa.ForeignKeyConstraint(['shared_proposal_id'], ['shared_proposals.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(
+        op.f('ix_shared_proposals_sessions_shared_proposal_id'),
+        'shared_proposals_sessions', ['shared_proposal_id'], unique=False
+    )
+
+
+def downgrade():
+    op.drop_index(op.f('ix_shared_proposals_sessions_shared_proposal_id'), table_name='shared_proposals_sessions')
+    op.drop_table('shared_proposals_sessions')
+    op.drop_table('shared_proposals_analytics')
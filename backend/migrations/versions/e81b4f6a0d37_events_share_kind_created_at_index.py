@@ -0,0 +1,27 @@
+"""events share kind created_at index
+
+Revision ID: e81b4f6a0d37
+Revises: d5a0c7e3b2f1
+Create Date: 2026-10-18 15:20:51.902734
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e81b4f6a0d37'
+down_revision = 'd5a0c7e3b2f1'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index(
+        'ix_shared_proposals_events_share_kind_created_at',
+        'shared_proposals_events',
+        ['shared_proposal_id', 'kind', 'created_at'],
+        unique=False
+    )
+
+
+def downgrade():
+    op.drop_index('ix_shared_proposals_events_share_kind_created_at', table_name='shared_proposals_events')
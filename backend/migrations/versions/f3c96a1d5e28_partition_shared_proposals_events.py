@@ -0,0 +1,93 @@
+"""partition shared proposals events
+
+Revision ID: f3c96a1d5e28
+Revises: e81b4f6a0d37
+Create Date: 2026-10-18 16:48:32.540117
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'f3c96a1d5e28'
+down_revision = 'e81b4f6a0d37'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# Copied from app/utils/analytics_archive.py so this migration never changes
+PARTITION_FUNCTION_SQL = """
+CREATE OR REPLACE FUNCTION shared_proposals_events_partition(ts timestamp) RETURNS text AS $$
+DECLARE
+    month_start timestamp := date_trunc('month', ts);
+    partition text := 'shared_proposals_events_' || to_char(month_start, '"y"YYYY"m"MM');
+BEGIN
+    IF to_regclass(partition) IS NULL THEN
+        BEGIN
+            EXECUTE format(
+                'CREATE TABLE %I (
+                    PRIMARY KEY (id),
+                    FOREIGN KEY (shared_proposal_id) REFERENCES shared_proposals (id),
+                    CHECK (created_at >= %L AND created_at < %L)
+                ) INHERITS (shared_proposals_events)',
+                partition, month_start, month_start + interval '1 month'
+            );
+            EXECUTE format(
+                'CREATE INDEX %I ON %I (shared_proposal_id, kind, created_at)',
+                partition || '_share_kind_created_at', partition
+            );
+        EXCEPTION WHEN duplicate_table OR unique_violation THEN
+            -- created concurrently by another insert
+            NULL;
+        END;
+    END IF;
+    RETURN partition;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+INSERT_TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION shared_proposals_events_insert() RETURNS trigger AS $$
+BEGIN
+    EXECUTE format('INSERT INTO %I VALUES ($1.*)', shared_proposals_events_partition(NEW.created_at))
+        USING NEW;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER shared_proposals_events_insert
+    BEFORE INSERT ON shared_proposals_events
+    FOR EACH ROW EXECUTE PROCEDURE shared_proposals_events_insert();
+"""
+
+
+def upgrade():
+    op.execute(PARTITION_FUNCTION_SQL)
+    op.execute(INSERT_TRIGGER_SQL)
+    # Re-inserting the existing events through the trigger moves them to
+    # their month
+    op.execute("""
+        WITH moved AS (DELETE FROM ONLY shared_proposals_events RETURNING *)
+        INSERT INTO shared_proposals_events SELECT * FROM moved
+    """)
+
+
+def downgrade():
+    # Archived partitions are not restored
+    op.execute("DROP TRIGGER shared_proposals_events_insert ON shared_proposals_events")
+    op.execute("""
+        DO $$
+        DECLARE
+            partition regclass;
+        BEGIN
+            FOR partition IN
+                SELECT inhrelid::regclass FROM pg_inherits
+                WHERE inhparent = 'shared_proposals_events'::regclass
+            LOOP
+                EXECUTE format('ALTER TABLE %s NO INHERIT shared_proposals_events', partition);
+                EXECUTE format('INSERT INTO shared_proposals_events SELECT * FROM %s', partition);
+                EXECUTE format('DROP TABLE %s', partition);
+            END LOOP;
+        END $$;
+    """)
+    op.execute("DROP FUNCTION shared_proposals_events_insert()")
+    op.execute("DROP FUNCTION shared_proposals_events_partition(timestamp)")
@@ -2,7 +2,30 @@ from tests.common import DatabaseTest
 from tests.factories._users import UserFactory
 from tests.factories._proposals import ProposalFactory
 from tests.factories._companies import CompanyFactory
-from tests.factories._sharing import SharedProposalFactory
+from tests.factories._sharing import SharedProposalFactory, SignatureFactory
+
+
+class TestDashboard(DatabaseTest):
+    def setUp(self):
+        super(TestDashboard, self).setUp()
+        self.user = UserFactory()
+        self.draft = ProposalFactory(company=self.user.company)
+        self.shared = ProposalFactory(company=self.user.company)
+        SharedProposalFactory(proposal=self.shared, version=1)
+        SharedProposalFactory(proposal=self.shared, version=2)
+        self.signed = ProposalFactory(company=self.user.company)
+        SharedProposalFactory(proposal=self.signed, version=1)
+        signed_share = SharedProposalFactory(proposal=self.signed, version=2)
+        SignatureFactory(proposal=self.signed, shared_proposal=signed_share)
+
+    def test_batched_proposals_same_as_to_json(self):
+        data, status = self.get_json("/dashboard", user=self.user)
+
+        self.assertEqual(status, 200)
+        expected = dict((p.id, p.to_json()) for p in [self.draft, self.shared, self.signed])
+        self.assertEqual(len(data["proposals"]), 3)
+        for proposal in data["proposals"]:
+            self.assertEqual(proposal, expected[proposal["id"]])
 
 
 class TestTemplates(DatabaseTest):
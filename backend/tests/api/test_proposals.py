@@ -1,5 +1,6 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 
+from app.setup import db
 from app.models.blocks import BlockType, Block
 
 from tests.common import DatabaseTest
@@ -28,6 +29,15 @@ class TestProposal(DatabaseTest):
         self.assertEqual(status, 200)
         self.assertEqual(data["users"][0]["loginToken"], "")
 
+    def test_get_tags_of_all_company_proposals(self):
+        self.p.tags = ["web", "mobile"]
+        DefaultProposalFactory(company=self.user.company, client=None, tags=["web", "design"])
+        DefaultProposalFactory(tags=["other company"])
+
+        data, status = self.get_json("/proposals/%d" % self.p.id, user=self.user)
+        self.assertEqual(status, 200)
+        self.assertEqual(sorted(data["tags"]), ["design", "mobile", "web"])
+
     def test_duplicate(self):
         _, status = self.post_json("/proposals/%d/duplicate" % self.p.id, {}, user=self.user)
 
@@ -60,6 +70,63 @@ class TestProposal(DatabaseTest):
         self.assertEqual(data["proposal"]["shares"][0]["sentTo"], ["a@b.com", "c@d.com"])
 
 
+class TestProposalListing(DatabaseTest):
+    def setUp(self):
+        super(TestProposalListing, self).setUp()
+        self.user = UserFactory()
+        self.client_ = ClientFactory(company=self.user.company)
+        now = datetime.utcnow()
+        self.proposals = [
+            DefaultProposalFactory(
+                company=self.user.company,
+                client=self.client_ if i % 2 == 0 else None,
+                title="Website %d" % i if i < 3 else "App %d" % i,
+                tags=["web"] if i < 3 else [],
+                status="draft" if i != 4 else "won",
+                updated_at=now - timedelta(minutes=i),
+            )
+            for i in range(5)
+        ]
+        # Another company proposal that should never show up
+        DefaultProposalFactory(title="Website other")
+
+    def get_ids(self, query=""):
+        data, status = self.get_json("/proposals?" + query, user=self.user)
+        self.assertEqual(status, 200)
+        return [p["id"] for p in data["proposals"]], data["nextCursor"]
+
+    def test_paginate(self):
+        ids, cursor = self.get_ids("limit=2")
+        self.assertEqual(ids, [p.id for p in self.proposals[:2]])
+
+        ids, cursor = self.get_ids("limit=2&cursor=%s" % cursor)
+        self.assertEqual(ids, [p.id for p in self.proposals[2:4]])
+
+        ids, cursor = self.get_ids("limit=2&cursor=%s" % cursor)
+        self.assertEqual(ids, [self.proposals[4].id])
+        self.assertIsNone(cursor)
+
+    def test_filters(self):
+        ids, _ = self.get_ids("status=won")
+        self.assertEqual(ids, [self.proposals[4].id])
+
+        ids, _ = self.get_ids("tag=web")
+        self.assertEqual(ids, [p.id for p in self.proposals[:3]])
+
+        ids, _ = self.get_ids("clientId=%d" % self.client_.id)
+        self.assertEqual(ids, [p.id for p in self.proposals[::2]])
+
+        ids, _ = self.get_ids("title=app")
+        self.assertEqual(ids, [p.id for p in self.proposals[3:]])
+
+    def test_invalid_arguments(self):
+        _, status = self.get_json("/proposals?cursor=nope", user=self.user)
+        self.assertEqual(status, 400)
+
+        _, status = self.get_json("/proposals?status=nope", user=self.user)
+        self.assertEqual(status, 400)
+
+
 class TestProposalUpdate(DatabaseTest):
     def setUp(self):
         super(TestProposalUpdate, self).setUp()
@@ -119,6 +186,21 @@ class TestProposalUpdate(DatabaseTest):
         self.assertEqual(len(prop_blocks), 1)
         self.assertEqual(prop_blocks[0].data, blocks[0]["data"])
 
+    def test_update_blocks_rejects_stale_versions(self):
+        block = self.p.blocks.order_by(Block.ordering).first()
+        block.version = 100
+        db.session.commit()
+        stale = block.to_json()
+        stale["data"] = {"value": "stale"}
+        stale["version"] = 50
+
+        data = dict(title="Hello", tags=["hey"], coverImageUrl="", blocks=[stale], updatedAt=self.now)
+        resp, status = self.put_json("/proposals/%d" % self.p.id, data, user=self.user)
+
+        self.assertEqual(status, 200)
+        self.assertEqual([x["uid"] for x in resp["conflicts"]], [block.uid])
+        self.assertEqual(resp["blocks"][0]["data"], {"value": "Introduction"})
+
     def test_update_should_not_work_if_signed(self):
         SignatureFactory(proposal=self.p)
         data = dict(title="Hello", tags=["hey"], coverImageUrl="")
@@ -134,6 +216,83 @@ class TestProposalUpdate(DatabaseTest):
         self.assertEqual(status, 400)
 
 
+class TestProposalBlocksPatch(DatabaseTest):
+    def setUp(self):
+        super(TestProposalBlocksPatch, self).setUp()
+        self.user = UserFactory()
+        self.p = DefaultProposalFactory(company=self.user.company, client=None)
+        self.url = "/proposals/%d/blocks" % self.p.id
+        self.section, self.paragraph = self.p.blocks.order_by(Block.ordering).all()
+
+    def test_insert_and_update(self):
+        new_block = Block(BlockType.Paragraph.value, data={"value": "new"}, version=10, ordering=2).to_json()
+        changed = self.paragraph.to_json()
+        changed["data"] = {"value": "changed"}
+        changed["version"] = 10
+
+        resp, status = self.patch_json(self.url, {"changed": [changed, new_block]}, user=self.user)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(resp["saved"], 2)
+        db.session.expire_all()
+        blocks = self.p.blocks.order_by(Block.ordering).all()
+        self.assertEqual([b.data["value"] for b in blocks], ["Introduction", "changed", "new"])
+
+    def test_move_and_remove(self):
+        data = {
+            "moved": [{"uid": self.paragraph.uid, "ordering": 0}],
+            "removed": [self.section.uid],
+        }
+        resp, status = self.patch_json(self.url, data, user=self.user)
+
+        self.assertEqual(status, 200)
+        db.session.expire_all()
+        self.assertEqual([b.uid for b in self.p.blocks.all()], [self.paragraph.uid])
+        self.assertEqual(self.paragraph.ordering, 0)
+        self.assertIsNone(self.section.proposal_id)
+
+    def test_cant_update_block_from_other_proposal(self):
+        other = DefaultProposalFactory(company=self.user.company, client=None)
+        block = other.blocks.first().to_json()
+        block["data"] = {"value": "stolen"}
+        block["version"] = 10
+
+        _, status = self.patch_json(self.url, {"changed": [block]}, user=self.user)
+
+        self.assertEqual(status, 200)
+        db.session.expire_all()
+        self.assertEqual(other.blocks.count(), 2)
+        self.assertNotEqual(Block.query.get(block["uid"]).data["value"], "stolen")
+
+    def test_stale_version_is_rejected(self):
+        self.paragraph.version = 100
+        db.session.commit()
+        stale = self.paragraph.to_json()
+        stale["data"] = {"value": "stale"}
+        stale["version"] = 50
+
+        resp, status = self.patch_json(self.url, {"changed": [stale]}, user=self.user)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(resp["saved"], 0)
+        self.assertEqual(len(resp["conflicts"]), 1)
+        self.assertEqual(resp["conflicts"][0]["uid"], self.paragraph.uid)
+        self.assertEqual(resp["conflicts"][0]["data"], {"value": "hello"})
+        self.assertEqual(resp["conflicts"][0]["version"], 100)
+
+    def test_same_version_is_not_a_conflict(self):
+        resp, status = self.patch_json(self.url, {"changed": [self.paragraph.to_json()]}, user=self.user)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(resp["conflicts"], [])
+
+    def test_patch_should_not_work_if_signed(self):
+        SignatureFactory(proposal=self.p)
+        _, status = self.patch_json(self.url, {"removed": [self.section.uid]}, user=self.user)
+
+        self.assertEqual(status, 400)
+
+
 class TestSectionImporting(DatabaseTest):
     def setUp(self):
         super(TestSectionImporting, self).setUp()
@@ -179,3 +338,24 @@ class TestBlockDeletion(DatabaseTest):
 
         self.assertEqual(status, 200)
         self.assertEqual(self.p.blocks.count(), 2)
+
+    def test_cant_restore_block_detached_from_other_proposal(self):
+        other_user = UserFactory()
+        other = DefaultProposalFactory(company=other_user.company, client=None)
+        detached = other.blocks.first()
+        Block.bulk_detach(other.id, [detached.uid])
+        db.session.commit()
+        block = detached.to_json()
+        block["data"] = {"value": "stolen"}
+        block["version"] += 10
+
+        data = dict(title="Hello", tags=["hey"], coverImageUrl="", blocks=[block], updatedAt=self.now)
+        resp, status = self.put_json("/proposals/%d" % self.p.id, data, user=self.user)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(resp["conflicts"], [])
+        self.assertEqual(self.p.blocks.count(), 0)
+        db.session.expire_all()
+        self.assertIsNone(detached.proposal_id)
+        self.assertEqual(detached.detached_from_id, other.id)
+        self.assertNotEqual(detached.data["value"], "stolen")
@@ -1,5 +1,8 @@
 from datetime import datetime, timedelta
-from app.setup import mail
+from unittest.mock import patch, ANY
+
+from app.setup import mail, db
+from app.utils import pdf_prerender
 
 from tests.common import DatabaseTest
 from tests.factories._payments import ChargebeeSubscriptionCacheFactory
@@ -32,6 +35,19 @@ class TestSharing(DatabaseTest):
             self.assertEqual(self.p.shared_proposals.count(), 1)
             self.assertEqual(len(outbox), 0)
 
+    def test_pdf_prerendered_after_commit(self):
+        committed = []
+
+        def submit(base_url, share_uid, version, signed):
+            # A new connection only sees what was committed
+            committed.append(db.engine.execute("SELECT count(*) FROM shared_proposals").scalar())
+
+        with patch.object(pdf_prerender.client, "submit", side_effect=submit) as submit_mock:
+            _, status = self.post_json(self.url, {}, user=self.user)
+        self.assertEqual(status, 200)
+        submit_mock.assert_called_once_with(ANY, self.p.share_uid, 1, pdf_prerender.UNSIGNED)
+        self.assertEqual(committed, [1])
+
     def test_email_share_proposal(self):
         SharedProposalFactory(version=1, proposal=self.p)
         with mail.record_messages() as outbox:
@@ -132,3 +148,41 @@ class TestAccessSharedProposal(DatabaseTest):
 
         self.assertEqual(status, 200)
         self.assertEqual(data["shared"]["version"], shared2.version)
+
+    def test_blocks_come_from_snapshot(self):
+        data, status = self.get_json(self.url)
+
+        self.assertEqual(status, 200)
+        self.assertIsNotNone(self.shared.snapshot_etag)
+        self.assertEqual(
+            [b["uid"] for b in data["blocks"]],
+            [b.uid for b in self.shared.blocks.order_by("ordering")]
+        )
+        self.assertTrue(all(b["proposalId"] == self.p.share_uid for b in data["blocks"]))
+
+    def test_snapshot_conditional_get(self):
+        url = "/shared/{}/{}/snapshot".format(self.p.share_uid, self.shared.version)
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers["ETag"]
+        self.assertEqual(etag, '"%s"' % self.shared.snapshot_etag)
+        self.assertIn("public", response.headers["Cache-Control"])
+
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_shared_conditional_get(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers["ETag"]
+
+        response = self.client.get(self.url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+        # Signing doesn't change the snapshot but changes the response
+        SignatureFactory(shared_proposal=self.shared, proposal=self.p)
+        db.session.commit()
+        response = self.client.get(self.url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
@@ -58,7 +58,7 @@ class TestSigning(DatabaseTest):
         self.shared.blocks.append(self.sig_block)
 
         with mail.record_messages() as outbox:
-            _, code = self.post_json(self.url, self.data)
+            resp, code = self.post_json(self.url, self.data)
 
             self.assertEqual(code, 200)
             self.assertEqual(self.p.signature.count(), 1)
@@ -67,6 +67,10 @@ class TestSigning(DatabaseTest):
             self.assertEqual(signed_block.data["signature"], self.data["signature"])
             self.assertEqual(signed_block.data["name"], self.data["name"])
             self.assertIn("hash", signed_block.data)
+            # and the snapshot served to clients
+            resp_block = [b for b in resp["blocks"] if b["uid"] == signed_block.uid][0]
+            self.assertEqual(resp_block["data"], signed_block.data)
+            self.assertTrue(resp["shared"]["signed"])
             self.assertEqual(self.p.status, "won")
             self.assertEqual(len(outbox), 1)
             self.assertIn(self.p.title, outbox[0].body)
@@ -50,6 +50,9 @@ class DatabaseTest(unittest.TestCase):
     def put_json(self, url: str, payload, user=None, extra_headers={}):
         return self._send_json(url, payload, self.client.put, user=user, extra_headers=extra_headers)
 
+    def patch_json(self, url: str, payload, user=None, extra_headers={}):
+        return self._send_json(url, payload, self.client.patch, user=user, extra_headers=extra_headers)
+
     def get(self, url: str, user=None):
         """Passing a user will create and use the jwt"""
         if user is None:
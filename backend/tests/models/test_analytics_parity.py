@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta
+import os
+import random
+import uuid
+
+from app.setup import db
+from app.models.analytics import Event
+from app.models.shared_proposals import WAW_IPS
+from app.utils.analytics_compaction import compact_analytics
+
+from tests.common import DatabaseTest
+from tests.factories._proposals import ProposalFactory
+from tests.factories._sharing import SharedProposalFactory
+
+
+# Set to 1000000 to run the parity checks on a bigger stream
+NUMBER_EVENTS = int(os.environ.get("ANALYTICS_PARITY_EVENTS", 100000))
+URLS = ["https://proppy.io/%d" % i for i in range(12)]
+
+
+def generate_events(rng, shared_proposal_ids, number_events):
+    """
+    Random event streams with the annoying cases: pings before any load,
+    loads without pings, several events in the same second or even at the
+    same time, our own ips and events without ips.
+    """
+    start = datetime(2026, 1, 1)
+    users = {
+        share_id: [str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(200)]
+        for share_id in shared_proposal_ids
+    }
+    created_at = [start + timedelta(seconds=rng.randint(0, 30 * 24 * 3600)) for _ in range(5000)]
+
+    for _ in range(number_events):
+        share_id = rng.choice(shared_proposal_ids)
+        kind = rng.choice(["load", "load", "ping", "ping", "ping", "ping", "ping", "outbound_click"])
+        if kind == "outbound_click":
+            data = {"url": rng.choice(URLS)}
+        elif kind == "load":
+            data = {"city": rng.choice(["London", "Paris", ""])}
+        else:
+            data = {}
+        if rng.random() < 0.9:
+            data["ip"] = rng.choice(WAW_IPS) if rng.random() < 0.02 else "10.0.0.%d" % rng.randint(0, 255)
+
+        if rng.random() < 0.5:
+            timestamp = rng.choice(created_at)
+        else:
+            timestamp = start + timedelta(microseconds=rng.randint(0, 30 * 24 * 3600 * 10 ** 6))
+
+        yield {
+            "shared_proposal_id": share_id,
+            "user_uid": rng.choice(users[share_id]),
+            "kind": kind,
+            "data": data,
+            "created_at": timestamp,
+        }
+
+
+class TestAnalyticsParity(DatabaseTest):
+    def setUp(self):
+        super(TestAnalyticsParity, self).setUp()
+        proposal = ProposalFactory()
+        self.shares = [SharedProposalFactory(proposal_id=proposal.id) for _ in range(4)]
+
+        rng = random.Random(42)
+        events = list(generate_events(rng, [s.id for s in self.shares], NUMBER_EVENTS))
+        # Ids follow the time events were received, as in production
+        events.sort(key=lambda e: e["created_at"])
+        for i in range(0, len(events), 5000):
+            db.session.execute(Event.__table__.insert().values(events[i:i + 5000]))
+        db.session.commit()
+
+    def assertSameAnalytics(self, analytics, expected):
+        self.assertEqual(analytics["numberViews"], expected["numberViews"])
+        self.assertEqual(analytics["lastSessionTimestamp"], expected["lastSessionTimestamp"])
+        self.assertEqual(analytics["averageSessionLength"], expected["averageSessionLength"])
+        self.assertEqual(analytics["outboundClicks"], expected["outboundClicks"])
+        self.assertEqual(len(analytics["sessions"]), len(expected["sessions"]))
+        for session, expected_session in zip(analytics["sessions"], expected["sessions"]):
+            self.assertEqual(session, expected_session)
+
+    def test_sql_analytics(self):
+        for share in self.shares:
+            expected = share.get_analytics_from_events()
+            self.assertGreater(len(expected["sessions"]), 0)
+            self.assertSameAnalytics(share.get_analytics_from_sql(), expected)
+
+    def test_empty_sql_analytics(self):
+        share = SharedProposalFactory(proposal_id=self.shares[0].proposal_id)
+        self.assertEqual(share.get_analytics_from_sql(), share.get_analytics_from_events())
+
+    def test_compacted_analytics(self):
+        compact_analytics(lag_seconds=0, batch_size=7000)
+        for share in self.shares:
+            self.assertIsNotNone(share.analytics_rollup)
+            self.assertSameAnalytics(share.get_analytics(), share.get_analytics_from_events())
@@ -1,6 +1,8 @@
 from datetime import datetime, timedelta
 import uuid
 
+from app.utils.analytics_compaction import compact_analytics
+
 from tests.common import DatabaseTest
 from tests.factories._proposals import ProposalFactory
 from tests.factories._sharing import SharedProposalFactory, EventFactory
@@ -15,7 +17,7 @@ class TestProposalAnalytics(DatabaseTest):
         self.shared1 = SharedProposalFactory(proposal_id=self.proposal.id)
         self.shared2 = SharedProposalFactory(proposal_id=self.proposal.id)
 
-        self.start = datetime.utcnow()
+        self.start = datetime.utcnow() - timedelta(hours=1)
 
         def get_future(seconds):
             return self.start + timedelta(seconds=seconds)
@@ -60,3 +62,25 @@ class TestProposalAnalytics(DatabaseTest):
         self.assertEqual(len(sessions), 2)
 
         self.assertEqual([s["length"] for s in sessions], [15, 1])
+
+    def test_compacted_analytics(self):
+        self.assertEqual(compact_analytics(lag_seconds=0, batch_size=4), 14)
+        self.assertIsNotNone(self.shared1.analytics_rollup)
+        self.assertEqual(self.shared1.get_analytics(), self.shared1.get_analytics_from_events())
+        self.assertEqual(self.shared2.get_analytics(), self.shared2.get_analytics_from_events())
+
+        # New events are folded on top of the rollup until the next compaction
+        def get_future(seconds):
+            return self.start + timedelta(seconds=seconds)
+
+        EventFactory(shared_proposal=self.shared1, kind="ping", user_uid=self.user1, created_at=get_future(560), data={})
+        EventFactory(shared_proposal=self.shared1, kind="load", user_uid=self.user2, created_at=get_future(600))
+        EventFactory(shared_proposal=self.shared1, kind="ping", user_uid=self.user2, created_at=get_future(620), data={})
+        analytics = self.shared1.get_analytics()
+        self.assertEqual(analytics, self.shared1.get_analytics_from_events())
+        self.assertEqual(analytics["numberViews"], 4)
+        self.assertEqual([s["length"] for s in analytics["sessions"]], [20, 60, 40, 30])
+
+        self.assertEqual(compact_analytics(lag_seconds=0), 3)
+        self.assertEqual(self.shared1.get_analytics(), analytics)
+        self.assertEqual(compact_analytics(lag_seconds=0), 0)
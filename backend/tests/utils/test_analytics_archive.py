@@ -0,0 +1,140 @@
+from datetime import datetime
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import uuid
+
+from sqlalchemy import text
+
+from app.setup import db
+from app.models.analytics import Event, AnalyticsRollup
+from app.utils.analytics_archive import (
+    PARTITION_FUNCTION_SQL, INSERT_TRIGGER_SQL, get_partitions, archive_partitions, delete_company_analytics
+)
+from app.utils.analytics_compaction import compact_analytics
+from app.utils.analytics_ingestion import store_events
+
+from tests.common import DatabaseTest
+from tests.factories._sharing import SharedProposalFactory, EventFactory
+
+
+class TestArchivePartitions(DatabaseTest):
+    def setUp(self):
+        super(TestArchivePartitions, self).setUp()
+        self.shared = SharedProposalFactory()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+        # No insert trigger here, the partition is filled directly
+        db.session.execute(text(PARTITION_FUNCTION_SQL))
+        self.partition = db.session.execute(
+            text("SELECT shared_proposals_events_partition(:ts)"), {"ts": datetime(2020, 1, 1)}
+        ).scalar()
+        db.session.commit()
+        self.addCleanup(self.drop_partition)
+
+        for kind in ["load", "ping"]:
+            db.session.execute(
+                text("""
+                    INSERT INTO %s (user_uid, kind, data, created_at, shared_proposal_id)
+                    VALUES (:user_uid, :kind, CAST(:data AS jsonb), :created_at, :shared_proposal_id)
+                """ % self.partition),
+                {
+                    "user_uid": str(uuid.uuid4()),
+                    "kind": kind,
+                    "data": json.dumps({}),
+                    "created_at": datetime(2020, 1, 15),
+                    "shared_proposal_id": self.shared.id,
+                }
+            )
+        EventFactory(shared_proposal=self.shared, kind="load")
+        db.session.commit()
+
+    def drop_partition(self):
+        db.session.remove()
+        db.engine.execute("DROP TABLE IF EXISTS %s" % self.partition)
+
+    def test_archive(self):
+        compact_analytics(lag_seconds=0)
+        analytics = self.shared.get_analytics()
+        self.assertEqual(get_partitions()[0][0], self.partition)
+
+        archived = archive_partitions(self.directory, keep_months=1, execute=True, drop=True)
+        self.assertEqual(archived, [self.partition])
+        self.assertNotIn(self.partition, [name for name, _ in get_partitions()])
+
+        with gzip.open(os.path.join(self.directory, "%s.jsonl.gz" % self.partition), "rt") as f:
+            events = [json.loads(line) for line in f]
+        self.assertEqual([e["kind"] for e in events], ["load", "ping"])
+        self.assertEqual(events[0]["created_at"], "2020-01-15T00:00:00")
+
+        self.assertEqual(Event.query.count(), 1)
+        self.assertEqual(self.shared.get_analytics(), analytics)
+
+    def test_not_compacted(self):
+        self.assertEqual(archive_partitions(self.directory, keep_months=1, execute=True), [])
+        self.assertEqual(Event.query.count(), 3)
+
+    def test_dry_run(self):
+        compact_analytics(lag_seconds=0)
+        self.assertEqual(archive_partitions(self.directory, keep_months=1), [])
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertEqual(Event.query.count(), 3)
+
+
+class TestInsertTrigger(DatabaseTest):
+    def setUp(self):
+        super(TestInsertTrigger, self).setUp()
+        self.shared = SharedProposalFactory()
+        db.session.execute(text(PARTITION_FUNCTION_SQL))
+        db.session.execute(text(INSERT_TRIGGER_SQL))
+        db.session.commit()
+        self.addCleanup(self.drop_trigger)
+
+    def drop_trigger(self):
+        db.session.remove()
+        partitions = [name for name, _ in get_partitions()]
+        db.session.remove()
+        db.engine.execute("DROP TRIGGER shared_proposals_events_insert ON shared_proposals_events")
+        for name in partitions:
+            db.engine.execute("DROP TABLE %s" % name)
+
+    def test_inserts(self):
+        store_events([{
+            "shared_proposal_id": self.shared.id,
+            "user_uid": str(uuid.uuid4()),
+            "kind": "load",
+            "data": {},
+            "ip": "8.8.8.8",
+            "created_at": datetime(2020, 1, 15),
+        }])
+        EventFactory(shared_proposal=self.shared, kind="ping", created_at=datetime(2020, 2, 3))
+        db.session.commit()
+
+        self.assertEqual(
+            [name for name, _ in get_partitions()],
+            ["shared_proposals_events_y2020m01", "shared_proposals_events_y2020m02"]
+        )
+        in_parent = db.session.execute(text("SELECT count(*) FROM ONLY shared_proposals_events")).scalar()
+        self.assertEqual(in_parent, 0)
+        self.assertEqual(sorted(e.kind for e in Event.query), ["load", "ping"])
+
+
+class TestDeleteCompanyAnalytics(DatabaseTest):
+    def test_delete(self):
+        shared = SharedProposalFactory()
+        other = SharedProposalFactory()
+        EventFactory(shared_proposal=shared, kind="load")
+        EventFactory(shared_proposal=shared, kind="ping")
+        EventFactory(shared_proposal=other, kind="load")
+        db.session.commit()
+        compact_analytics(lag_seconds=0)
+
+        self.assertEqual(delete_company_analytics(shared.proposal.company_id), 2)
+        db.session.commit()
+
+        self.assertEqual([e.shared_proposal_id for e in Event.query.all()], [other.id])
+        self.assertEqual([r.shared_proposal_id for r in AnalyticsRollup.query.all()], [other.id])
+        self.assertEqual(shared.analytics_sessions.count(), 0)
@@ -0,0 +1,63 @@
+import datetime
+import uuid
+
+from flask import current_app
+
+from app.setup import db
+from app.models.analytics import Event
+from app.utils.analytics_ingestion import store_events, EventBuffer
+
+from tests.common import DatabaseTest
+from tests.factories._sharing import SharedProposalFactory, SignatureFactory
+
+
+def make_event(shared, kind="ping"):
+    return {
+        "shared_proposal_id": shared.id,
+        "user_uid": str(uuid.uuid4()),
+        "kind": kind,
+        "data": {"username": ""},
+        "ip": "8.8.8.8",
+        "created_at": datetime.datetime.utcnow(),
+    }
+
+
+class TestStoreEvents(DatabaseTest):
+    def setUp(self):
+        super(TestStoreEvents, self).setUp()
+        self.shared = SharedProposalFactory()
+
+    def test_store_events(self):
+        store_events([make_event(self.shared, "load"), make_event(self.shared)])
+        db.session.commit()
+
+        events = Event.query.order_by(Event.id).all()
+        self.assertEqual([e.kind for e in events], ["load", "ping"])
+        self.assertEqual(events[0].data["ip"], "8.8.8.8")
+        self.assertIn("city", events[0].data)
+
+    def test_ignore_signed_proposals(self):
+        SignatureFactory(proposal=self.shared.proposal, shared_proposal=self.shared)
+        store_events([make_event(self.shared)])
+        db.session.commit()
+
+        self.assertEqual(Event.query.count(), 0)
+
+
+class TestEventBuffer(DatabaseTest):
+    def setUp(self):
+        super(TestEventBuffer, self).setUp()
+        self.shared = SharedProposalFactory()
+        # Big interval and size so nothing is flushed before we stop
+        self.buffer = EventBuffer(
+            current_app._get_current_object(),
+            flush_interval=60, flush_size=100, max_size=10, put_timeout=0.01
+        )
+
+    def test_flush_on_stop(self):
+        for _ in range(3):
+            self.assertTrue(self.buffer.put(make_event(self.shared)))
+        self.assertEqual(Event.query.count(), 0)
+
+        self.buffer.stop()
+        self.assertEqual(Event.query.count(), 3)
@@ -0,0 +1,42 @@
+import unittest
+from collections import namedtuple
+
+from app.utils.geoip import GeoIPLocator
+
+
+Name = namedtuple("Name", ["name"])
+City = namedtuple("City", ["city", "country"])
+
+
+class FakeReader(object):
+    def __init__(self):
+        self.lookups = []
+
+    def city(self, ip):
+        self.lookups.append(ip)
+        if ip == "127.0.0.1":
+            raise ValueError("The address 127.0.0.1 is not in the database.")
+        return City(Name("London"), Name("United Kingdom"))
+
+
+class TestGeoIPLocator(unittest.TestCase):
+    def test_cached_lookups(self):
+        reader = FakeReader()
+        locator = GeoIPLocator(reader, cache_size=2)
+
+        for _ in range(3):
+            self.assertEqual(locator.locate("8.8.8.8"), ("London", "United Kingdom"))
+            self.assertEqual(locator.locate("127.0.0.1"), ("", ""))
+
+        self.assertEqual(reader.lookups, ["8.8.8.8", "127.0.0.1"])
+        self.assertEqual(locator.stats(), {"hits": 4, "misses": 2, "size": 2})
+
+    def test_bounded(self):
+        reader = FakeReader()
+        locator = GeoIPLocator(reader, cache_size=2)
+
+        for ip in ["1.1.1.1", "2.2.2.2", "3.3.3.3", "1.1.1.1"]:
+            locator.locate(ip)
+
+        self.assertEqual(reader.lookups, ["1.1.1.1", "2.2.2.2", "3.3.3.3", "1.1.1.1"])
+        self.assertEqual(locator.stats()["size"], 2)
@@ -0,0 +1,35 @@
+import io
+import unittest
+
+from PIL import Image
+
+from app.utils.images import scale_image, InvalidImage
+
+
+def make_image(size, extension):
+    contents = io.BytesIO()
+    Image.new("RGB", size, (200, 40, 40)).save(contents, extension)
+    return contents.getvalue()
+
+
+class TestScaleImage(unittest.TestCase):
+    def test_scale_jpeg(self):
+        scaled = scale_image(make_image((4000, 3000), "JPEG"), "JPEG", (300, 300))
+        image = Image.open(io.BytesIO(scaled))
+        self.assertEqual((image.format, image.size), ("JPEG", (300, 225)))
+
+    def test_scale_png(self):
+        scaled = scale_image(make_image((1000, 500), "PNG"), "PNG", (3000, 1000))
+        image = Image.open(io.BytesIO(scaled))
+        self.assertEqual((image.format, image.size), ("PNG", (1000, 500)))
+
+    def test_gif_not_scaled(self):
+        self.assertIsNone(scale_image(make_image((10, 10), "GIF"), "GIF", (300, 300)))
+
+    def test_invalid(self):
+        with self.assertRaises(InvalidImage):
+            scale_image(b"not an image", "PNG", (300, 300))
+
+    def test_too_many_pixels(self):
+        with self.assertRaises(InvalidImage):
+            scale_image(make_image((1000, 500), "PNG"), "PNG", (300, 300), max_pixels=1000 * 499)
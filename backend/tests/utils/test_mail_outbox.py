@@ -0,0 +1,76 @@
+from unittest.mock import patch, Mock
+
+from flask import current_app
+
+from app.setup import db
+from app.models.mailjet import Message as MailjetMessage, OutboxMessage
+from app.utils.mailer import send_activation_email
+from app.utils.mail_outbox import count_recipients, send_outbox, _record_sent, _record_failure
+
+from tests.common import DatabaseTest
+
+
+class TestMailOutbox(DatabaseTest):
+    def setUp(self):
+        super(TestMailOutbox, self).setUp()
+        current_app.config["PRODUCTION"] = True
+        self.addCleanup(current_app.config.update, PRODUCTION=False)
+
+    def test_queued_in_transaction(self):
+        send_activation_email("bob@proppy.io", token="abc")
+        db.session.rollback()
+        self.assertEqual(OutboxMessage.query.count(), 0)
+
+        send_activation_email("bob@proppy.io", token="abc")
+        db.session.commit()
+        message = OutboxMessage.query.one()
+        self.assertEqual(message.payload["To"], "bob@proppy.io")
+        self.assertEqual(message.message_reason, "mails/activation")
+
+    def test_count_recipients(self):
+        self.assertEqual(count_recipients({"To": "a@proppy.io,b@proppy.io", "Bcc": "c@proppy.io"}), 3)
+
+    def test_record_sent(self):
+        send_activation_email("bob@proppy.io", token="abc")
+        send_activation_email("alice@proppy.io", token="abc")
+        db.session.commit()
+        messages = OutboxMessage.query.order_by(OutboxMessage.id).all()
+
+        results = [
+            [{"Email": "bob@proppy.io", "MessageID": 1}],
+            [{"Email": "alice@proppy.io", "MessageID": 2}],
+        ]
+        _record_sent(messages, results)
+        # Already known ids are ignored
+        _record_sent(messages[:1], results[:1])
+        db.session.commit()
+
+        self.assertEqual(OutboxMessage.query.count(), 0)
+        self.assertEqual(
+            [(m.id, m.message_reason) for m in MailjetMessage.query.order_by(MailjetMessage.id)],
+            [(1, "mails/activation"), (2, "mails/activation")]
+        )
+
+    def test_record_failure(self):
+        send_activation_email("bob@proppy.io", token="abc")
+        db.session.commit()
+        message = OutboxMessage.query.one()
+
+        _record_failure([message], ValueError("Mailjet returned 500"), max_attempts=5)
+        db.session.commit()
+
+        message = OutboxMessage.query.one()
+        self.assertEqual(message.attempts, 1)
+        self.assertGreater(message.next_attempt_at, message.created_at)
+
+    @patch("app.utils.mail_outbox._send")
+    def test_not_sent_again_if_recording_fails(self, send):
+        send.return_value = Mock(status_code=200, json=Mock(return_value={"unexpected": []}))
+        send_activation_email("bob@proppy.io", token="abc")
+        send_activation_email("alice@proppy.io", token="abc")
+        db.session.commit()
+
+        self.assertEqual(send_outbox(), 2)
+
+        self.assertEqual(send.call_count, 1)
+        self.assertEqual(OutboxMessage.query.count(), 0)
@@ -0,0 +1,98 @@
+import base64
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs
+
+import mixpanel
+
+from app.utils.mixpanel import QueueConsumer
+
+
+class StubMixpanel(BaseHTTPRequestHandler):
+    """Records the batches posted, like mixpanel answers status 1"""
+    batches = []  # type: list
+    api_keys = []  # type: list
+    delay = 0
+
+    def do_POST(self):
+        time.sleep(self.delay)
+        body = self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8")
+        form = parse_qs(body)
+        self.batches.append((self.path, json.loads(base64.b64decode(form["data"][0]).decode("utf-8"))))
+        self.api_keys.append(form.get("api_key", [None])[0])
+
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(json.dumps({"status": 1}).encode("utf-8"))
+
+    def log_message(self, *args):
+        pass
+
+
+class TestQueueConsumer(unittest.TestCase):
+    def setUp(self):
+        StubMixpanel.batches = []
+        StubMixpanel.api_keys = []
+        StubMixpanel.delay = 0
+        self.server = HTTPServer(("127.0.0.1", 0), StubMixpanel)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def make_consumer(self, **kwargs):
+        base_url = "http://127.0.0.1:%d" % self.server.server_port
+        return QueueConsumer(
+            events_url=base_url + "/track", people_url=base_url + "/engage", import_url=base_url + "/import",
+            **kwargs
+        )
+
+    def test_batches(self):
+        consumer = self.make_consumer(flush_interval=60)
+        mp = mixpanel.Mixpanel("token", consumer)
+        for i in range(120):
+            mp.track(1, "Proposal duplicated", {"i": i})
+        mp.people_set(1, {"$name": "Proppy"})
+        consumer.stop()
+
+        tracked = [b for path, b in StubMixpanel.batches if path == "/track"]
+        self.assertTrue(all(len(b) <= 50 for b in tracked))
+        self.assertEqual(
+            sorted(e["properties"]["i"] for b in tracked for e in b),
+            list(range(120))
+        )
+        self.assertEqual([len(b) for path, b in StubMixpanel.batches if path == "/engage"], [1])
+        self.assertEqual(consumer.dropped, 0)
+
+    def test_import_api_key(self):
+        consumer = self.make_consumer(flush_interval=60)
+        mp = mixpanel.Mixpanel("token", consumer)
+        mp.import_data("key1", 1, "Proposal shared", 1500000000)
+        mp.import_data("key2", 1, "Proposal shared", 1500000000)
+        mp.track(1, "Proposal duplicated")
+        consumer.stop()
+
+        self.assertEqual(
+            sorted(zip([path for path, _ in StubMixpanel.batches], StubMixpanel.api_keys), key=str),
+            sorted([("/import", "key1"), ("/import", "key2"), ("/track", None)], key=str)
+        )
+        self.assertEqual(consumer.dropped, 0)
+
+    def test_drop_when_full(self):
+        # Each request takes a while so the queue fills up
+        StubMixpanel.delay = 0.5
+        consumer = self.make_consumer(max_size=1, batch_size=1, put_timeout=0.01)
+        mp = mixpanel.Mixpanel("token", consumer)
+        for i in range(5):
+            mp.track(1, "Proposal duplicated", {"i": i})
+        consumer.stop()
+
+        self.assertGreaterEqual(consumer.dropped, 3)
+        self.assertEqual(len(StubMixpanel.batches) + consumer.dropped, 5)
+
+    def test_drop_on_error(self):
+        consumer = QueueConsumer(events_url="http://127.0.0.1:1/track", request_timeout=1)
+        consumer.flush([("events", json.dumps({"event": "Slack added"}), None)])
+        self.assertEqual(consumer.dropped, 1)
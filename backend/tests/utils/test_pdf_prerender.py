@@ -0,0 +1,72 @@
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from app.utils.pdf_prerender import PrerenderClient, SIGNED, UNSIGNED
+
+
+class StubRenderer(BaseHTTPRequestHandler):
+    """Records the jobs, renders take `delay` seconds"""
+    jobs = []  # type: list
+    delay = 0
+
+    def do_POST(self):
+        self.jobs.append(self.path)
+        time.sleep(self.delay)
+        self.reply(202, "queued")
+
+    def do_GET(self):
+        self.reply(200, "done")
+
+    def reply(self, status_code, status):
+        self.send_response(status_code)
+        self.end_headers()
+        self.wfile.write(json.dumps({"status": status}).encode("utf-8"))
+
+    def log_message(self, *args):
+        pass
+
+
+class TestPrerenderClient(unittest.TestCase):
+    def setUp(self):
+        StubRenderer.jobs = []
+        StubRenderer.delay = 0
+        self.server = HTTPServer(("127.0.0.1", 0), StubRenderer)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.base_url = "http://127.0.0.1:%d/api/render-pdf" % self.server.server_port
+
+    def test_deduplicate(self):
+        StubRenderer.delay = 0.2
+        client = PrerenderClient(workers=2)
+        for _ in range(5):
+            client.submit(self.base_url, "ABCDEFGHI", 1, UNSIGNED)
+        client.submit(self.base_url, "ABCDEFGHI", 1, SIGNED)
+        client.join()
+
+        self.assertEqual(sorted(StubRenderer.jobs), [
+            "/api/render-pdf/ABCDEFGHI/1/s/jobs?priority=prerender",
+            "/api/render-pdf/ABCDEFGHI/1/u/jobs?priority=prerender",
+        ])
+        stats = client.stats()
+        self.assertEqual((stats["submitted"], stats["deduplicated"], stats["rendered"]), (2, 4, 2))
+        self.assertEqual(stats["pending"], 0)
+
+    def test_drop_when_full(self):
+        StubRenderer.delay = 0.2
+        client = PrerenderClient(workers=1, max_pending=2)
+        for version in range(5):
+            client.submit(self.base_url, "ABCDEFGHI", version, UNSIGNED)
+        client.join()
+
+        self.assertEqual(len(StubRenderer.jobs), 2)
+        self.assertEqual(client.stats()["dropped"], 3)
+
+    def test_failure(self):
+        client = PrerenderClient(timeout=(1, 1))
+        client.submit("http://127.0.0.1:1/api/render-pdf", "ABCDEFGHI", 1, SIGNED, wait=True)
+        client.join()
+        self.assertEqual(client.stats()["failed"], 1)
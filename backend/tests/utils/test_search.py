@@ -6,8 +6,17 @@ from unittest import SkipTest, mock, skipIf
 from elasticsearch import Elasticsearch
 from flask import current_app
 
+from sqlalchemy import text
+
 from app.setup import db
-from app.utils.search import ingest_proposals, cleanup_index, create_index
+from app.models.blocks import Block
+from app.models.enums import BlockType
+from app.models.search import SearchDirtyProposal, DIRTY_TRIGGERS_SQL
+from app.utils.search import (
+    ingest_proposals, cleanup_index, create_index, index_dirty_proposals, reindex,
+    _index_actions, _stream_actions, _delete_proposals_from_index,
+)
+from app.models.proposals import Proposal
 
 
 from tests.common import DatabaseTest
@@ -49,6 +58,7 @@ class SearchIndexingProposal(DatabaseTest):
     """
     def setUp(self):
         super(SearchIndexingProposal, self).setUp()
+        db.session.execute(text(DIRTY_TRIGGERS_SQL))
         self.proposal1 = DefaultProposalFactory()
         self.proposal2 = DefaultProposalFactory(company=self.proposal1.company)
         self.index = current_app.config["ES_IMPORT_INDEX"]
@@ -72,3 +82,171 @@ class SearchIndexingProposal(DatabaseTest):
         cleanup_index()
         time.sleep(1)
         self.assertEqual(self.es_client.count(index=self.index)["count"], 1)
+
+    def test_cleanup_index_past_first_page(self, _):
+        # More documents than a search returns by default
+        for i in range(15):
+            self.proposal2.blocks.append(Block(BlockType.Section.value, data={'value': 'Part %d' % i}, ordering=10 + i))
+        db.session.commit()
+        ingest_proposals(ingest_all=True)
+        time.sleep(1)
+        self.assertEqual(self.es_client.count(index=self.index)["count"], 17)
+
+        db.session.delete(self.proposal2)
+        cleanup_index()
+        time.sleep(1)
+        self.assertEqual(self.es_client.count(index=self.index)["count"], 1)
+
+    def test_reindex(self, _):
+        reindex()
+        reindex()
+        time.sleep(1)
+        self.assertEqual(self.es_client.count(index=self.index)["count"], 2)
+        indices = list(self.es_client.indices.get_alias(name=self.index).keys())
+        self.assertEqual(len(indices), 1)
+        self.assertTrue(indices[0].startswith(self.index + "-"))
+
+    def test_reindex_edit_during_build(self, _):
+        from app.utils import search
+        set_checkpoint = search._set_checkpoint
+
+        def edit_then_set_checkpoint(client, index, proposal_id):
+            # After the proposals were read, before the alias is swapped
+            block = self.proposal1.blocks.filter(Block.type == BlockType.Section.value).first()
+            block.data = {"value": "Renamed during the build"}
+            db.session.commit()
+            self.assertEqual(index_dirty_proposals(), 0)
+            set_checkpoint(client, index, proposal_id)
+
+        with mock.patch("app.utils.search._set_checkpoint", side_effect=edit_then_set_checkpoint):
+            reindex()
+        time.sleep(1)
+
+        self.assertEqual(SearchDirtyProposal.query.count(), 0)
+        response = self.es_client.search(index=self.index, body={"query": {"match": {"title": "Renamed"}}})
+        self.assertEqual(response["hits"]["total"], 1)
+
+    def test_index_dirty_proposals(self, _):
+        db.session.commit()
+        self.assertGreater(index_dirty_proposals(), 0)
+        self.assertEqual(index_dirty_proposals(), 0)
+        time.sleep(1)
+        self.assertEqual(self.es_client.count(index=self.index)["count"], 2)
+
+        db.session.delete(self.proposal2)
+        db.session.commit()
+        self.assertEqual(index_dirty_proposals(), 1)
+        self.assertEqual(index_dirty_proposals(), 0)
+        time.sleep(1)
+        self.assertEqual(self.es_client.count(index=self.index)["count"], 1)
+
+
+class TestDirtyProposals(DatabaseTest):
+    def setUp(self):
+        super(TestDirtyProposals, self).setUp()
+        db.session.execute(text(DIRTY_TRIGGERS_SQL))
+        self.proposal = DefaultProposalFactory()
+        self.other = DefaultProposalFactory(company=self.proposal.company)
+        db.session.commit()
+        SearchDirtyProposal.query.delete()
+        db.session.commit()
+
+    def dirty(self):
+        return sorted(p for p, in db.session.query(SearchDirtyProposal.proposal_id))
+
+    def test_block_writes(self):
+        block = self.proposal.blocks.first()
+        block.data = {"value": "Edited"}
+        db.session.commit()
+        self.assertEqual(self.dirty(), [self.proposal.id])
+
+        # Once per transaction whatever the number of blocks
+        Block.bulk_detach(self.proposal.id, [b.uid for b in self.proposal.blocks])
+        db.session.commit()
+        self.assertEqual(self.dirty(), [self.proposal.id, self.proposal.id])
+
+    def test_block_moved(self):
+        block = self.proposal.blocks.first()
+        block.proposal_id = self.other.id
+        db.session.commit()
+        self.assertEqual(self.dirty(), sorted([self.proposal.id, self.other.id]))
+
+    def test_proposal_writes(self):
+        self.proposal.title = "Renamed"
+        db.session.commit()
+        db.session.delete(self.other)
+        db.session.commit()
+        self.assertEqual(self.dirty(), sorted([self.proposal.id, self.other.id]))
+
+
+class TestStreamActions(DatabaseTest):
+    def test_same_as_per_proposal(self):
+        proposal = DefaultProposalFactory()
+        other = DefaultProposalFactory(company=proposal.company)
+        proposal.blocks.append(Block(BlockType.Subtitle.value, data={'value': 'Pricing'}, ordering=2))
+        proposal.blocks.append(Block(BlockType.Paragraph.value, data={'value': 'Cheap'}, ordering=3))
+        db.session.commit()
+
+        proposals = Proposal.query.order_by(Proposal.id).all()
+        self.assertEqual(list(_stream_actions("index")), list(_index_actions("index", proposals)))
+        self.assertEqual(
+            [a["_source"]["proposal_id"] for a in _stream_actions("index", after_id=proposal.id)],
+            [other.id]
+        )
+
+
+def scroll_response(hits):
+    return {
+        "_scroll_id": "scroll",
+        "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+        "hits": {"total": len(hits), "hits": hits},
+    }
+
+
+class TestScanDeletes(DatabaseTest):
+    """
+    The scans of the deletes with the real client and elasticsearch-dsl,
+    only the HTTP calls are mocked
+    """
+    def setUp(self):
+        super(TestScanDeletes, self).setUp()
+        self.client = Elasticsearch(["127.0.0.1:1"])
+        self.client.scroll = mock.Mock(return_value=scroll_response([]))
+        self.client.clear_scroll = mock.Mock()
+        self.deleted = []
+
+        def bulk(client, actions, **kwargs):
+            self.deleted.extend(action["_id"] for action in actions)
+
+        for target, patch in [("get_client", {"return_value": self.client}), ("bulk", {"side_effect": bulk})]:
+            patcher = mock.patch("app.utils.search." + target, **patch)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.proposal = DefaultProposalFactory()
+        db.session.commit()
+
+    def hit(self, uid, proposal_id):
+        return {"_index": "proposals", "_type": "section", "_id": uid, "_source": {"proposal_id": proposal_id}}
+
+    def test_cleanup_index(self):
+        self.client.search = mock.Mock(return_value=scroll_response([
+            self.hit("kept", self.proposal.id), self.hit("stale", self.proposal.id + 1),
+        ]))
+
+        cleanup_index()
+
+        self.assertEqual(self.client.search.call_args[1]["body"]["_source"], ["proposal_id"])
+        self.assertEqual(self.deleted, ["stale"])
+
+    def test_delete_proposals_from_index(self):
+        self.client.search = mock.Mock(return_value=scroll_response([
+            {"_index": "proposals", "_type": "section", "_id": "section"},
+        ]))
+
+        _delete_proposals_from_index([self.proposal.id])
+
+        body = self.client.search.call_args[1]["body"]
+        self.assertIs(body["_source"], False)
+        self.assertEqual(body["query"]["bool"]["filter"], [{"terms": {"proposal_id": [self.proposal.id]}}])
+        self.assertEqual(self.deleted, ["section"])
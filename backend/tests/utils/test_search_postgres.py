@@ -0,0 +1,69 @@
+from app.setup import db
+from app.models.blocks import Block
+from app.models.enums import BlockType
+from app.models.search import SearchSection
+from app.utils.search_postgres import PostgresBackend, to_prefix_tsquery
+
+from tests.common import DatabaseTest
+from tests.factories._proposals import DefaultProposalFactory
+
+
+class TestPostgresBackend(DatabaseTest):
+    def setUp(self):
+        super(TestPostgresBackend, self).setUp()
+        self.backend = PostgresBackend()
+        self.proposal = DefaultProposalFactory()
+        self.proposal.blocks.append(Block(BlockType.Section.value, data={'value': 'Pricing'}, ordering=2))
+        self.proposal.blocks.append(Block(
+            BlockType.Paragraph.value, data={'value': 'Our daily rate is negotiable'}, ordering=3
+        ))
+        self.other_company = DefaultProposalFactory()
+        db.session.commit()
+        self.backend.reindex()
+
+    def test_to_prefix_tsquery(self):
+        self.assertEqual(to_prefix_tsquery("Daily  RATE!"), "daily:* | rate:*")
+        self.assertEqual(to_prefix_tsquery("&|!"), "")
+
+    def test_find_title(self):
+        hits = self.backend.find("pric", self.proposal.company_id, self.proposal.id)
+        self.assertEqual([h.title for h in hits], ["Pricing"])
+        self.assertEqual(hits[0].highlight["title"], ["<span class='search-highlight'>Pricing</span>"])
+        self.assertEqual(hits[0].level, "h1")
+        self.assertEqual(hits[0].proposal_title, self.proposal.title)
+
+    def test_find_content(self):
+        hits = self.backend.find("negotia", self.proposal.company_id, self.proposal.id)
+        self.assertEqual([h.title for h in hits], ["Pricing"])
+        self.assertNotIn("title", hits[0].highlight)
+        self.assertIn("<span class='search-highlight'>negotiable</span>", hits[0].highlight["content"][0])
+
+    def test_title_ranked_first(self):
+        hits = self.backend.find("introduction hello", self.proposal.company_id, self.proposal.id)
+        self.assertEqual(hits[0].title, "Introduction")
+
+    def test_other_company(self):
+        self.assertEqual(len(self.backend.find("hello", self.proposal.company_id, self.proposal.id)), 1)
+        self.assertEqual(self.backend.find("pricing", self.other_company.company_id, self.proposal.id), [])
+
+    def test_index_proposals(self):
+        block = self.proposal.blocks.filter(Block.ordering == 2).one()
+        block.data = {'value': 'Costs'}
+        db.session.commit()
+        self.backend.index_proposals([self.proposal.id])
+        self.assertEqual(self.backend.find("pricing", self.proposal.company_id, self.proposal.id), [])
+        self.assertEqual(len(self.backend.find("costs", self.proposal.company_id, self.proposal.id)), 1)
+
+        company_id = self.proposal.company_id
+        db.session.delete(self.proposal)
+        db.session.commit()
+        self.assertEqual(SearchSection.query.filter_by(company_id=company_id).count(), 0)
+
+    def test_reindex_by_batches(self):
+        SearchSection.query.delete()
+        db.session.commit()
+        self.backend.reindex(batch_size=1)
+        self.assertEqual(
+            sorted(set(s.proposal_id for s in SearchSection.query)),
+            sorted([self.proposal.id, self.other_company.id])
+        )
@@ -0,0 +1,55 @@
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from app.utils.slack_notifications import SlackDispatcher
+
+
+class StubSlack(BaseHTTPRequestHandler):
+    """Records the messages, answers with the status code in the path"""
+    messages = []  # type: list
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8")
+        self.messages.append(json.loads(body))
+        self.send_response(int(self.path.strip("/")))
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+class TestSlackDispatcher(unittest.TestCase):
+    def setUp(self):
+        StubSlack.messages = []
+        self.server = HTTPServer(("127.0.0.1", 0), StubSlack)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.dispatcher = SlackDispatcher(workers=2)
+
+    def url(self, status_code):
+        return "http://127.0.0.1:%d/%d" % (self.server.server_port, status_code)
+
+    def test_coalesce_views(self):
+        for _ in range(30):
+            self.dispatcher.post(1, self.url(200), {"text": "Bob has opened"}, coalesce_key=(1, "Bob"))
+        self.dispatcher.post(1, self.url(200), {"text": "Alice has opened"}, coalesce_key=(1, "Alice"))
+        self.dispatcher.post(1, self.url(200), {"text": "A comment has been posted"})
+        self.dispatcher.stop()
+
+        self.assertEqual(
+            sorted(m["text"] for m in StubSlack.messages),
+            ["A comment has been posted", "Alice has opened", "Bob has opened"]
+        )
+    def test_failures(self):
+        with self.assertLogs("app.utils.slack_notifications", "WARNING") as logs:
+            self.dispatcher.post(1, self.url(200), {"text": "signed"})
+            self.dispatcher.post(2, self.url(404), {"text": "signed"})
+            self.dispatcher.stop()
+
+        self.assertEqual(len(StubSlack.messages), 2)
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("integration 2", logs.output[0])
@@ -0,0 +1,121 @@
+from datetime import datetime, timedelta
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from app.setup import db
+from app.models.zapier import ZapierIntegration, ZapierHookEndpoint, ZapierTriggerEvent
+from app.utils.zapier import build_trigger, Dispatcher
+
+from tests.common import DatabaseTest
+from tests.factories._users import UserFactory
+
+
+class StubZapier(BaseHTTPRequestHandler):
+    """Answers with the status code in the path"""
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(int(self.path.strip("/")))
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestZapierTriggers(DatabaseTest):
+    def setUp(self):
+        super(TestZapierTriggers, self).setUp()
+        self.server = HTTPServer(("127.0.0.1", 0), StubZapier)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        self.user = UserFactory()
+        self.company = self.user.company
+        integration = ZapierIntegration(company_id=self.company.id)
+        db.session.add(integration)
+        db.session.commit()
+
+        self.endpoints = {}
+        for status_code in [200, 410, 500]:
+            self.endpoints[status_code] = self.add_endpoint(integration, status_code, "proposal_created")
+        self.add_endpoint(integration, 200, "proposal_published")
+        db.session.commit()
+        self.trigger = build_trigger("proposal_created")
+
+    def add_endpoint(self, integration, status_code, event):
+        endpoint = ZapierHookEndpoint(
+            company_id=self.company.id,
+            zapier_integration_id=integration.id,
+            target_url="http://127.0.0.1:%d/%d" % (self.server.server_port, status_code),
+            event=event,
+        )
+        db.session.add(endpoint)
+        return endpoint
+
+    def test_queued_in_transaction(self):
+        self.trigger(None, company=self.company, payload={"id": 1})
+        db.session.rollback()
+        self.assertEqual(ZapierTriggerEvent.query.count(), 0)
+
+        self.trigger(None, company=self.company, payload={"id": 1})
+        db.session.commit()
+        events = ZapierTriggerEvent.query.all()
+        self.assertEqual(len(events), 3)
+        self.assertTrue(all(e.data == {"id": 1} and e.event == "proposal_created" for e in events))
+
+    def test_dispatch(self):
+        gone_id = self.endpoints[410].id
+        self.trigger(None, company=self.company, payload={"id": 1})
+        db.session.commit()
+
+        self.assertEqual(Dispatcher(workers=2).dispatch(), 3)
+
+        events = dict((e.endpoint_id, e) for e in ZapierTriggerEvent.query.all())
+        # The endpoint is gone and its event with it
+        self.assertIsNone(ZapierHookEndpoint.query.get(gone_id))
+        self.assertEqual(len(events), 2)
+
+        delivered = events[self.endpoints[200].id]
+        self.assertIsNotNone(delivered.delivered_at)
+        self.assertEqual(delivered.post_event_log[0]["statusCode"], 200)
+
+        failed = events[self.endpoints[500].id]
+        self.assertIsNone(failed.delivered_at)
+        self.assertEqual(failed.attempts, 1)
+        self.assertGreater(failed.next_attempt_at, datetime.utcnow())
+
+        # Nothing due anymore
+        self.assertEqual(Dispatcher(workers=2).dispatch(), 0)
+
+    def test_rate_limit(self):
+        for i in range(3):
+            self.trigger(None, company=self.company, payload={"id": i})
+        db.session.commit()
+
+        # Only 2 posts per endpoint, the others are moved back in the queue
+        dispatcher = Dispatcher(workers=2, rate=0.1, burst=2)
+        self.assertEqual(dispatcher.dispatch(), 6)
+        throttled = ZapierTriggerEvent.query\
+            .filter(ZapierTriggerEvent.attempts == 0, ZapierTriggerEvent.delivered_at == None)\
+            .count()
+        self.assertEqual(throttled, 2)
+
+    def test_prune(self):
+        self.trigger(None, company=self.company, payload={"id": 1})
+        db.session.commit()
+        dispatcher = Dispatcher(workers=2, max_attempts=1)
+        dispatcher.dispatch()
+
+        # Still in the retention
+        self.assertEqual(dispatcher.prune(), 0)
+
+        old = datetime.utcnow() - timedelta(days=8)
+        ZapierTriggerEvent.query.update({"created_at": old}, synchronize_session=False)
+        ZapierTriggerEvent.query\
+            .filter(ZapierTriggerEvent.delivered_at != None)\
+            .update({"delivered_at": old}, synchronize_session=False)
+        db.session.commit()
+
+        # The delivered one and the failed one as it was its only attempt
+        self.assertEqual(dispatcher.prune(), 2)
+        self.assertEqual(ZapierTriggerEvent.query.count(), 0)
@@ -47,13 +47,34 @@ function findActiveSection(): string | null {
   return activeBlock;
 }
 
+// The page is rendered by then but the blocks images, cover image and
+// web fonts can still be loading
+function whenImagesAndFontsLoaded(): Promise<any> {
+  const images = Array.prototype.slice.call(document.images).map((img: HTMLImageElement) => {
+    if (img.complete) {
+      return Promise.resolve();
+    }
+    return new Promise(resolve => {
+      img.addEventListener("load", resolve);
+      img.addEventListener("error", resolve);
+    });
+  });
+  const fonts = (document as any).fonts;
+  return Promise.all(images.concat(fonts ? [fonts.ready] : []));
+}
+
 @observer
 export class ShareRoute extends React.Component<{}, {}> {
   componentDidMount() {
     document.title = `${rootStore.companyStore.us.name} - ${unescape(rootStore.sharedStore.proposal.title)}`;
     brandProposal(rootStore.companyStore.us.branding);
     setAnonUid();
-    rootStore.sharedStore.sendLoadEvent();
+    // Set by the preload script of the PDF renderer, the renders are not
+    // views of the proposal
+    const pdfReady = (window as any).proppyPdfReady;
+    if (!pdfReady) {
+      rootStore.sharedStore.sendLoadEvent();
+    }
 
     document.onclick = (e: any) => {
       e = e || window.event;
@@ -71,9 +92,16 @@ export class ShareRoute extends React.Component<{}, {}> {
       (anchor[0] as any).scrollIntoView();
     }
 
-    setInterval(() => {
-      rootStore.sharedStore.sendPingEvent(findActiveSection());
-    }, 15000);
+    if (pdfReady) {
+      // Tells the renderer to wait for proppyPdfReady rather than printing
+      // as soon as the page is displayed, then that the page can be printed
+      (window as any).proppyPdfWaiting = true;
+      whenImagesAndFontsLoaded().then(() => pdfReady());
+    } else {
+      setInterval(() => {
+        rootStore.sharedStore.sendPingEvent(findActiveSection());
+      }, 15000);
+    }
   }
 
   componentWillUnmount() {
@@ -1,13 +1,28 @@
 const electron = require('electron')
+const net = require('net')
+const fs = require('fs')
 const path = require('path')
 var ipc = require('electron').ipcMain;
 
 let mainWindow
 const BrowserWindow = electron.BrowserWindow
 const app = electron.app
-const url = process.argv[process.argv.length - 1];
 console.error("Called with: ", process.argv);
 
+// `electron . --serve <socket path>` keeps running and renders the urls
+// sent on the socket, otherwise renders the url given as last argument
+const serveIndex = process.argv.indexOf("--serve");
+const socketPath = serveIndex > -1 ? process.argv[serveIndex + 1] : null;
+const url = process.argv[process.argv.length - 1];
+
+// Number of windows kept loaded in serve mode
+const WINDOWS = parseInt(process.env.PDF_WINDOWS || "2", 10);
+// Loaded in the windows when idle so the bundle is in cache
+const WARM_URL = process.env.PDF_WARM_URL || "https://app.proppy.io/";
+// Pages that don't set proppyPdfWaiting (older frontend) are printed once
+// this returns, same as the one-shot mode
+const RENDER_TIMEOUT = 60000;
+
 const waitLoadedJS = `
 new Promise(resolve => {
   function waitLoaded() {
@@ -24,10 +39,29 @@ new Promise(resolve => {
 });
 `;
 
+// Serve mode: resolves to "waiting" as soon as the page says it calls
+// proppyPdfReady itself, falls back to waitLoadedJS for the others
+const waitDisplayedJS = `
+new Promise(resolve => {
+  function waitDisplayed() {
+    if (window.proppyPdfWaiting) {
+      resolve("waiting");
+    } else if (window.document.getElementsByClassName('icon-print').length > 0) {
+      setTimeout(() => { resolve(window.proppyPdfWaiting ? "waiting" : "ok"); }, 1000);
+    } else {
+      setTimeout(() => { waitDisplayed(); }, 100);
+    }
+  }
+  waitDisplayed();
+});
+`;
+
 function createWindow() {
   mainWindow = new BrowserWindow({
     width: 1024, height: 600,
     webSecurity: false,
+    // Only to not count the render as a view, waitLoadedJS decides when to print
+    webPreferences: {preload: path.join(__dirname, "preload.js")},
   })
   mainWindow.loadURL(url)
 
@@ -54,12 +88,142 @@ function createWindow() {
   }, 120000);
 }
 
+// Serve mode
+
+const idleWindows = [];
+const jobs = [];
+
+function createRenderWindow() {
+  const win = new BrowserWindow({
+    width: 1024, height: 600, show: false,
+    webSecurity: false,
+    webPreferences: {preload: path.join(__dirname, "preload.js")},
+  });
+  win.loadURL(WARM_URL);
+  return win;
+}
+
+function renderInWindow(win, job, done) {
+  let finished = false;
+  const contents = win.webContents;
+
+  function cleanup() {
+    finished = true;
+    clearTimeout(timeout);
+    ipc.removeListener("pdf-ready", onReady);
+    contents.removeListener("did-finish-load", onLoad);
+    contents.removeListener("did-fail-load", onFail);
+  }
+
+  function print() {
+    if (finished) return;
+    cleanup();
+    contents.printToPDF({}, (err, data) => {
+      if (err) {
+        done(win, {id: job.id, ok: false, error: String(err)});
+      } else {
+        done(win, {id: job.id, ok: true, pdf: data.toString("base64")});
+      }
+    });
+  }
+
+  function onReady(event) {
+    if (event.sender === contents) print();
+  }
+
+  function onLoad() {
+    contents.executeJavaScript(waitDisplayedJS, (result) => {
+      // Pages waiting for their images and fonts call proppyPdfReady
+      if (result !== "waiting") print();
+    });
+  }
+
+  function onFail(event, code, message) {
+    // -3 is the warm page load aborted by ours
+    if (finished || code === -3) return;
+    cleanup();
+    done(win, {id: job.id, ok: false, error: "load failed: " + code + " " + message});
+  }
+
+  const timeout = setTimeout(() => {
+    if (finished) return;
+    cleanup();
+    // Something is stuck in there, start from a new window
+    win.destroy();
+    done(createRenderWindow(), {id: job.id, ok: false, error: "render timeout"});
+  }, RENDER_TIMEOUT);
+
+  ipc.on("pdf-ready", onReady);
+  contents.on("did-finish-load", onLoad);
+  contents.on("did-fail-load", onFail);
+  contents.loadURL(job.url);
+}
+
+function schedule() {
+  while (idleWindows.length > 0 && jobs.length > 0) {
+    const win = idleWindows.shift();
+    const job = jobs.shift();
+    renderInWindow(win, job, (win, result) => {
+      job.reply(result);
+      // Leave the share page: nothing of it keeps running while idle
+      win.webContents.loadURL("about:blank");
+      idleWindows.push(win);
+      schedule();
+    });
+  }
+}
+
+function serve() {
+  for (let i = 0; i < WINDOWS; i++) {
+    idleWindows.push(createRenderWindow());
+  }
+
+  if (fs.existsSync(socketPath)) fs.unlinkSync(socketPath);
+
+  // One JSON job per line: {"id": ..., "url": ...}, answered with one JSON
+  // line: {"id": ..., "ok": true, "pdf": <base64>} or {"id": ..., "ok": false, "error": ...}
+  const server = net.createServer((socket) => {
+    let buffer = "";
+    socket.on("data", (chunk) => {
+      buffer += chunk.toString("utf8");
+      let newline;
+      while ((newline = buffer.indexOf("\n")) > -1) {
+        const line = buffer.slice(0, newline);
+        buffer = buffer.slice(newline + 1);
+        let job;
+        try {
+          job = JSON.parse(line);
+        } catch (e) {
+          socket.write(JSON.stringify({ok: false, error: "invalid job"}) + "\n");
+          continue;
+        }
+        job.reply = (result) => {
+          if (!socket.destroyed) socket.write(JSON.stringify(result) + "\n");
+        };
+        jobs.push(job);
+      }
+      schedule();
+    });
+    socket.on("error", (err) => console.error("socket error", err));
+  });
+
+  server.listen(socketPath, () => {
+    // renderer.py waits for this line before sending jobs
+    console.log("ready");
+  });
+}
+
 ipc.on('invokeAction', function(event, data) {
   console.error("invokeAction", event, data);
 });
 
-app.on('ready', createWindow)
+// Keep running when windows are destroyed in serve mode
+app.on('window-all-closed', () => {
+  if (!socketPath) app.quit();
+});
+
+app.on('ready', socketPath ? serve : createWindow)
 
 app.on('activate', function () {
-  createWindow()
+  if (!socketPath) createWindow()
 })
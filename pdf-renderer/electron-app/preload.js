@@ -0,0 +1,6 @@
+// Lets the page tell us when it is ready to be printed, see ShareRoute.tsx
+const ipcRenderer = require('electron').ipcRenderer;
+
+window.proppyPdfReady = function() {
+  ipcRenderer.send('pdf-ready');
+};
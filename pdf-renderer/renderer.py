@@ -4,19 +4,54 @@ This script renders PDFs for proppy shared proposals.
 Assumptions:
 * docker running on machine
 * working directory is cache directory where rendered PDFs are stored
+* run as a single process with threads (eg gunicorn --threads): the render
+  queue lives in memory so that concurrent requests for the same PDF share
+  one render
+
+Renders go through two lanes: user downloads and pre-renders asked by the
+backend when a proposal is shared or signed. Each lane has its own workers
+so pre-renders never hold up a download.
+
+Rendered PDFs are kept in a cache bounded in bytes, see `PdfCache`.
 """
+import base64
+import hashlib
+import json
 import logging
 import logging.handlers
 import os
+import queue
 import re
 import flask
+import shutil
+import socket
+import sqlite3
 import subprocess
 import tempfile
+import threading
+import time
 
 from raven.contrib.flask import Sentry
 
 HOME = os.path.expanduser("/var/lib/pdf-render-cache/")
 
+# Number of renders running at the same time per lane
+USER_WORKERS = int(os.environ.get("PDF_USER_WORKERS", 2))
+PRERENDER_WORKERS = int(os.environ.get("PDF_PRERENDER_WORKERS", 1))
+# How long a download waits for its render before giving up
+RENDER_TIMEOUT = int(os.environ.get("PDF_RENDER_TIMEOUT", 120))
+# How long the status of a finished render, failed or not, is kept
+JOB_TTL = int(os.environ.get("PDF_JOB_TTL", 600))
+# Keep one electron running per worker instead of starting one per PDF
+PERSISTENT_ELECTRON = os.environ.get("PDF_PERSISTENT_ELECTRON", "1") == "1"
+# Size of the cache, least recently served PDFs are deleted past it
+CACHE_MAX_BYTES = int(os.environ.get("PDF_CACHE_MAX_BYTES", 5 * 1024 ** 3))
+# PDFs not served for that long are deleted even if there is room
+CACHE_MAX_AGE = int(os.environ.get("PDF_CACHE_MAX_AGE", 90 * 24 * 3600))
+
+USER = "user"
+PRERENDER = "prerender"
+
 app = flask.Flask(__name__)
 sentry = Sentry(app, dsn=os.environ['SENTRY_DSN'])
 app.debug = True
@@ -24,42 +59,449 @@ app.debug = True
 logging.basicConfig(level=logging.INFO)
 logging.getLogger().addHandler(logging.handlers.SysLogHandler(address='/run/systemd/journal/dev-log'))
 
+def share_url(share_id, version):
+    return "https://app.proppy.io/p/{}/{}".format(share_id, version)
+
 def command(share_id, version, log_path):
     return [
         "xvfb-run", "-a", "-e", log_path, "--", "electron", ".",
-        "https://app.proppy.io/p/{}/{}".format(share_id, version),
+        share_url(share_id, version),
     ]
 
 def cache_name(share_id, version, signed):
     return '{}-{}-{}'.format(share_id, version, signed)
 
-@app.route("/api/render-pdf/<path:share_id>/<int:version>/<signed>")
-def render(share_id, version, signed):
-    assert re.match('^[A-Z0-9]{9}$', share_id), "invalid share_id"
-    assert signed in ['u', 's'], "signed must be 'u' or 's'"
+CACHE_NAME_RE = re.compile(r"^[A-Z0-9]{9}-\d+-[us]$")
+# Written by `PdfCache.put` before being renamed to the cache name
+TMP_NAME_RE = re.compile(r"^\.[A-Z0-9]{9}-\d+-[us]\.")
 
-    title = flask.request.args.get("title", "Untitled")
+class ElectronProcess(object):
+    """
+    An electron started with `--serve`: it keeps its windows loaded and
+    renders the urls sent on a unix socket, see electron-app/main.js.
+    Restarted on the next render if anything goes wrong.
+    """
+    def __init__(self, log_path):
+        self.log_path = log_path
+        self.process = None
+        self.conn = None
+        self.socket_dir = None
 
-    cached_name = cache_name(share_id, version, signed)
-    out_path = os.path.join(HOME, cached_name)
+    def start(self):
+        self.socket_dir = tempfile.mkdtemp()
+        socket_path = os.path.join(self.socket_dir, "electron.sock")
+        self.process = subprocess.Popen(
+            ["xvfb-run", "-a", "-e", self.log_path, "--", "electron", ".", "--serve", socket_path],
+            stdout=subprocess.PIPE,
+        )
+        # Printed once the windows are created and the socket listening
+        for line in self.process.stdout:
+            if line.strip() == b"ready":
+                break
+        else:
+            raise RuntimeError("electron exited before being ready")
+        # Keeps reading its output so that electron never blocks on a full pipe
+        threading.Thread(target=self._log_output, args=(self.process.stdout, ), daemon=True).start()
 
-    logging.info("Request for  %s", cached_name)
-    send = lambda: flask.send_file(out_path, attachment_filename="{}.pdf".format(title), as_attachment=True)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(RENDER_TIMEOUT)
+        sock.connect(socket_path)
+        self.conn = sock.makefile("rwb")
+
+    def _log_output(self, stdout):
+        for line in stdout:
+            logging.debug("electron: %s", line.rstrip())
+        stdout.close()
+
+    def stop(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+        if self.socket_dir is not None:
+            shutil.rmtree(self.socket_dir, ignore_errors=True)
+            self.socket_dir = None
+
+    def render(self, url):
+        if self.process is None or self.process.poll() is not None:
+            self.stop()
+            self.start()
+        try:
+            self.conn.write(json.dumps({"id": url, "url": url}).encode("utf-8") + b"\n")
+            self.conn.flush()
+            result = json.loads(self.conn.readline().decode("utf-8"))
+        except Exception:
+            self.stop()
+            raise
+        if not result["ok"]:
+            raise RuntimeError(result["error"])
+        return base64.b64decode(result["pdf"])
 
-    if os.path.exists(out_path):
-        logging.info("Serving from cache  %s", out_path)
-        return send()
 
-    c = command(share_id, version, "{}.log".format(out_path))
-    logging.info("Rendering  %s", cached_name)
+# One electron per render worker thread
+electrons = threading.local()
+
+def render_pdf(share_id, version, signed):
+    """Returns the content of the PDF"""
+    if PERSISTENT_ELECTRON:
+        if not hasattr(electrons, "process"):
+            name = threading.current_thread().name
+            electrons.process = ElectronProcess(os.path.join(HOME, "logs", "{}.log".format(name)))
+        return electrons.process.render(share_url(share_id, version))
+
+    log_path = os.path.join(HOME, "logs", "{}.log".format(cache_name(share_id, version, signed)))
+    c = command(share_id, version, log_path)
     logging.info("  %s: calling ", c)
     logging.info("  %s: pwd ", os.getcwd())
 
     # xvfb sometimes doesn't clean up its lock file so we run in a
     # temp dir that's always deleted.
-    out = subprocess.check_output(c)
+    return subprocess.check_output(c)
+
+
+class PdfCache(object):
+    """
+    PDFs are written to a temporary file renamed once complete, so a
+    crash mid-write never leaves a truncated PDF to be served.
+
+    An sqlite index next to the files keeps their size, etag (sha256 of
+    the content) and last access: stats and eviction never list the
+    directory.
+    """
+    def __init__(self, directory, max_bytes, max_age):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.join(directory, "logs"), exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(directory, "index.sqlite"), check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS pdfs (
+                key TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                etag TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS pdfs_accessed_at ON pdfs (accessed_at)")
+        self.db.commit()
+        self._remove_leftovers()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _remove_leftovers(self):
+        """
+        Removes the temporary files of renders interrupted by a crash and
+        adds the complete PDFs cached before the index existed to it
+        """
+        indexed = set(key for key, in self.db.execute("SELECT key FROM pdfs"))
+        for name in os.listdir(self.directory):
+            path = self._path(name)
+            if TMP_NAME_RE.match(name):
+                logging.info("Removing temporary cache file %s", name)
+                os.remove(path)
+            elif CACHE_NAME_RE.match(name) and name not in indexed:
+                self._adopt(name)
+        self.db.commit()
+
+    def _adopt(self, key):
+        size = os.path.getsize(self._path(key))
+        etag = hashlib.sha256()
+        with open(self._path(key), "rb") as f:
+            start = f.read(5)
+            f.seek(max(0, size - 1024))
+            end = f.read()
+            f.seek(0)
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                etag.update(chunk)
+        # Truncated by a crash mid-write, the renderer didn't write them atomically then
+        if start != b"%PDF-" or b"%%EOF" not in end:
+            logging.info("Removing incomplete cache file %s", key)
+            os.remove(self._path(key))
+            return
+        mtime = os.path.getmtime(self._path(key))
+        self.db.execute(
+            "INSERT INTO pdfs (key, size, etag, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (key, size, etag.hexdigest(), mtime, mtime)
+        )
+
+    def get(self, key):
+        """Path and etag of the cached PDF or None"""
+        with self.lock:
+            row = self.db.execute("SELECT etag FROM pdfs WHERE key = ?", (key, )).fetchone()
+            if row is None or not os.path.exists(self._path(key)):
+                if row is not None:
+                    self.db.execute("DELETE FROM pdfs WHERE key = ?", (key, ))
+                    self.db.commit()
+                self.misses += 1
+                return None
+            self.db.execute("UPDATE pdfs SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self.db.commit()
+            self.hits += 1
+            return self._path(key), row[0]
+
+    def __contains__(self, key):
+        with self.lock:
+            row = self.db.execute("SELECT 1 FROM pdfs WHERE key = ?", (key, )).fetchone()
+        return row is not None
+
+    def put(self, key, content):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".{}.".format(key))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp_path, self._path(key))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO pdfs (key, size, etag, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, len(content), hashlib.sha256(content).hexdigest(), now, now)
+            )
+            self.db.commit()
+            self._evict(keep=key)
+
+    def _evict(self, keep):
+        """
+        Oldest accessed first until under the budget, `keep` stays whatever
+        its size. Called with the lock held
+        """
+        expired = []
+        over = -self.max_bytes
+        min_accessed_at = time.time() - self.max_age
+        for key, size, accessed_at in self.db.execute("SELECT key, size, accessed_at FROM pdfs ORDER BY accessed_at DESC"):
+            over += size
+            if key != keep and accessed_at < min_accessed_at:
+                expired.append((key, size))
+                over -= size
+        for key, size in self.db.execute("SELECT key, size FROM pdfs ORDER BY accessed_at"):
+            if over <= 0:
+                break
+            if key != keep and (key, size) not in expired:
+                expired.append((key, size))
+                over -= size
+
+        for key, _ in expired:
+            logging.info("Evicting %s from the cache", key)
+            self.db.execute("DELETE FROM pdfs WHERE key = ?", (key, ))
+            if os.path.exists(self._path(key)):
+                os.remove(self._path(key))
+        self.db.commit()
+        self.evicted += len(expired)
+
+    def stats(self):
+        with self.lock:
+            count, size = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pdfs").fetchone()
+            return {
+                "count": count,
+                "bytes": size,
+                "maxBytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evicted": self.evicted,
+            }
+
+
+cache = PdfCache(HOME, CACHE_MAX_BYTES, CACHE_MAX_AGE)
+
+
+class Job(object):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, share_id, version, signed):
+        self.share_id = share_id
+        self.version = version
+        self.signed = signed
+        self.key = cache_name(share_id, version, signed)
+        self.status = Job.QUEUED
+        self.error = None
+        self.finished = threading.Event()
+        self.finished_at = None
+
+    def to_json(self):
+        return {"key": self.key, "status": self.status, "error": self.error}
+
+
+class RenderQueue(object):
+    """
+    Jobs are deduplicated by cache key while they are queued or running: a
+    second request for the same PDF waits on the job already there.
+    A user download of a PDF waiting in the pre-render lane is added to the
+    user lane as well and ran by whichever lane gets to it first.
+    Finished jobs are kept `JOB_TTL` seconds for their status, submitting
+    the PDF again renders it again.
+    """
+    def __init__(self, workers):
+        self.workers = workers
+        self.lanes = dict((lane, queue.Queue()) for lane in workers)
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def _ensure_started(self):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            for lane, count in self.workers.items():
+                for i in range(count):
+                    name = "render-{}-{}".format(lane, i)
+                    threading.Thread(target=self._run, args=(self.lanes[lane], ), name=name, daemon=True).start()
+            self.pid = os.getpid()
+
+    def _expire(self):
+        expired = time.monotonic() - JOB_TTL
+        for key, job in list(self.jobs.items()):
+            if job.finished_at is not None and job.finished_at < expired:
+                del self.jobs[key]
+
+    def submit(self, share_id, version, signed, lane=USER):
+        self._ensure_started()
+        key = cache_name(share_id, version, signed)
+        with self.lock:
+            self._expire()
+            job = self.jobs.get(key)
+            if job is None or job.finished.is_set():
+                job = Job(share_id, version, signed)
+                self.jobs[key] = job
+                self.lanes[lane].put(job)
+            elif lane == USER and job.status == Job.QUEUED:
+                self.lanes[USER].put(job)
+        return job
+
+    def get(self, key):
+        with self.lock:
+            self._expire()
+            return self.jobs.get(key)
+
+    def _run(self, lane):
+        while True:
+            job = lane.get()
+            with self.lock:
+                # Already taken by the other lane
+                if job.status != Job.QUEUED:
+                    continue
+                job.status = Job.RUNNING
+
+            logging.info("Rendering  %s", job.key)
+            try:
+                cache.put(job.key, render_pdf(job.share_id, job.version, job.signed))
+                job.status = Job.DONE
+            except Exception as e:
+                logging.exception("Rendering %s failed", job.key)
+                job.status = Job.FAILED
+                job.error = str(e)
+            finally:
+                with self.lock:
+                    job.finished_at = time.monotonic()
+                job.finished.set()
+
+
+render_queue = RenderQueue({USER: USER_WORKERS, PRERENDER: PRERENDER_WORKERS})
+
+
+def validate(share_id, signed):
+    assert re.match('^[A-Z0-9]{9}$', share_id), "invalid share_id"
+    assert signed in ['u', 's'], "signed must be 'u' or 's'"
+
+
+@app.route("/api/render-pdf/<path:share_id>/<int:version>/<signed>")
+def render(share_id, version, signed):
+    """
+    Download of the PDF, waits for it to be rendered if needed
+    """
+    validate(share_id, signed)
+
+    title = flask.request.args.get("title", "Untitled")
+
+    cached_name = cache_name(share_id, version, signed)
+    logging.info("Request for  %s", cached_name)
+
+    cached = cache.get(cached_name)
+    if cached is None:
+        job = render_queue.submit(share_id, version, signed, USER)
+        if not job.finished.wait(RENDER_TIMEOUT):
+            return flask.jsonify(job.to_json()), 504
+        if job.status == Job.FAILED:
+            return flask.jsonify(job.to_json()), 500
+        cached = cache.get(cached_name)
+        if cached is None:
+            # Evicted right away, only if the cache is tiny
+            return flask.jsonify(job.to_json()), 500
+    else:
+        logging.info("Serving from cache  %s", cached_name)
+
+    path, etag = cached
+    # Sent with sendfile through the wsgi file wrapper
+    response = flask.send_file(
+        path, attachment_filename="{}.pdf".format(title), as_attachment=True,
+        mimetype="application/pdf", add_etags=False, conditional=False,
+    )
+    response.set_etag(etag)
+    return response.make_conditional(flask.request)
+
+
+@app.route("/api/render-pdf/<path:share_id>/<int:version>/<signed>/jobs", methods=["POST"])
+def submit(share_id, version, signed):
+    """
+    Queues a render without waiting for it, `?priority=prerender` for the
+    renders nobody is waiting for
+    """
+    validate(share_id, signed)
+    lane = PRERENDER if flask.request.args.get("priority") == PRERENDER else USER
+
+    cached_name = cache_name(share_id, version, signed)
+    if cached_name in cache:
+        return flask.jsonify({"key": cached_name, "status": Job.DONE, "error": None})
+
+    job = render_queue.submit(share_id, version, signed, lane)
+    return flask.jsonify(job.to_json()), 202
+
+
+@app.route("/api/render-pdf/<path:share_id>/<int:version>/<signed>/status")
+def status(share_id, version, signed):
+    """
+    Status of the render, `?wait=<seconds>` waits for it to finish
+    """
+    validate(share_id, signed)
+
+    cached_name = cache_name(share_id, version, signed)
+    try:
+        wait = min(int(flask.request.args.get("wait", 0)), RENDER_TIMEOUT)
+    except ValueError:
+        return flask.jsonify({"key": cached_name, "status": None, "error": "wait must be a number of seconds"}), 400
+
+    job = render_queue.get(cached_name)
+    if job is not None:
+        if wait > 0:
+            job.finished.wait(wait)
+        if job.status != Job.DONE:
+            return flask.jsonify(job.to_json())
+
+    if cached_name in cache:
+        return flask.jsonify({"key": cached_name, "status": Job.DONE, "error": None})
+    return flask.jsonify({"key": cached_name, "status": None, "error": None}), 404
 
-    with open(os.path.join(out_path), 'wb') as f:
-        f.write(out)
 
-    return send()
+@app.route("/api/render-pdf/cache")
+def cache_stats():
+    return flask.jsonify(cache.stats())
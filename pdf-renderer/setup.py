@@ -6,5 +6,5 @@ setup(
     author='We Are Wizards',
     author_email='team@wearewizards.io',
     py_modules=['renderer'],
-    data_files=[('electron-app', ['electron-app/main.js', 'electron-app/package.json'])],
+    data_files=[('electron-app', ['electron-app/main.js', 'electron-app/preload.js', 'electron-app/package.json'])],
 )